@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# file: bulk_utils.py
+
+import time
+
+# number of operations sent in one bulk_write
+BULK_BATCH_SIZE = 1000
+
+
+class BulkWriter:
+    '''
+    Buffer writes to a collection and send them by batches of batch_size
+    as an unordered bulk_write
+    - write errors (duplicate keys, validation...) are collected per row
+    instead of stopping the import
+    - report() prints counts and throughput
+    - on_flush(rows) is called after each batch acknowledged by mongo (see import_jobs)
+    - duplicate _id errors are reported as any other error, unless duplicates_ok:
+    a resumed import rewrites the rows written after its last checkpoint
+    Used as a context manager, pending operations are flushed and reported on exit
+    '''
+
+    def __init__(self, collection, batch_size=BULK_BATCH_SIZE, name=None, on_flush=None, duplicates_ok=False):
+        self.collection = collection
+        self.on_flush = on_flush
+        self.duplicates_ok = duplicates_ok
+        self.batch_size = batch_size
+        self.name = name or collection.name
+        self.operations = []
+        self.rows = []
+        self.errors = []
+        self.nb_rows = 0
+        self.inserted = 0
+        self.upserted = 0
+        self.modified = 0
+        self.start = time.perf_counter()
+
+    def insert(self, doc, row=None):
+        from pymongo import InsertOne
+        self.add(InsertOne(doc), row)
+
+    def add(self, operation, row=None):
+        '''queue a pymongo write operation, row identifies it in errors (default: row number)'''
+        self.nb_rows += 1
+        self.operations.append(operation)
+        self.rows.append(row if row is not None else self.nb_rows)
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.operations) == 0:
+            return
+        from pymongo.errors import BulkWriteError
+        try:
+            details = self.collection.bulk_write(self.operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details["writeErrors"]:
+                self.errors.append({
+                    "row": self.rows[error["index"]],
+                    "code": error["code"],
+                    "message": error["errmsg"],
+                })
+        self.inserted += details["nInserted"]
+        self.upserted += details["nUpserted"]
+        self.modified += details["nModified"]
+        rows = self.rows
+        self.operations = []
+        self.rows = []
+        if self.on_flush is not None:
+            self.on_flush(rows)
+
+    def is_rewrite(self, error):
+        '''duplicate _id of a row already written by an interrupted run'''
+        return self.duplicates_ok and error["code"] == 11000 and " index: _id_ " in error["message"]
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "collection": self.name,
+            "rows": self.nb_rows,
+            "inserted": self.inserted,
+            "upserted": self.upserted,
+            "modified": self.modified,
+            "errors": len(self.errors),
+            "duplicates": len([e for e in self.errors if e["code"] == 11000]),
+            "rewritten": len([e for e in self.errors if self.is_rewrite(e)]),
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(self.nb_rows / elapsed, 1) if elapsed > 0 else 0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            f"{stats['collection']}: {stats['rows']} rows, {stats['inserted']} inserted, "
+            f"{stats['upserted']} upserted, {stats['modified']} modified, "
+            f"{stats['errors']} errors ({stats['duplicates']} duplicates, "
+            f"{stats['rewritten']} already written) "
+            f"in {stats['seconds']}s ({stats['rows_per_second']} rows/s)"
+        )
+        for error in self.errors:
+            if not self.is_rewrite(error):
+                print(f"Error row {error['row']}: {error['message']}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+            self.report()
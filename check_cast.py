@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# file: check_cast.py
+
+import sys
+import time
+import argparse
+from csv import DictReader
+
+from utils import chunked, is_multilang_model
+from db_import_utils import cast_model_rows, cast_model_rows_by_row, TRANSLATION_CHUNK_SIZE
+
+
+def compare_cast(model, rows, lang="fr", chunk_size=TRANSLATION_CHUNK_SIZE):
+    '''
+    cast rows with the columnar and the cell by cell paths
+    returns the differences [(row number, field, columnar value, row value)] and the time of each path
+    '''
+    multilang = is_multilang_model(model)
+    differences = []
+    timings = {"columnar": 0.0, "by_row": 0.0}
+    offset = 0
+    for chunk in chunked(rows, chunk_size):
+        start = time.perf_counter()
+        columnar = cast_model_rows(model, lang, chunk, multilang)
+        timings["columnar"] += time.perf_counter() - start
+        start = time.perf_counter()
+        by_row = cast_model_rows_by_row(model, lang, chunk, multilang)
+        timings["by_row"] += time.perf_counter() - start
+        for i, (doc, expected) in enumerate(zip(columnar, by_row)):
+            if multilang:
+                doc, expected = doc[lang], expected[lang]
+            for field in expected:
+                if doc.get(field) != expected[field] or type(doc.get(field)) != type(expected[field]):
+                    differences.append((offset + i, field, doc.get(field), expected[field]))
+        offset += len(chunk)
+    return differences, timings
+
+
+parser = argparse.ArgumentParser(description="Check that columnar and cell by cell csv casts give the same docs")
+parser.add_argument("model")
+parser.add_argument("csv_file")
+parser.add_argument("--lang", default="fr", choices=["fr", "en"])
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.csv_file, "r") as f:
+        rows = list(DictReader(f, delimiter=","))
+    differences, timings = compare_cast(args.model, rows, args.lang)
+    print(
+        f"{len(rows)} rows: columnar {timings['columnar']:.3f}s, "
+        f"cell by cell {timings['by_row']:.3f}s"
+    )
+    for row_nb, field, value, expected in differences[:20]:
+        print(f"row {row_nb} {field}: {value!r} != {expected!r}")
+    if len(differences) > 0:
+        print(f"Error: {len(differences)} differences")
+        sys.exit(1)
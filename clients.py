@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# file: clients.py
+
+import os
+
+DATABASE_NAME = "GD4H_V2"
+MONGODB_URL = "mongodb://localhost:27017"
+ELASTICSEARCH_URL = "http://localhost:9200"
+# search engine: "elasticsearch" or "local" (pure python index files in SEARCH_DIR, see search_backend)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "elasticsearch")
+SEARCH_DIR = os.environ.get(
+    "SEARCH_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "search")
+)
+
+# clients and translators are created on first use, not at import time
+CLIENTS = {}
+
+
+def get_mongodb_client():
+    if "mongodb" not in CLIENTS:
+        from pymongo import MongoClient
+        CLIENTS["mongodb"] = MongoClient(MONGODB_URL)
+    return CLIENTS["mongodb"]
+
+
+def get_db():
+    return get_mongodb_client()[DATABASE_NAME]
+
+
+def get_es():
+    if "es" not in CLIENTS:
+        from elasticsearch7 import Elasticsearch
+        CLIENTS["es"] = Elasticsearch(ELASTICSEARCH_URL)
+    return CLIENTS["es"]
+
+
+def get_search():
+    '''search backend of SEARCH_BACKEND'''
+    if "search" not in CLIENTS:
+        from search_backend import ElasticsearchBackend, get_backend
+        if SEARCH_BACKEND == "elasticsearch":
+            CLIENTS["search"] = ElasticsearchBackend(client=get_es())
+        else:
+            CLIENTS["search"] = get_backend(SEARCH_BACKEND, directory=SEARCH_DIR)
+    return CLIENTS["search"]
+
+
+def get_translator(_from="fr"):
+    '''get argos translation fr_en (_from="fr") or en_fr (_from="en")'''
+    key = "fr_en" if _from == "fr" else "en_fr"
+    if key not in CLIENTS:
+        from argostranslate import translate
+        installed_languages = translate.get_installed_languages()
+        if _from == "fr":
+            CLIENTS[key] = installed_languages[1].get_translation(installed_languages[0])
+        else:
+            CLIENTS[key] = installed_languages[0].get_translation(installed_languages[1])
+    return CLIENTS[key]
+
+
+def get_model_version(direction):
+    '''get installed argos package version for direction "fr_en" or "en_fr"'''
+    if "model_versions" not in CLIENTS:
+        from argostranslate import package
+        CLIENTS["model_versions"] = {
+            f"{p.from_code}_{p.to_code}": str(getattr(p, "package_version", ""))
+            for p in package.get_installed_packages()
+        }
+    return CLIENTS["model_versions"].get(direction, "")
+
+
+class LazyDatabase:
+    '''stands for the pymongo database, the client is created on first access'''
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+class LazyElasticsearch:
+    '''stands for the Elasticsearch client, created on first access'''
+
+    def __getattr__(self, name):
+        return getattr(get_es(), name)
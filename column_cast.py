@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# file: column_cast.py
+
+import datetime
+
+# csv values read as None
+NULL_VALUES = frozenset(["None", "NULL", "NA"])
+TRUE_VALUES = frozenset(["true", "True"])
+FALSE_VALUES = frozenset(["false", "False"])
+
+
+def parse_date(value):
+    '''
+    2021-01-01T00:04:00.000Z > datetime (milliseconds and Z are dropped)
+    values that are not dates are kept as strings, as parse_int does
+    '''
+    try:
+        return datetime.datetime.fromisoformat(value.split(".")[0].rstrip("Z"))
+    except ValueError:
+        return str(value)
+
+
+def format_date(value):
+    '''
+    csv cell of a date: datetime > 2021-01-01T00:04:00
+    dates imported before they were parsed are strings: 2021-01-01T00:04:00.000Z > 2021-01-01T00:04:00
+    '''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(timespec="seconds")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value).split(".")[0]
+
+
+def parse_bool(value):
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return bool(value)
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return str(value)
+
+
+def keep(value):
+    return value
+
+
+# datatype > cast of a non empty, non null csv value (str by default)
+CONVERTERS = {
+    "date": parse_date,
+    "boolean": parse_bool,
+    "int": parse_int,
+    "object": keep,
+}
+
+
+def cast_value(datatype, value):
+    '''cast a single csv value following its datatype'''
+    if value is None or value in NULL_VALUES:
+        return None
+    if value == "":
+        return ""
+    return CONVERTERS.get(datatype, str)(value)
+
+
+def cast_values(datatype, values):
+    '''cast a whole column of csv values following its datatype'''
+    convert = CONVERTERS.get(datatype, str)
+    return [
+        None if value is None or value in NULL_VALUES else value if value == "" else convert(value)
+        for value in values
+    ]
+
+
+def cast_multiple_values(datatype, values):
+    '''cast a column of "|" separated values into lists'''
+    return [
+        None if value is None else cast_values(datatype, value.split("|"))
+        for value in values
+    ]
+
+
+def cast_unknown_value(value):
+    '''cast a value of a field without rule: guess lists, booleans and nulls'''
+    if value is None:
+        return None
+    if "|" in value:
+        return cast_values("string", value.split("|"))
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    if value in NULL_VALUES:
+        return None
+    return str(value)
+
+
+def cast_unknown_values(values):
+    return [cast_unknown_value(value) for value in values]
+
+
+def compile_column_caster(rule):
+    '''return the function casting a whole column, from the rule of its field (None if unknown)'''
+    if rule is None:
+        return cast_unknown_values
+    datatype = rule["datatype"]
+    if rule["multiple"]:
+        return lambda values: cast_multiple_values(datatype, values)
+    return lambda values: cast_values(datatype, values)
+
+
+def cast_columns(rows, get_column_rule):
+    '''
+    cast csv rows column by column: the rule of each column is resolved once
+    with get_column_rule(field) and the column is cast in a single pass
+    returns the cast rows as dicts, keeping the csv column order
+    '''
+    if len(rows) == 0:
+        return []
+    fields = list(rows[0].keys())
+    columns = [
+        compile_column_caster(get_column_rule(field))([row.get(field) for row in rows])
+        for field in fields
+    ]
+    return [dict(zip(fields, values)) for values in zip(*columns)]
@@ -7,8 +7,23 @@ import csv
 from utils import DB
 from utils import data_dir
 from utils import get_rule, get_rules, is_multilang_model
+from utils import REFERENCES
 from db_import_utils import import_rules_from_csv, import_references_from_csv
+from export_sinks import CsvSink, JsonlSink, ParquetSink, COMPRESSIONS
+from export_sinks import open_output, open_input
+from column_cast import format_date
+import json
+import time
 import datetime
+import argparse
+
+
+# documents fetched from mongo per cursor round trip
+EXPORT_BATCH_SIZE = 1000
+# change events of a document, other events (createIndexes...) have no documentKey
+DOCUMENT_OPERATIONS = ["insert", "update", "replace", "delete"]
+# change events after which a delta export falls back to a snapshot
+RESET_OPERATIONS = ["drop", "rename", "dropDatabase", "invalidate"]
 
 
 def cast_type_for_csv_export(model, lang, field, value):
@@ -43,6 +58,15 @@ def cast_type_for_csv_export(model, lang, field, value):
                 return "|".join(
                     [cast_value_for_csv_export(ext_datatype, v[ext_key]) for v in value]
                 )
+        elif rule["reference_table"] != "":
+            # controlled values are exported with their label in lang
+            return "|".join(
+                [
+                    cast_value_for_csv_export(datatype, v)
+                    for v in REFERENCES.names(rule["reference_table"], value, lang)
+                    if v is not None
+                ]
+            )
         else:
             return "|".join(
                 [cast_value_for_csv_export(datatype, v) for v in value if v is not None]
@@ -61,6 +85,10 @@ def cast_type_for_csv_export(model, lang, field, value):
                 return cast_value_for_csv_export(ext_datatype, value[lang][ext_key])
             else:
                 return cast_value_for_csv_export(ext_datatype, value[ext_key])
+        elif rule["reference_table"] != "":
+            return cast_value_for_csv_export(
+                datatype, REFERENCES.names(rule["reference_table"], [value], lang)[0]
+            )
         else:
             return cast_value_for_csv_export(datatype, value)
 
@@ -73,109 +101,373 @@ def cast_value_for_csv_export(datatype, value):
     if datatype == "boolean":
         return bool(value)
     if datatype == "date":
-        # 2021-01-01T00:04:00.000Z
-        return value.split(".")[0]
+        return format_date(value)
     if datatype == "object":
         return value
     return str(value)
 
 
-def export_datasets(lang="fr"):
-    """
-    export
-    """
-    datasets_list = []
-    for dataset in DB.datasets.find({}, {"_id": 0}):
-        dataset_row = {}
-        for k, v in dataset.items():
-            rules = DB.rules.find_one({"model": "dataset", "slug": k}, {"_id": 0})
-            if rules is not None and "comment" not in k:
-                if rules["datatype"] == "bool":
-                    dataset_row[k] = v
+def keep(value):
+    return value
+
+
+# datatype > export of a non empty, non null value (str by default), see cast_value_for_csv_export
+VALUE_EXPORTERS = {
+    "boolean": bool,
+    "date": format_date,
+    "object": keep,
+}
+
+
+def compile_value_exporter(datatype):
+    convert = VALUE_EXPORTERS.get(datatype, str)
+    return lambda value: "None" if value is None else "" if value == "" else convert(value)
+
+
+def compile_field_exporter(model, lang, rule):
+    '''
+    return the function exporting a value of the field of rule into a csv cell
+    same output as cast_type_for_csv_export, with the rules of the field
+    and of its external model resolved once
+    '''
+    if rule["external_model"] != "" and rule["reference_table"] == "":
+        ext_model = rule["external_model"]
+        ext_key = rule["external_model_display_keys"].split("|")[0]
+        ext_datatype = get_rule(ext_model, ext_key)["datatype"]
+        export_value = compile_value_exporter(ext_datatype)
+        if ext_datatype == "id":
+            get_key = keep
+        elif is_multilang_model(ext_model):
+            get_key = lambda v: v[lang][ext_key]
+        else:
+            get_key = lambda v: v[ext_key]
+        if rule["multiple"]:
+            # None items of non multilang external models are not skipped
+            skip_none = ext_datatype == "id" or is_multilang_model(ext_model)
+            export = lambda value: "|".join(
+                [export_value(get_key(v)) for v in value if v is not None or not skip_none]
+            )
+        else:
+            export = lambda value: export_value(get_key(value))
+    elif rule["reference_table"] != "":
+        ref_table = rule["reference_table"]
+        export_value = compile_value_exporter(rule["datatype"])
+        if rule["multiple"]:
+            export = lambda value: "|".join(
+                [export_value(v) for v in REFERENCES.names(ref_table, value, lang) if v is not None]
+            )
+        else:
+            export = lambda value: export_value(REFERENCES.names(ref_table, [value], lang)[0])
+    else:
+        export_value = compile_value_exporter(rule["datatype"])
+        if rule["multiple"]:
+            export = lambda value: "|".join([export_value(v) for v in value if v is not None])
+        else:
+            export = export_value
+    return lambda value: "" if value is None else export(value)
+
+
+def compile_exporters(model, lang):
+    '''[(slug, csv header, exporter)] of the exported fields of model, built once per export'''
+    return [
+        (rule["slug"], rule[f"name_{lang}"], compile_field_exporter(model, lang, rule))
+        for rule in get_rules(model)
+        if rule["external_model"] != "comment"
+        and rule["slug"] not in ["_id", "id", "ID"]
+        and rule["ITEM_order"] != -1
+    ]
+
+
+def export_row(exporters, model_item):
+    return {
+        header: export(model_item[slug])
+        for slug, header, export in exporters
+        if slug in model_item
+    }
+
+
+def build_dataset_row(dataset, lang="fr"):
+    dataset_row = {}
+    for k, v in dataset.items():
+        rules = get_rule("dataset", k)
+        if rules is not None and "comment" not in k:
+            if rules["datatype"] == "bool":
+                dataset_row[k] = v
+                continue
+            elif (
+                rules["datatype"] == "dict"
+                and rules["external_model"] == "organization"
+            ):
+                dataset_row[k] = "|".join([n["name"] for n in v])
+                continue
+            elif rules["multiple"]:
+                if rules["translation"]:
+                    try:
+                        dataset_row[k] = "|".join([n["name_" + lang] for n in v])
+                    except TypeError:
+                        dataset_row[k] = "|".join(
+                            [
+                                n["name_" + lang]
+                                for n in v
+                                if n["name_" + lang] is not None
+                                and n["name_" + lang] != ""
+                            ]
+                        )
+                    continue
+                else:
+                    dataset_row[k] = "|".join(v)
                     continue
-                elif (
-                    rules["datatype"] == "dict"
-                    and rules["external_model"] == "organization"
-                ):
-                    dataset_row[k] = "|".join([n["name"] for n in v])
+            else:
+                if rules["translation"]:
+                    dataset_row[k] = v["name_" + lang]
                     continue
-                elif rules["multiple"]:
-                    if rules["translation"]:
-                        try:
-                            dataset_row[k] = "|".join([n["name_" + lang] for n in v])
-                        except TypeError:
-                            dataset_row[k] = "|".join(
-                                [
-                                    n["name_" + lang]
-                                    for n in v
-                                    if n["name_" + lang] is not None
-                                    and n["name_" + lang] != ""
-                                ]
-                            )
-                        continue
-                    else:
-                        dataset_row[k] = "|".join(v)
-                        continue
                 else:
-                    if rules["translation"]:
-                        dataset_row[k] = v["name_" + lang]
-                        continue
-                    else:
-                        dataset_row[k] = v
-                        continue
-        datasets_list.append(dataset_row)
+                    dataset_row[k] = v
+                    continue
+    return dataset_row
+
+
+def export_datasets(lang="fr"):
+    """
+    export, rows are written as datasets are read
+    (csv headers are the fields of the first dataset)
+    """
     filename = f"datasets_{lang}.csv"
     filepath = os.path.join(data_dir, "export", filename)
-    headers = list(sorted(dataset_row.keys()))
     with open(filepath, "w") as fd:
-        csv_writer = csv.DictWriter(fd, headers)
-        csv_writer.writeheader()
-        for row in datasets_list:
-            csv_writer.writerow(row)
+        csv_writer = None
+        for dataset in DB.datasets.find({}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE):
+            dataset_row = build_dataset_row(dataset, lang)
+            if csv_writer is None:
+                headers = list(sorted(dataset_row.keys()))
+                csv_writer = csv.DictWriter(fd, headers, extrasaction="ignore")
+                csv_writer.writeheader()
+            csv_writer.writerow(dataset_row)
     # raise DeprecationWarning
 
 
-def export_model_to_csv(model="dataset", lang="fr"):
+def export_model(model="dataset", langs=("fr", "en"), formats=("csv",), compression=None, batch_size=EXPORT_BATCH_SIZE, export_dir=os.path.join(data_dir, "export")):
+    '''
+    export a model in one pass over the collection: each document is read once
+    and written to every sink (csv and parquet per lang, jsonl of whole documents)
+    formats: csv, jsonl, parquet (requires pyarrow)
+    compression: None, gzip or zstd (requires zstandard) for csv and jsonl
+    returns the exported files
+    '''
     now = datetime.datetime.now()
     today_now = now.strftime("%Y-%m-%d_%H:%M:%S")
-    if is_multilang_model:
-        filename = f"{model}_{lang}-{today_now}.csv"
-
+    multilang = is_multilang_model(model)
+    if not multilang:
+        # docs of models without translations are not split by lang
+        langs = ["en"]
+    extension = COMPRESSIONS[compression]
+    if "jsonl" in formats or not multilang:
+        projection = None
     else:
-        filename = f"{model}-{today_now}.csv"
-        lang = "en"
-    filepath = os.path.join(data_dir, "export", filename)
-    key_getter = {
-        rule["slug"]: rule[f"name_{lang}"]
-        for rule in DB.rules.find(
-            {
-                "model": model,
-                "external_model": {"$ne": "comment"},
-                "slug": {"$nin": ["_id", "id", "ID"]},
-                "ITEM_order": {"$ne": -1},
-            },
-            {"_id": 0},
-        )
+        projection = {lang: 1 for lang in langs}
+    sinks = []
+    try:
+        # sinks open their file: built in the try so that a failing one closes the others
+        for lang in langs:
+            prefix = f"{model}_{lang}-{today_now}" if multilang else f"{model}-{today_now}"
+            exporters = compile_exporters(model, lang)
+            doc_lang = lang if multilang else None
+            if "csv" in formats:
+                filepath = os.path.join(export_dir, f"{prefix}.csv{extension}")
+                sinks.append(CsvSink(filepath, exporters, doc_lang, compression))
+            if "parquet" in formats:
+                filepath = os.path.join(export_dir, f"{prefix}.parquet")
+                sinks.append(ParquetSink(filepath, exporters, doc_lang))
+        if "jsonl" in formats:
+            filepath = os.path.join(export_dir, f"{model}-{today_now}.jsonl{extension}")
+            sinks.append(JsonlSink(filepath, compression))
+        for model_item in DB[f"{model}s"].find({}, projection).batch_size(batch_size):
+            for sink in sinks:
+                sink.write(model_item)
+    finally:
+        for sink in sinks:
+            sink.close()
+    for sink in sinks:
+        print(f"{sink.rows} {model}s exported into {sink.filepath}")
+    return [sink.filepath for sink in sinks]
+
+
+def export_model_to_csv(model="dataset", lang="fr"):
+    return export_model(model, [lang], ["csv"])
+
+
+def get_manifest_file(model, export_dir=os.path.join(data_dir, "export")):
+    return os.path.join(export_dir, f"{model}-manifest.json")
+
+
+def load_manifest(model, export_dir=os.path.join(data_dir, "export")):
+    manifest_file = get_manifest_file(model, export_dir)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, export_dir=os.path.join(data_dir, "export")):
+    with open(get_manifest_file(manifest["model"], export_dir), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def export_model_snapshot(model, compression=None, export_dir=os.path.join(data_dir, "export")):
+    '''
+    full jsonl export starting a new manifest
+    the change stream position is taken before the export so that
+    changes made during the export are in the next delta
+    '''
+    with DB[f"{model}s"].watch(full_document="updateLookup") as stream:
+        stream.try_next()
+        resume_token = stream.resume_token
+    snapshot_file = export_model(model, formats=["jsonl"], compression=compression, export_dir=export_dir)[-1]
+    manifest = {
+        "model": model,
+        "snapshot": {"file": os.path.basename(snapshot_file), "date": datetime.datetime.now().isoformat()},
+        "resume_token": resume_token,
+        "deltas": [],
     }
+    save_manifest(manifest, export_dir)
+    return manifest
 
-    headers = {v: "" for v in key_getter.values()}
-    with open(filepath, "w") as fd:
-        csv_writer = csv.DictWriter(fd, fieldnames=headers)
-        csv_writer.writeheader()
-        for model_item in DB[f"{model}s"].find({}, {lang: 1, "_id": 0}):
-            model_item = model_item[lang]
-            exported_item = {
-                key_getter[k]: cast_type_for_csv_export(model, lang, k, model_item[k])
-                for k in key_getter.keys()
-                if k in model_item and k in key_getter.keys()
-            }
-            csv_writer.writerow(exported_item)
+
+def export_model_delta(model, compression=None, export_dir=os.path.join(data_dir, "export")):
+    '''
+    export the documents inserted, changed or deleted since the last export
+    - the high-water mark is the change stream resume token stored in <model>-manifest.json
+    (change streams require mongo to run as a replica set)
+    - changes are written into <model>-delta-<date>.jsonl, one line per document:
+    {"op": "upsert", "_id": ..., "doc": {...}} or {"op": "delete", "_id": ...}
+    - without manifest, if the oplog no longer holds the mark or if the collection was
+    dropped or renamed since, a full snapshot is exported
+    - other events without a document (createIndexes...) are skipped
+    '''
+    from pymongo.errors import OperationFailure
+    manifest = load_manifest(model, export_dir)
+    if manifest is None:
+        print(f"No export manifest for {model}, exporting a full snapshot")
+        return export_model_snapshot(model, compression, export_dir)
+    changes = {}
+    reset = None
+    try:
+        with DB[f"{model}s"].watch(full_document="updateLookup", resume_after=manifest["resume_token"]) as stream:
+            change = stream.try_next()
+            while change is not None:
+                if change["operationType"] in RESET_OPERATIONS:
+                    reset = change["operationType"]
+                    break
+                if change["operationType"] in DOCUMENT_OPERATIONS:
+                    # the last change of a document wins, fullDocument is its current state
+                    doc_id = str(change["documentKey"]["_id"])
+                    if change["operationType"] == "delete" or change.get("fullDocument") is None:
+                        changes[doc_id] = None
+                    else:
+                        changes[doc_id] = change["fullDocument"]
+                change = stream.try_next()
+            resume_token = stream.resume_token
+    except OperationFailure as e:
+        print(f"Error: {model} changes since the last export are lost ({e}), exporting a full snapshot")
+        return export_model_snapshot(model, compression, export_dir)
+    if reset is not None:
+        # the stream is invalidated: its token cannot be resumed and the deltas no longer apply
+        print(f"{model}s collection event {reset} since the last export, exporting a full snapshot")
+        return export_model_snapshot(model, compression, export_dir)
+    today_now = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    delta_file = os.path.join(export_dir, f"{model}-delta-{today_now}.jsonl{COMPRESSIONS[compression]}")
+    with open_output(delta_file, compression) as f:
+        for doc_id, doc in changes.items():
+            if doc is None:
+                line = {"op": "delete", "_id": doc_id}
+            else:
+                line = {"op": "upsert", "_id": doc_id, "doc": doc}
+            f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+    deleted = len([doc for doc in changes.values() if doc is None])
+    manifest["deltas"].append({
+        "file": os.path.basename(delta_file),
+        "date": datetime.datetime.now().isoformat(),
+        "upserted": len(changes) - deleted,
+        "deleted": deleted,
+    })
+    manifest["resume_token"] = resume_token
+    save_manifest(manifest, export_dir)
+    print(f"{model} delta: {len(changes) - deleted} upserted, {deleted} deleted into {delta_file}")
+    return manifest
+
+
+def rebuild_snapshot(model, output_file, export_dir=os.path.join(data_dir, "export")):
+    '''rebuild the current full jsonl export of model from the manifest snapshot and its deltas'''
+    manifest = load_manifest(model, export_dir)
+    assert manifest is not None, f"Error: no export manifest for {model}"
+    docs = {}
+    with open_input(os.path.join(export_dir, manifest["snapshot"]["file"])) as f:
+        for line in f:
+            if line.strip() != "":
+                doc = json.loads(line)
+                docs[doc["_id"]] = doc
+    for delta in manifest["deltas"]:
+        with open_input(os.path.join(export_dir, delta["file"])) as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                change = json.loads(line)
+                if change["op"] == "delete":
+                    docs.pop(change["_id"], None)
+                else:
+                    docs[change["_id"]] = change["doc"]
+    with open(output_file, "w") as f:
+        for doc in docs.values():
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    print(f"{len(docs)} {model}s rebuilt from {len(manifest['deltas'])} deltas into {output_file}")
+    return len(docs)
+
+
+def benchmark_export(model="dataset", lang="fr", nb_docs=100000, sample_size=1000):
+    '''
+    export nb_docs docs (a sample of the collection repeated) into memory
+    with the compiled exporters and with cast_type_for_csv_export
+    '''
+    sample = [item[lang] for item in DB[f"{model}s"].find({}, {lang: 1, "_id": 0}).limit(sample_size)]
+    assert len(sample) > 0, f"Error: no {model} to export"
+    docs = [sample[i % len(sample)] for i in range(nb_docs)]
+    start = time.perf_counter()
+    exporters = compile_exporters(model, lang)
+    compiled = [export_row(exporters, doc) for doc in docs]
+    compiled_time = time.perf_counter() - start
+    key_getter = {slug: header for slug, header, _ in exporters}
+    start = time.perf_counter()
+    by_cell = [
+        {key_getter[k]: cast_type_for_csv_export(model, lang, k, doc[k]) for k in key_getter if k in doc}
+        for doc in docs
+    ]
+    cell_time = time.perf_counter() - start
+    assert compiled == by_cell, "Error: compiled exporters and cast_type_for_csv_export differ"
+    print(f"{nb_docs} {model}s ({lang}): compiled {compiled_time:.2f}s, cell by cell {cell_time:.2f}s")
+    return {"compiled": compiled_time, "cell": cell_time}
+
+
+parser = argparse.ArgumentParser(description="Export models into data/export")
+parser.add_argument("--model", default="dataset")
+parser.add_argument("--formats", nargs="+", default=["csv"], choices=["csv", "jsonl", "parquet"])
+parser.add_argument("--compression", choices=["gzip", "zstd"])
+parser.add_argument("--delta", action="store_true", help="jsonl of the changes since the last export (see export_model_delta)")
+parser.add_argument("--rebuild", metavar="OUTPUT_FILE", help="rebuild the full jsonl export from the last snapshot and deltas")
+parser.add_argument("--benchmark", type=int, metavar="NB_DOCS", help="time the exporters on NB_DOCS docs instead of exporting")
 
 
 if __name__ == "__main__":
     # import_rules_from_csv()
     # import_references_from_csv()
-    export_model_to_csv("dataset", "fr")
-    export_model_to_csv("dataset", "en")
+    args = parser.parse_args()
+    if args.benchmark is not None:
+        for lang in ["fr", "en"]:
+            benchmark_export(args.model, lang, args.benchmark)
+    elif args.delta:
+        export_model_delta(args.model, args.compression)
+    elif args.rebuild is not None:
+        rebuild_snapshot(args.model, args.rebuild)
+    else:
+        export_model(args.model, ["fr", "en"], args.formats, args.compression)
     # export_model_to_csv("organization", "fr")
     
\ No newline at end of file
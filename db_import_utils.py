@@ -11,62 +11,40 @@ import os
 from csv import DictReader, DictWriter
 import bleach
 import datetime
-import pymongo
+import argparse
 
 from utils import (SWITCH_LANGS, AVAILABLE_LANG)
-from utils import DB
+from utils import DB, RULES
 from utils import data_dir
 from utils import is_multilang_model
-from utils import translate, translate_doc
-from utils import get_rule
+from utils import translate, translate_doc, translate_batch, translate_docs
+from utils import translation_pool
+from utils import TRANSLATION_CHUNK_SIZE, TRANSLATION_WORKERS
+from utils import get_rule, get_rules, get_mandatory_fields
+from rules_utils import bump_version
+from bulk_utils import BulkWriter, BULK_BATCH_SIZE
+from import_pipeline import ImportPipeline, Stage
+from import_tracker import ImportTracker
+from import_jobs import ImportJob
+from column_cast import cast_columns, cast_value, cast_unknown_value
 
 
 def cast_type_for_csv_import(model, field, value):
     rule = get_rule(model, field)
     if rule is None:
-        if "|" in value:
-            rule = {"multiple": True}
-        else:  
-            if value in ["true", "True"]:
-                return True
-            if value in ["false", "False"]:
-                return False
-            if value in ["NA", "None", "NULL"]:
-                return None
-            else:
-                return str(value)
+        return cast_unknown_value(value)
     if rule["multiple"]:
+        if value is None:
+            return None
         return [cast_value_for_csv_import(rule["datatype"], v) for v in value.split("|")]
     else:
         return cast_value_for_csv_import(rule["datatype"], value)
 
 
 def cast_value_for_csv_import(datatype, value):
-    if value is None:
-        return None
-    if value in ["None","NULL", "NA"]:
-        return None
-    if value == "":
-        return ""
-    if datatype == "date":
-        #2021-01-01T00:04:00.000Z
-        return datetime.datetime(**value.split(".")[0])
-    if datatype == "boolean":
-        return bool(value)
-    # if datatype == "date":
-    #     #2021-01-01T00:04:00.000Z
-    #     return value.split(".")[0]
-    if datatype == "int":
-        try:
-            return int(value)
-        except:
-            return str(value)
-    if datatype == "object":
-        return value
-
-    return str(value)
+    return cast_value(datatype, value)
     
-def import_rules_from_csv():
+def import_rules_from_csv(batch_size=BULK_BATCH_SIZE):
     '''
     import_rules into DB['rules'] from data/import/rules.csv
     '''
@@ -74,7 +52,7 @@ def import_rules_from_csv():
     DB[coll_name].drop()
     rules_doc = os.path.join(data_dir, "import", "rules.csv")
     print(f"Creating {coll_name} table")
-    with open(rules_doc, "r") as f:
+    with open(rules_doc, "r") as f, BulkWriter(DB[coll_name], batch_size) as bulk_writer:
         reader = DictReader(f, delimiter=",")
         for row in reader:
             for k,v in row.items():
@@ -92,95 +70,258 @@ def import_rules_from_csv():
                         row[k] = int(v)
                     except ValueError:
                         row[k] = str(v)
-            _id = DB[coll_name].insert_one(row).inserted_id
-
-def import_references_from_csv():
-    assert len(DB.rules.distinct("reference_table")) > 0, "Error: no rules specified. A rules table is required"
-    DB.references.drop()
-    for ref_table in DB.rules.distinct("reference_table"):
-        if ref_table != "":
-            DB[ref_table].drop()
-            print(f"Creating {ref_table} table")
-            meta_reference = {"model":"reference"}
-            meta_reference["table_name"] = ref_table
-            meta_reference["slug"] =  ref_table.replace("ref_", "")
-            ref_file =  os.path.join(data_dir, "import", ref_table+".csv")
-            meta_reference["refs"] = [] 
-            try:
-                with open(ref_file, "r") as f:            
-                    reader = DictReader(f, delimiter=",")
-                    
-                    for row in reader:
-                        clean_row = {k.strip(): v.strip() for k,v in row.items() if v is not None}
-                        try:
-                            if clean_row["name_en"] != "" and clean_row["name_fr"] == "":
-                                clean_row["name_fr"] = translate(clean_row["name_en"], _from="en")
-                            if clean_row["name_fr"] != "" and clean_row["name_en"] =="":
-                                clean_row["name_en"] = translate(clean_row["name_fr"], _from="fr")
-                        except KeyError:
-                            print("Error in clean_row not name_*", clean_row.keys())
-                            pass
-                        
-                        if "root_uri" in clean_row:
-                            meta_reference["root_uri"] = row["root_uri"]
-                        if "root_uri" not in clean_row and "uri" in clean_row:
-                            if clean_row["uri"] != "":
-                                meta_reference["root_uri"] = "/".join(row["uri"].split("/")[:-1])
-                        meta_reference["refs"].append(clean_row)            
-                        try:
-                            ref_id = DB[ref_table].insert_one(clean_row)
-                        except pymongo.errors.DuplicateKeyError:
-                            pass
-                        del clean_row
-                with open(ref_file, "w") as f:        
-                    one_record = DB[ref_table].find_one({}, {"_id":0})
-                    if one_record is not None:
-                        fieldnames = list(one_record.keys())
-                        writer = DictWriter(f, delimiter=",",fieldnames=fieldnames)
-                        writer.writeheader()
-                        for row in DB[ref_table].find({}, {"_id":0}):
-                            writer.writerow(row)
-                meta_reference["status"] = True
-            except FileNotFoundError:
-                print(f"Error! required reference {ref_table} has no corresponding file {ref_file}")
-                meta_reference["status"] = False
-            try:
-                DB.references.insert_one(meta_reference)
-            except pymongo.errors.DuplicateKeyError:
-                print("Err")
-                pass
+            bulk_writer.insert(row)
+    bump_version(DB, coll_name)
+    RULES.reload()
+
+def translate_reference_names(rows):
+    '''fill missing name_fr or name_en of a chunk of reference rows, one batch per direction'''
+    for row in rows:
+        if "name_fr" not in row or "name_en" not in row:
+            print("Error in clean_row not name_*", row.keys())
+    for _from, other_lang in SWITCH_LANGS.items():
+        to_fill = [
+            row for row in rows
+            if row.get(f"name_{_from}", "") != "" and row.get(f"name_{other_lang}") == ""
+        ]
+        translations = translate_batch([row[f"name_{_from}"] for row in to_fill], _from=_from)
+        for row, translated in zip(to_fill, translations):
+            row[f"name_{other_lang}"] = translated
+
+def clean_reference_rows(meta_reference, rows):
+    '''strip reference rows and register the root_uri of the reference table'''
+    clean_rows = []
+    for row in rows:
+        clean_row = {k.strip(): v.strip() for k,v in row.items() if v is not None}
+        if "root_uri" in clean_row:
+            meta_reference["root_uri"] = row["root_uri"]
+        if "root_uri" not in clean_row and "uri" in clean_row:
+            if clean_row["uri"] != "":
+                meta_reference["root_uri"] = "/".join(row["uri"].split("/")[:-1])
+        clean_rows.append(clean_row)
+    return clean_rows
+
+def get_key_field(model):
+    '''csv column identifying a row of model: the first field with a unique constraint'''
+    for rule in get_rules(model):
+        if rule.get("constraint") == "unique":
+            return rule["slug"]
+    return None
+
+def import_reference_table(ref_table, chunk_size=TRANSLATION_CHUNK_SIZE, batch_size=BULK_BATCH_SIZE, incremental=False, import_dir=os.path.join(data_dir, "import")):
+    '''
+    import one reference table from <import_dir>/<ref_table>.csv and register it in DB.references
+    rows are streamed: clean > translate missing names > write
+    and the refs list of DB.references is built by mongo from the written table
+    incremental: the table is not dropped, only new or changed rows are translated and upserted,
+    rows missing from the csv are deleted. Returns the changes (None if not incremental)
+    '''
+    changes = None
+    DB.references.delete_many({"table_name": ref_table})
+    if not incremental:
+        DB[ref_table].drop()
+    print(f"Creating {ref_table} table")
+    meta_reference = {"model":"reference"}
+    meta_reference["table_name"] = ref_table
+    meta_reference["slug"] =  ref_table.replace("ref_", "")
+    ref_file =  os.path.join(import_dir, ref_table+".csv")
+    meta_reference["refs"] = [] 
+    try:
+        with open(ref_file, "r") as f, BulkWriter(DB[ref_table], batch_size) as bulk_writer:
+            reader = DictReader(f, delimiter=",")
+            tracker = ImportTracker(DB, ref_table, key_field="uri")
+            if not incremental:
+                # the table is dropped: every row is new, its hash is stored for the next incremental run
+                tracker.reset()
+            stages = [
+                Stage("clean", lambda rows: clean_reference_rows(meta_reference, rows)),
+                Stage("diff", lambda rows: [dict(row, _import=meta) for row, meta in tracker.diff(rows)]),
+                Stage("translate", lambda rows: translate_reference_names(rows) or rows),
+                Stage("write", lambda rows: tracker.upsert(bulk_writer, rows)),
+            ]
+            ImportPipeline(stages, chunk_size, name=ref_table).run(reader)
+        tracker_changes = tracker.finish(bulk_writer)
+        if incremental:
+            changes = tracker_changes
+        with open(ref_file, "w") as f:        
+            one_record = DB[ref_table].find_one({}, {"_id":0})
+            if one_record is not None:
+                fieldnames = list(one_record.keys())
+                writer = DictWriter(f, delimiter=",",fieldnames=fieldnames)
+                writer.writeheader()
+                for row in DB[ref_table].find({}, {"_id":0}):
+                    writer.writerow(row)
+        meta_reference["status"] = True
+    except FileNotFoundError:
+        print(f"Error! required reference {ref_table} has no corresponding file {ref_file}")
+        meta_reference["status"] = False
+    from pymongo.errors import DuplicateKeyError
+    try:
+        meta_id = DB.references.insert_one(meta_reference).inserted_id
+    except DuplicateKeyError:
+        print("Err")
+        return changes
+    if meta_reference["status"]:
+        DB[ref_table].aggregate([
+            {"$sort": {"_id": 1}},
+            {"$group": {"_id": meta_id, "refs": {"$push": "$$ROOT"}}},
+            {"$merge": {"into": "references", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+        ])
+        # reference dictionaries (utils.REFERENCES) reload the table
+        bump_version(DB, ref_table)
+    return changes
+
+def import_references_from_csv(workers=TRANSLATION_WORKERS, chunk_size=TRANSLATION_CHUNK_SIZE, batch_size=BULK_BATCH_SIZE, incremental=False, import_dir=os.path.join(data_dir, "import"), resume=False):
+    '''
+    import every reference table declared in rules (see import_reference_table)
+    returns {ref_table: changes} when incremental
+    imported tables are checkpointed in DB._jobs: resume=True skips the tables
+    imported by the last unfinished run
+    '''
+    assert len(RULES.reference_tables()) > 0, "Error: no rules specified. A rules table is required"
+    job = None
+    if not incremental:
+        job = ImportJob(DB, "references", resume=resume)
+        if not job.resumed:
+            DB.references.drop()
+    changes = {}
+    with translation_pool(workers):
+        try:
+            for ref_table in RULES.reference_tables():
+                if ref_table == "":
+                    continue
+                if job is not None and job.is_done(ref_table):
+                    print(f"{ref_table} already imported")
+                    continue
+                changes[ref_table] = import_reference_table(ref_table, chunk_size, batch_size, incremental, import_dir)
+                if job is not None:
+                    job.mark(ref_table)
+        except Exception as e:
+            if job is not None:
+                job.fail(e)
+            raise
+    if job is not None:
+        job.finish()
     print("Created references table")
+    if incremental:
+        return changes
+
+def cast_model_rows(model, lang, rows, multilang=True):
+    '''cast csv rows into model docs ({lang: {...}} for multilang models)
+    rows are cast column by column, see cast_model_rows_by_row for the cell by cell path
+    '''
+    docs = cast_columns(rows, lambda field: get_rule(model, field))
+    if multilang:
+        return [{lang: doc} for doc in docs]
+    return docs
+
+def cast_model_rows_by_row(model, lang, rows, multilang=True):
+    '''cell by cell cast of csv rows, reference for cast_model_rows'''
+    if multilang:
+        return [
+            {lang: {k: cast_type_for_csv_import(model, k, v) for k, v in row.items()}}
+            for row in rows
+        ]
+    return [
+        {k: cast_type_for_csv_import(model, k, v) for k, v in row.items()}
+        for row in rows
+    ]
+
+def cast_changed_rows(model, lang, items, multilang=True):
+    '''cast [(row, meta)] returned by ImportTracker.diff, meta is kept under "_import"'''
+    docs = cast_model_rows(model, lang, [row for row, _ in items], multilang)
+    for doc, (_, meta) in zip(docs, items):
+        doc["_import"] = meta
+    return docs
+
+def translate_model_docs(model, lang, docs):
+    '''add the other lang translation to a chunk of model docs'''
+    other_lang = SWITCH_LANGS[lang]
+    for doc, translated in zip(docs, translate_docs(model, docs, _from=lang)):
+        doc[other_lang] = translated
+    return docs
 
-def import_model_from_csv(model, lang, import_dir = os.path.join(data_dir, "import")):
-    '''Import a model from a csv following rules'''
-    assert len(DB.rules.distinct("reference_table")) > 0, "Error: no rules specified pleas build_rules before launching references"
-    assert len(DB.rules.distinct("reference_table")) > 0, "Error: no references specified please build_references before launching references"
+def validate_model_docs(model, docs, lang=None, strict=False):
+    '''check mandatory fields, invalid docs are reported and dropped only if strict'''
+    mandatory_fields = get_mandatory_fields(model)
+    valid_docs = []
+    for doc in docs:
+        values = doc[lang] if lang is not None else doc
+        missing = [f for f in mandatory_fields if values.get(f) in [None, "", []]]
+        if len(missing) > 0:
+            print(f"Invalid {model}: missing {', '.join(missing)}")
+            if strict:
+                continue
+        valid_docs.append(doc)
+    return valid_docs
+
+def import_model_from_csv(model, lang, import_dir = os.path.join(data_dir, "import"), workers=TRANSLATION_WORKERS, chunk_size=TRANSLATION_CHUNK_SIZE, batch_size=BULK_BATCH_SIZE, strict=False, incremental=False, resume=False):
+    '''Import a model from a csv following rules
+    rows are streamed by chunks of chunk_size: read > cast > translate > validate > write
+    translation uses `workers` translation processes if > 1
+    and rows are written by batches of batch_size
+    incremental: only rows whose content changed since the last import are cast, translated
+    and upserted, rows missing from the csv are deleted. Returns the changed ids
+    otherwise every committed batch is checkpointed in DB._jobs (see import_jobs.ImportJob)
+    and resume=True continues the last unfinished run after its last committed row
+    (an interrupted incremental import needs no resume: its diff skips the rows already written)
+    '''
+    assert len(RULES.reference_tables()) > 0, "Error: no rules specified pleas build_rules before launching references"
+    assert len(RULES.reference_tables()) > 0, "Error: no references specified please build_references before launching references"
     
-    if is_multilang_model(model):
-        csv_file = os.path.abspath(import_dir, f"{model}_{lang}.csv")    
+    multilang = is_multilang_model(model)
+    if multilang:
+        csv_file = os.path.abspath(os.path.join(import_dir, f"{model}_{lang}.csv"))
     else:
-        csv_file = os.path.abspath(import_dir, f"{model}.csv")
+        csv_file = os.path.abspath(os.path.join(import_dir, f"{model}.csv"))
+        lang = "en"
     
-    assert os.file.exists(csv_file), f"Error: no file {csv_file} found"
+    assert os.path.exists(csv_file), f"Error: no file {csv_file} found"
     
     print(f"Create {model}s by inserting {csv_file}")
-    with open(csv_file, "r") as f:
+    job = None
+    on_flush = None
+    if not incremental:
+        job = ImportJob(DB, f"{model}s_{lang}", csv_file, resume)
+        on_flush = job.commit
+    with translation_pool(workers), open(csv_file, "r") as f, BulkWriter(DB[f'{model}s'], batch_size, on_flush=on_flush, duplicates_ok=job is not None and job.resumed) as bulk_writer:
         reader = DictReader(f, delimiter=",")
-        for row in reader:
-            if is_multilang_model(model):
-                dataset = {"fr": {}, "en": {}}
-                other_lang = SWITCH_LANGS[lang]
-                dataset[lang] = {
-                    k: cast_type_for_csv_import(model, k, v) for k, v in row.items()
-                }
-                dataset[other_lang] = translate_doc(model, dataset, _from=lang)
-            else:
-                lang = "en"
-                dataset = {
-                    cast_type_for_csv_import(model, k, v) for k, v in row.items()
-                }
-            DB[f'{model}s'].insert_one(dataset)
+        if incremental:
+            tracker = ImportTracker(DB, f"{model}s", key_field=get_key_field(model))
+            stages = [
+                Stage("diff", tracker.diff),
+                Stage("cast", lambda items: cast_changed_rows(model, lang, items, multilang)),
+            ]
+            rows = reader
+        else:
+            stages = [Stage("cast", lambda items: cast_changed_rows(model, lang, items, multilang))]
+            rows = job.items(reader)
+        if multilang:
+            stages.append(Stage("translate", lambda docs: translate_model_docs(model, lang, docs)))
+        stages.append(Stage("validate", lambda docs: validate_model_docs(model, docs, lang if multilang else None, strict)))
+        if incremental:
+            stages.append(Stage("write", lambda docs: tracker.upsert(bulk_writer, docs)))
+        else:
+            stages.append(Stage("write", lambda docs: job.write(bulk_writer, docs)))
+        try:
+            ImportPipeline(stages, chunk_size, name=model).run(rows)
+        except Exception as e:
+            if job is not None:
+                job.fail(e)
+            raise
     print(DB[f"{model}s"].count_documents({}), f"{model}s from {csv_file}")
+    # caches of the documents (facet bitmaps of the services) are rebuilt
+    bump_version(DB, f"{model}s")
+    if incremental:
+        return tracker.finish(bulk_writer)
+    # hashes of the written rows, ids are those of the job (resumed runs included)
+    tracker = ImportTracker(DB, f"{model}s", key_field=get_key_field(model))
+    with open(csv_file, "r") as f:
+        tracker.record(
+            (row, job.doc_id(number))
+            for number, row in enumerate(DictReader(f, delimiter=","), start=1)
+        )
+    job.finish()
     
 
 def build_import_file_template(model="dataset", lang="fr"):
@@ -197,7 +338,7 @@ def build_import_file_template(model="dataset", lang="fr"):
         )
     headers = {
         rule[f"name_{lang}"]: ""
-        for rule in DB.rules.find({"model": model}, {"_id": 0})
+        for rule in get_rules(model)
         if rule["external_model"] != "comment"
         and rule["slug"] not in ["_id", "id", "ID"]
         and rule["ITEM_order"] != -1
@@ -207,9 +348,20 @@ def build_import_file_template(model="dataset", lang="fr"):
         csv_writer.writeheader()
 
 
+parser = argparse.ArgumentParser(description="Import rules, references and models from csv")
+parser.add_argument("--model", help="import this model after rules and references")
+parser.add_argument("--lang", default="fr", choices=AVAILABLE_LANG)
+parser.add_argument("--workers", type=int, default=TRANSLATION_WORKERS, help="translation processes")
+parser.add_argument("--resume", action="store_true", help="continue the last interrupted import from its last committed batch")
+
+
 if __name__ == "__main__":
-    import_rules_from_csv()
-    import_references_from_csv()
+    args = parser.parse_args()
+    if not args.resume:
+        import_rules_from_csv()
+    import_references_from_csv(args.workers, resume=args.resume)
+    if args.model is not None:
+        import_model_from_csv(args.model, args.lang, workers=args.workers, resume=args.resume)
     build_import_file_template()
     
     # # for model_name in DB["rules"].distinct("model"):
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# file: export_aggregation.py
+
+import os
+import csv
+import time
+import datetime
+import argparse
+
+from utils import DB, data_dir
+from utils import get_rule, is_multilang_model
+from db_export_utils import compile_exporters, EXPORT_BATCH_SIZE
+
+# datatypes whose csv value is the python repr of the value: exported by the python exporter
+PYTHON_DATATYPES = ["object"]
+# documents compared with the python exporter before an aggregated export (see check_export_parity)
+PARITY_SAMPLE_SIZE = 1000
+
+
+def is_null(expr):
+    '''true for null and missing values'''
+    return {"$lte": [expr, None]}
+
+
+# format of datetime.isoformat(timespec="seconds"), see column_cast.format_date
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def export_value_expr(datatype, expr):
+    '''aggregation expression of compile_value_exporter(datatype)'''
+    if datatype == "boolean":
+        # bool([]) is False, mongo arrays are always true
+        truth = {"$cond": [{"$isArray": expr}, {"$gt": [{"$size": expr}, 0]}, expr]}
+        convert = {"$cond": [truth, "True", "False"]}
+    elif datatype == "date":
+        # parsed dates are BSON dates, dates imported before they were parsed are strings
+        convert = {"$cond": [
+            {"$eq": [{"$type": expr}, "date"]},
+            {"$dateToString": {"date": expr, "format": DATE_FORMAT}},
+            {"$arrayElemAt": [{"$split": [str_expr(expr), "."]}, 0]},
+        ]}
+    else:
+        convert = str_expr(expr)
+    return {"$switch": {
+        "branches": [
+            {"case": is_null(expr), "then": "None"},
+            {"case": {"$eq": [expr, ""]}, "then": ""},
+        ],
+        "default": convert,
+    }}
+
+
+def str_expr(expr):
+    '''
+    str(value) of a non null value: $toString fails on arrays (lists of translated fields),
+    they are rendered as python lists, and differs from python on booleans, integral doubles and dates
+    '''
+    return {"$switch": {
+        "branches": [
+            {"case": {"$isArray": expr}, "then": list_repr_expr(expr)},
+            {"case": {"$eq": [{"$type": expr}, "bool"]}, "then": {"$cond": [expr, "True", "False"]}},
+            # str(2.0) is "2.0", $toString gives "2" (doubles of 1e16 and more print as exponents in both)
+            {"case": {"$and": [
+                {"$eq": [{"$type": expr}, "double"]},
+                {"$eq": [expr, {"$trunc": expr}]},
+                {"$lt": [{"$abs": expr}, 1e16]},
+            ]}, "then": {"$concat": [{"$toString": expr}, ".0"]}},
+            {"case": {"$eq": [{"$type": expr}, "date"]}, "then": datetime_str_expr(expr)},
+        ],
+        "default": {"$toString": expr},
+    }}
+
+
+def datetime_str_expr(expr):
+    '''str(datetime): 2021-01-01 00:04:00, with microseconds when they are not 0'''
+    seconds = {"$dateToString": {"date": expr, "format": "%Y-%m-%d %H:%M:%S"}}
+    return {"$cond": [
+        {"$eq": [{"$millisecond": expr}, 0]},
+        seconds,
+        {"$concat": [seconds, ".", {"$dateToString": {"date": expr, "format": "%L"}}, "000"]},
+    ]}
+
+
+def repr_expr(expr):
+    '''repr() of a list item: quoted strings, True/False, None and ObjectId(...)'''
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": [{"$type": expr}, "string"]}, "then": {"$cond": [
+                # repr() switches to double quotes around single quotes, other escapes are not rendered
+                {"$regexMatch": {"input": expr, "regex": "'"}},
+                {"$concat": ['"', expr, '"']},
+                {"$concat": ["'", expr, "'"]},
+            ]}},
+            {"case": {"$eq": [{"$type": expr}, "bool"]}, "then": {"$cond": [expr, "True", "False"]}},
+            {"case": is_null(expr), "then": "None"},
+            {"case": {"$eq": [{"$type": expr}, "objectId"]}, "then": {"$concat": ["ObjectId('", {"$toString": expr}, "')"]}},
+        ],
+        "default": {"$toString": expr},
+    }}
+
+
+def list_repr_expr(array_expr, var="element"):
+    '''str(list) of a list of scalars'''
+    items = join_expr(array_expr, repr_expr(f"$${var}"), var=var, separator=", ", skip_null=False)
+    return {"$concat": ["[", {"$ifNull": [items, ""]}, "]"]}
+
+
+def join_expr(array_expr, item_expr, var="item", separator="|", skip_null=True):
+    '''separator.join([item_expr for $$var in array_expr if $$var is not None])'''
+    if skip_null:
+        array_expr = {"$filter": {"input": array_expr, "as": var, "cond": {"$not": [is_null(f"$${var}")]}}}
+    items = {"$map": {
+        "input": array_expr,
+        "as": var,
+        "in": item_expr,
+    }}
+    return {"$reduce": {
+        "input": items,
+        "initialValue": None,
+        "in": {"$cond": [
+            {"$eq": ["$$value", None]},
+            "$$this",
+            {"$concat": ["$$value", separator, "$$this"]},
+        ]},
+    }}
+
+
+def reference_label_expr(refs, lang, expr, var="ref"):
+    '''
+    label in lang of a value found in the looked up reference rows, as ReferenceRegistry.names:
+    a name in lang, else a name in the other lang, else a uri; the value itself when
+    it is unknown or the row has no name in lang
+    '''
+    other_lang = "en" if lang == "fr" else "fr"
+
+    def first_match(key):
+        return {"$arrayElemAt": [{"$filter": {
+            "input": refs,
+            "as": var,
+            # empty cells label nothing, as in ReferenceTable.values
+            "cond": {"$and": [
+                {"$eq": [f"$${var}.{key}", expr]},
+                {"$not": [is_null(f"$${var}.{key}")]},
+                {"$ne": [f"$${var}.{key}", ""]},
+            ]},
+        }}, 0]}
+
+    # $ifNull also skips the missing element of an empty filter
+    match = {"$ifNull": [
+        first_match(f"name_{lang}"),
+        {"$ifNull": [first_match(f"name_{other_lang}"), first_match("uri")]},
+    ]}
+    return {"$let": {
+        "vars": {"match": match},
+        "in": {"$cond": [
+            {"$or": [is_null(f"$$match.name_{lang}"), {"$eq": [f"$$match.name_{lang}", ""]}]},
+            expr,
+            f"$$match.name_{lang}",
+        ]},
+    }}
+
+
+def compile_field_expr(model, lang, rule, path):
+    '''
+    aggregation expression of db_export_utils.compile_field_exporter
+    returns (expression, lookup stage or None), expression is None when the field
+    has to be exported in python
+    '''
+    lookup = None
+    if rule["external_model"] != "" and rule["reference_table"] == "":
+        ext_model = rule["external_model"]
+        ext_key = rule["external_model_display_keys"].split("|")[0]
+        ext_datatype = get_rule(ext_model, ext_key)["datatype"]
+        if ext_datatype in PYTHON_DATATYPES:
+            return None, None
+        if ext_datatype == "id":
+            key_path = ""
+        elif is_multilang_model(ext_model):
+            key_path = f".{lang}.{ext_key}"
+        else:
+            key_path = f".{ext_key}"
+        if rule["multiple"]:
+            expr = join_expr(path, export_value_expr(ext_datatype, f"$$item{key_path}"))
+        else:
+            expr = {"$let": {
+                "vars": {"item": path},
+                "in": export_value_expr(ext_datatype, f"$$item{key_path}"),
+            }}
+    elif rule["reference_table"] != "":
+        if rule["datatype"] in PYTHON_DATATYPES:
+            return None, None
+        refs = f"_refs_{rule['slug']}"
+        values = {"$cond": [{"$isArray": path}, path, [path]]}
+        lookup = {"$lookup": {
+            "from": rule["reference_table"],
+            "let": {"values": values},
+            "pipeline": [
+                {"$match": {"$expr": {"$or": [
+                    {"$in": ["$name_fr", "$$values"]},
+                    {"$in": ["$name_en", "$$values"]},
+                    {"$in": ["$uri", "$$values"]},
+                ]}}},
+                {"$project": {"_id": 0, "name_fr": 1, "name_en": 1, "uri": 1}},
+            ],
+            "as": refs,
+        }}
+        if rule["multiple"]:
+            expr = join_expr(
+                path,
+                export_value_expr(rule["datatype"], reference_label_expr(f"${refs}", lang, "$$item")),
+            )
+        else:
+            expr = export_value_expr(rule["datatype"], reference_label_expr(f"${refs}", lang, path))
+    else:
+        if rule["datatype"] in PYTHON_DATATYPES:
+            return None, None
+        if rule["multiple"]:
+            expr = join_expr(path, export_value_expr(rule["datatype"], "$$item"))
+        else:
+            expr = export_value_expr(rule["datatype"], path)
+    # None > "" and joins of empty lists > ""
+    return {"$cond": [is_null(path), "", {"$ifNull": [expr, ""]}]}, lookup
+
+
+def compile_export_pipeline(model, lang):
+    '''
+    compile the export rules of (model, lang) into an aggregation pipeline returning
+    flattened rows keyed by slug (csv headers may not be valid field names)
+    returns (pipeline, python fields): fields mongo cannot format are returned raw
+    and exported with their python exporter
+    '''
+    multilang = is_multilang_model(model)
+    lookups = []
+    project = {"_id": 1}
+    python_fields = []
+    for slug, _, export in compile_exporters(model, lang):
+        path = f"${lang}.{slug}" if multilang else f"${slug}"
+        expr, lookup = compile_field_expr(model, lang, get_rule(model, slug), path)
+        if expr is None:
+            project[slug] = path
+            python_fields.append(slug)
+            continue
+        if lookup is not None:
+            lookups.append(lookup)
+        # missing fields stay missing, as in the python export
+        project[slug] = {"$cond": [{"$eq": [{"$type": path}, "missing"]}, "$$REMOVE", expr]}
+    return lookups + [{"$project": project}], python_fields
+
+
+def aggregate_rows(model, lang, batch_size=EXPORT_BATCH_SIZE, doc_ids=None):
+    '''yield (_id, csv row) of model exported by mongo, only the docs of doc_ids if given'''
+    pipeline, python_fields = compile_export_pipeline(model, lang)
+    if doc_ids is not None:
+        pipeline = [{"$match": {"_id": {"$in": list(doc_ids)}}}] + pipeline
+    exporters = compile_exporters(model, lang)
+    headers = {slug: header for slug, header, _ in exporters}
+    python_exporters = {slug: export for slug, _, export in exporters if slug in python_fields}
+    for doc in DB[f"{model}s"].aggregate(pipeline, batchSize=batch_size, allowDiskUse=True):
+        doc_id = doc.pop("_id")
+        for slug, export in python_exporters.items():
+            if slug in doc:
+                doc[slug] = export(doc[slug])
+        yield doc_id, {headers[slug]: value for slug, value in doc.items()}
+
+
+def export_model_aggregated(model="dataset", lang="fr", export_dir=os.path.join(data_dir, "export"), check=True):
+    '''
+    csv export of (model, lang) with rows flattened by mongo, opt-in alternative to
+    db_export_utils.export_model: unless check is False, a sample of PARITY_SAMPLE_SIZE documents
+    is first compared with the python exporter and the export is refused on any difference
+    '''
+    if check:
+        differences = check_export_parity(model, lang, PARITY_SAMPLE_SIZE)
+        if len(differences) > 0:
+            doc_id, header, cell, expected = differences[0]
+            raise ValueError(
+                f"Error: aggregation export of {model} differs from the python export "
+                f"({len(differences)} cells, e.g. {doc_id} {header}: {cell!r} != {expected!r}), "
+                "export with db_export_utils.export_model"
+            )
+    today_now = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+    if is_multilang_model(model):
+        filename = f"{model}_{lang}-{today_now}.csv"
+    else:
+        filename = f"{model}-{today_now}.csv"
+        lang = "en"
+    filepath = os.path.join(export_dir, filename)
+    headers = [header for _, header, _ in compile_exporters(model, lang)]
+    nb = 0
+    with open(filepath, "w", newline="") as fd:
+        csv_writer = csv.DictWriter(fd, fieldnames=headers)
+        csv_writer.writeheader()
+        for _, row in aggregate_rows(model, lang):
+            csv_writer.writerow(row)
+            nb += 1
+    print(f"{nb} {model}s exported into {filepath}")
+    return filepath
+
+
+def csv_cells(headers, row):
+    '''cells as written by csv.DictWriter'''
+    return [str(row[header]) if header in row else "" for header in headers]
+
+
+def check_export_parity(model="dataset", lang="fr", limit=0):
+    '''
+    compare the rows of the aggregation export with the python exporter
+    returns the differences [(_id, header, aggregation cell, python cell)]
+    '''
+    if not is_multilang_model(model):
+        lang = "en"
+    exporters = compile_exporters(model, lang)
+    headers = [header for _, header, _ in exporters]
+    start = time.perf_counter()
+    expected = {}
+    projection = {lang: 1} if is_multilang_model(model) else None
+    for doc in DB[f"{model}s"].find({}, projection).limit(limit).batch_size(EXPORT_BATCH_SIZE):
+        values = doc.get(lang, {}) if projection is not None else doc
+        expected[doc["_id"]] = csv_cells(headers, {
+            header: export(values[slug]) for slug, header, export in exporters if slug in values
+        })
+    python_time = time.perf_counter() - start
+    start = time.perf_counter()
+    differences = []
+    for doc_id, row in aggregate_rows(model, lang, doc_ids=expected if limit else None):
+        if doc_id not in expected:
+            continue
+        for header, cell, expected_cell in zip(headers, csv_cells(headers, row), expected[doc_id]):
+            if cell != expected_cell:
+                differences.append((doc_id, header, cell, expected_cell))
+    aggregation_time = time.perf_counter() - start
+    print(
+        f"{len(expected)} {model}s ({lang}): python {python_time:.2f}s, "
+        f"aggregation {aggregation_time:.2f}s, {len(differences)} differences"
+    )
+    return differences
+
+
+parser = argparse.ArgumentParser(description="Export models with rows flattened by a mongo aggregation")
+parser.add_argument("--model", default="dataset")
+parser.add_argument("--parity", action="store_true", help="compare with the python exporter instead of exporting")
+parser.add_argument("--limit", type=int, default=0, help="number of docs compared by --parity (0: all)")
+parser.add_argument("--no-check", action="store_true", help="export without comparing a sample with the python exporter")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    nb_differences = 0
+    for lang in ["fr", "en"]:
+        if args.parity:
+            differences = check_export_parity(args.model, lang, args.limit)
+            for doc_id, header, cell, expected in differences[:20]:
+                print(f"{doc_id} {header}: {cell!r} != {expected!r}")
+            nb_differences += len(differences)
+        else:
+            export_model_aggregated(args.model, lang, check=not args.no_check)
+    if nb_differences > 0:
+        raise SystemExit(1)
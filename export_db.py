@@ -7,6 +7,7 @@ import csv
 from utils import DB
 from utils import data_dir
 from utils import cast_type_for_export, is_multilang_model
+from utils import get_rule, get_rules
 
 
 def export_datasets(lang="fr"):
@@ -17,7 +18,7 @@ def export_datasets(lang="fr"):
     for dataset in DB.datasets.find({}, {"_id": 0}):
         dataset_row = {}
         for k, v in dataset.items():
-            rules = DB.rules.find_one({"model": "dataset", "slug": k}, {"_id": 0})
+            rules = get_rule("dataset", k)
             if rules is not None and "comment" not in k:
                 if rules["datatype"] == "bool":
                     dataset_row[k] = v
@@ -78,15 +79,10 @@ def export_to_csv(model="dataset", lang="fr"):
     filepath = os.path.join(data_dir, "export", filename)
     key_getter = {
             rule["slug"]: rule[f"name_{lang}"]
-            for rule in DB.rules.find(
-                {
-                    "model": model,
-                    "external_model": {"$ne": "comment"},
-                    "slug": {"$nin": ["_id", "id", "ID"]},
-                    "ITEM_order": {"$ne": -1},
-                },
-                {"_id": 0},
-            )
+            for rule in get_rules(model)
+            if rule["external_model"] != "comment"
+            and rule["slug"] not in ["_id", "id", "ID"]
+            and rule["ITEM_order"] != -1
         }
     
     headers = {v: "" for v in key_getter.values()}
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# file: export_sinks.py
+
+import io
+import csv
+import gzip
+import json
+
+# compression > file extension
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+# rows buffered before writing a parquet row group
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+def open_output(filepath, compression=None):
+    '''open a text file for writing, compressed on the fly with gzip or zstd'''
+    if compression is None:
+        return open(filepath, "w", newline="")
+    if compression == "gzip":
+        return gzip.open(filepath, "wt", newline="")
+    if compression == "zstd":
+        # optional dependency, only needed for zstd exports
+        import zstandard
+        raw = open(filepath, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw, closefd=True), newline="")
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def open_input(filepath):
+    '''open an exported file for reading, decompressed following its extension'''
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, "rt", newline="")
+    if filepath.endswith(".zst"):
+        import zstandard
+        raw = open(filepath, "rb")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), newline="")
+    return open(filepath, "r", newline="")
+
+
+class CsvSink:
+    '''
+    csv export of one lang: rows are built with the compiled exporters
+    of db_export_utils.compile_exporters(model, lang)
+    '''
+
+    def __init__(self, filepath, exporters, lang=None, compression=None):
+        self.filepath = filepath
+        self.exporters = exporters
+        self.lang = lang
+        self.rows = 0
+        self.file = open_output(filepath, compression)
+        self.writer = csv.DictWriter(self.file, fieldnames=[header for _, header, _ in exporters])
+        self.writer.writeheader()
+
+    def write(self, doc):
+        values = doc.get(self.lang, {}) if self.lang is not None else doc
+        self.writer.writerow({
+            header: export(values[slug])
+            for slug, header, export in self.exporters
+            if slug in values
+        })
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlSink:
+    '''jsonl export of the whole documents (every lang), one document per line'''
+
+    def __init__(self, filepath, compression=None):
+        self.filepath = filepath
+        self.rows = 0
+        self.file = open_output(filepath, compression)
+
+    def write(self, doc):
+        self.file.write(json.dumps(doc, ensure_ascii=False, default=str) + "\n")
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    '''
+    parquet export of one lang, same columns as the csv export (as strings)
+    rows are written by row groups of row_group_size so that memory stays bounded
+    requires pyarrow (parquet has its own compression: snappy)
+    '''
+
+    def __init__(self, filepath, exporters, lang=None, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        # optional dependency, only needed for parquet exports
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.filepath = filepath
+        self.exporters = exporters
+        self.lang = lang
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self.headers = [header for _, header, _ in exporters]
+        self.schema = pyarrow.schema([(header, pyarrow.string()) for header in self.headers])
+        self.writer = pyarrow.parquet.ParquetWriter(filepath, self.schema)
+        self.columns = {header: [] for header in self.headers}
+
+    def write(self, doc):
+        values = doc.get(self.lang, {}) if self.lang is not None else doc
+        for slug, header, export in self.exporters:
+            self.columns[header].append(str(export(values[slug])) if slug in values else None)
+        self.rows += 1
+        if len(self.headers) > 0 and len(self.columns[self.headers[0]]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.headers) == 0 or len(self.columns[self.headers[0]]) == 0:
+            return
+        self.writer.write_table(self.pyarrow.table(self.columns, schema=self.schema))
+        self.columns = {header: [] for header in self.headers}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
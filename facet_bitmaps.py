@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# file: facet_bitmaps.py
+
+# this module is also copied into the generated apps (see generate_api.generate_app):
+# it must only depend on the db and the ReferenceRegistry passed to FacetEngine
+
+import time
+import heapq
+import array
+import bisect
+import argparse
+import threading
+
+# values of a container kept as a sorted array, above it the container is a bitset
+ARRAY_CONTAINER_MAX = 4096
+CONTAINER_BYTES = 1 << 13
+# seconds between two checks of the version stamps of the facets (see FacetEngine.is_stale)
+FACETS_CHECK_INTERVAL = 5
+# seconds after which the bitmaps are rebuilt anyway: writes of other processes bump no stamp
+FACETS_MAX_AGE = 300
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:
+    def popcount(bits):
+        return bin(bits).count("1")
+
+
+def array_to_bitset(values):
+    data = bytearray(CONTAINER_BYTES)
+    for value in values:
+        data[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(data, "little")
+
+
+def bitset_to_array(bits):
+    data = bits.to_bytes(CONTAINER_BYTES, "little")
+    return array.array("H", [
+        i * 8 + j
+        for i, byte in enumerate(data) if byte
+        for j in range(8) if byte >> j & 1
+    ])
+
+
+def container_size(container):
+    return popcount(container) if isinstance(container, int) else len(container)
+
+
+def compact(container):
+    '''smallest representation of a container, None if empty'''
+    if isinstance(container, int):
+        size = popcount(container)
+        if size == 0:
+            return None
+        return bitset_to_array(container) if size <= ARRAY_CONTAINER_MAX else container
+    if len(container) == 0:
+        return None
+    return array_to_bitset(container) if len(container) > ARRAY_CONTAINER_MAX else container
+
+
+def copy_container(container):
+    return container if isinstance(container, int) else array.array("H", container)
+
+
+def as_bitset(container):
+    return container if isinstance(container, int) else array_to_bitset(container)
+
+
+def container_and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return compact(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return compact(array.array("H", [value for value in a if b >> value & 1]))
+    return compact(array.array("H", sorted(set(a).intersection(b))))
+
+
+def container_or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return compact(as_bitset(a) | as_bitset(b))
+    return compact(array.array("H", sorted(set(a).union(b))))
+
+
+def container_andnot(a, b):
+    if isinstance(a, int):
+        return compact(a & ~as_bitset(b))
+    if isinstance(b, int):
+        return compact(array.array("H", [value for value in a if not b >> value & 1]))
+    return compact(array.array("H", sorted(set(a).difference(b))))
+
+
+class Bitmap:
+    '''
+    Compressed bitmap of document numbers (roaring layout):
+    numbers are split by their 16 high bits into containers of the 16 low bits,
+    a container is a sorted array while it holds at most ARRAY_CONTAINER_MAX values
+    and a 65536 bits bitset above. &, |, - and len() work container by container
+    '''
+    __slots__ = ["containers"]
+
+    def __init__(self, values=(), containers=None):
+        self.containers = containers if containers is not None else {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        high, low = value >> 16, value & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array.array("H", [low])
+        elif isinstance(container, int):
+            self.containers[high] = container | (1 << low)
+        else:
+            i = bisect.bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return
+            container.insert(i, low)
+            if len(container) > ARRAY_CONTAINER_MAX:
+                self.containers[high] = array_to_bitset(container)
+
+    def discard(self, value):
+        high, low = value >> 16, value & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = compact(container & ~(1 << low))
+        else:
+            i = bisect.bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                del container[i]
+            container = compact(container)
+        if container is None:
+            del self.containers[high]
+        else:
+            self.containers[high] = container
+
+    def __contains__(self, value):
+        container = self.containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        i = bisect.bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self):
+        return sum(container_size(container) for container in self.containers.values())
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, int):
+                container = bitset_to_array(container)
+            for low in container:
+                yield high << 16 | low
+
+    def __and__(self, other):
+        containers = {}
+        for high in set(self.containers).intersection(other.containers):
+            container = container_and(self.containers[high], other.containers[high])
+            if container is not None:
+                containers[high] = container
+        return Bitmap(containers=containers)
+
+    def __or__(self, other):
+        containers = {high: copy_container(container) for high, container in self.containers.items()}
+        for high, container in other.containers.items():
+            if high in containers:
+                containers[high] = container_or(containers[high], container)
+            else:
+                containers[high] = copy_container(container)
+        return Bitmap(containers=containers)
+
+    def __sub__(self, other):
+        containers = {}
+        for high, container in self.containers.items():
+            if high in other.containers:
+                container = container_andnot(container, other.containers[high])
+            else:
+                container = copy_container(container)
+            if container is not None:
+                containers[high] = container
+        return Bitmap(containers=containers)
+
+    def copy(self):
+        return Bitmap() | self
+
+
+class FacetEngine:
+    '''
+    Filters and counts of the facets of a model from bitmaps of documents:
+    one Bitmap per (facet field, value, lang), built from the is_facet rules
+    - controlled facets have a bitmap for every name of their ref_* table (counts of 0 included),
+    document values (names in any lang or uris) are resolved into names of the lang
+    - organizations are counted by name, booleans by True/False
+    - filter(): values of a field are or'ed (disjunctive), fields are and'ed (conjunctive)
+    - counts(): per value counts, each field counted with the filters of the other fields
+    - add(), remove() and update() keep the bitmaps in sync with writes
+    - is_stale() once the version stamp (db.versions) of the rules, of the model collection
+    or of a reference table changed since build(), checked at most every check_interval seconds,
+    or max_age seconds after build()
+    Documents are numbered, the numbers of removed documents are reused (smallest first)
+    '''
+
+    def __init__(self, db, model, langs=("fr", "en"), references=None,
+                 check_interval=FACETS_CHECK_INTERVAL, max_age=FACETS_MAX_AGE):
+        self.db = db
+        self.model = model
+        self.langs = list(langs)
+        self.references = references
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.rules = {}
+        self.ids = []
+        self.free = []
+        self.numbers = {}
+        self.all = Bitmap()
+        self.bitmaps = {}
+        self.versions = {}
+        self.built_at = None
+        self.checked_at = 0
+
+    def build(self):
+        '''(re)build every bitmap from the rules, the reference tables and the documents'''
+        start = time.perf_counter()
+        with self.lock:
+            self.rules = {
+                rule["slug"]: rule
+                for rule in self.db.rules.find({"model": self.model, "is_facet": True}, {"_id": 0})
+            }
+            self.ids = []
+            self.free = []
+            self.numbers = {}
+            self.all = Bitmap()
+            self.bitmaps = {}
+            self.versions = self.get_versions()
+            for slug, rule in self.rules.items():
+                for lang in self.langs:
+                    values = self.bitmaps[(slug, lang)] = {}
+                    if self.is_controlled(rule):
+                        for name in self.references.values(rule["reference_table"], f"name_{lang}"):
+                            if name is not None and name != "":
+                                values[name] = Bitmap()
+                    elif rule["datatype"] == "boolean":
+                        values[True] = Bitmap()
+                        values[False] = Bitmap()
+            projection = {"_id": 1}
+            for slug in self.rules:
+                projection[slug] = 1
+                projection.update({f"{lang}.{slug}": 1 for lang in self.langs})
+            for doc in self.db[f"{self.model}s"].find({}, projection):
+                self.add_doc(doc)
+            self.built_at = time.time()
+            self.checked_at = time.monotonic()
+        print(
+            f"Facets of {len(self.numbers)} {self.model}s built in {time.perf_counter() - start:.3f}s "
+            f"({sum(len(values) for values in self.bitmaps.values())} bitmaps)"
+        )
+        return self
+
+    def get_versions(self):
+        '''version stamps of the rules, of the model collection and of the reference tables of the facets'''
+        names = ["rules", f"{self.model}s"] + sorted({
+            rule["reference_table"] for rule in self.rules.values() if self.is_controlled(rule)
+        })
+        stamps = {stamp["_id"]: stamp["version"] for stamp in self.db.versions.find({"_id": {"$in": names}})}
+        return {name: stamps.get(name) for name in names}
+
+    def is_stale(self):
+        '''true if never built, too old, or if a version stamp changed since build()'''
+        if self.built_at is None or time.time() - self.built_at >= self.max_age:
+            return True
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval:
+            return False
+        self.checked_at = now
+        return self.get_versions() != self.versions
+
+    def is_controlled(self, rule):
+        return self.references is not None and rule.get("is_controled") is True and rule.get("reference_table", "") != ""
+
+    def doc_values(self, rule, doc, lang):
+        '''facet values of a document in lang'''
+        values = doc[lang] if isinstance(doc.get(lang), dict) else doc
+        values = values.get(rule["slug"])
+        if not isinstance(values, list):
+            values = [values]
+        keys = []
+        for value in values:
+            if isinstance(value, dict):
+                # organizations: {_id, fr: {name, ...}, en: {...}} or {name, ...}
+                value = value[lang] if isinstance(value.get(lang), dict) else value
+                value = value.get("name")
+            if value is None or value == "":
+                continue
+            keys.append(value)
+        if self.is_controlled(rule):
+            keys = self.references.names(rule["reference_table"], keys, lang)
+        return keys
+
+    def add_doc(self, doc):
+        doc_id = str(doc["_id"])
+        if len(self.free) > 0:
+            number = heapq.heappop(self.free)
+            self.ids[number] = doc_id
+        else:
+            number = len(self.ids)
+            self.ids.append(doc_id)
+        self.numbers[doc_id] = number
+        self.all.add(number)
+        for slug, rule in self.rules.items():
+            for lang in self.langs:
+                values = self.bitmaps[(slug, lang)]
+                for value in self.doc_values(rule, doc, lang):
+                    values.setdefault(value, Bitmap()).add(number)
+
+    def remove_doc(self, doc_id):
+        number = self.numbers.pop(str(doc_id), None)
+        if number is None:
+            return False
+        self.ids[number] = None
+        heapq.heappush(self.free, number)
+        self.all.discard(number)
+        for values in self.bitmaps.values():
+            for bitmap in values.values():
+                bitmap.discard(number)
+        return True
+
+    def add(self, doc):
+        '''add a new mongo document'''
+        with self.lock:
+            self.add_doc(doc)
+
+    def remove(self, doc_id):
+        with self.lock:
+            return self.remove_doc(doc_id)
+
+    def update(self, doc):
+        '''replace the values of a mongo document (added if new)'''
+        with self.lock:
+            self.remove_doc(doc["_id"])
+            self.add_doc(doc)
+
+    def field_filter(self, slug, values, lang):
+        '''documents having one of values in field slug'''
+        if (slug, lang) not in self.bitmaps:
+            raise ValueError(f"{slug} is not a facet of {self.model}")
+        if not isinstance(values, list):
+            values = [values]
+        bitmaps = self.bitmaps[(slug, lang)]
+        result = Bitmap()
+        for value in values:
+            if value in bitmaps:
+                result = result | bitmaps[value]
+        return result
+
+    def filter(self, filters, lang="fr", exclude=None):
+        '''bitmap of the documents matching every field of filters {slug: value or [values]}'''
+        result = self.all
+        for slug, values in filters.items():
+            if slug != exclude:
+                result = result & self.field_filter(slug, values, lang)
+        return result
+
+    def documents(self, filters, lang="fr"):
+        '''ids of the documents matching filters, by document number'''
+        with self.lock:
+            return [self.ids[number] for number in self.filter(filters, lang)]
+
+    def counts(self, filters=None, lang="fr"):
+        '''{slug: {value: number of documents}} of every facet under filters'''
+        filters = filters or {}
+        counts = {}
+        with self.lock:
+            for slug in self.rules:
+                matching = self.filter(filters, lang, exclude=slug)
+                counts[slug] = {
+                    value: len(matching & bitmap)
+                    for value, bitmap in self.bitmaps[(slug, lang)].items()
+                }
+        return counts
+
+
+def benchmark_facets(engine, lang="fr", repeat=100):
+    '''time filters and counts of one and two values of every facet'''
+    engine.build()
+    timings = {}
+    for slug, values in engine.counts(lang=lang).items():
+        top = [value for value, _ in sorted(values.items(), key=lambda item: -item[1])[:2]]
+        if len(top) == 0:
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            engine.documents({slug: top}, lang)
+        filter_time = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        for _ in range(repeat):
+            engine.counts({slug: top[:1]}, lang)
+        counts_time = (time.perf_counter() - start) / repeat
+        timings[slug] = {"filter_us": round(filter_time * 1e6, 1), "counts_us": round(counts_time * 1e6, 1)}
+        print(f"{slug}: filter {timings[slug]['filter_us']}us, counts {timings[slug]['counts_us']}us")
+    return timings
+
+
+parser = argparse.ArgumentParser(description="Build the facet bitmaps of a model and time filters and counts")
+parser.add_argument("--model", default="dataset")
+parser.add_argument("--lang", default="fr")
+
+
+if __name__ == "__main__":
+    from clients import get_db
+    from reference_utils import ReferenceRegistry
+    args = parser.parse_args()
+    db = get_db()
+    benchmark_facets(FacetEngine(db, args.model, references=ReferenceRegistry(db)), args.lang)
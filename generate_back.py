@@ -7,8 +7,9 @@ import argparse
 import shutil
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pathlib import Path
-from utils import DB
+from utils import DB, RULES
 from utils import data_dir
+from clients import SEARCH_DIR
 from utils import AVAILABLE_LANG
 from utils import get_rules, is_facet_model, is_multilang_model, is_search_model
 
@@ -46,7 +47,7 @@ def get_model_name_list():
     build a list of model with [(model_name, lang, ModelName),...]
     """
     models = [("rule", "", "Rules")]
-    for model_name in DB["rules"].distinct("model"):
+    for model_name in RULES.models():
         modelName = model_name.title()
         if is_multilang_model(model_name):
             for lang in AVAILABLE_LANG:
@@ -196,7 +197,7 @@ def generate_model_lines(model_name):
 
 def generate_services_lines(model_name):
     return [
-        "from .services import es, index_document, get_indexed_fieldnames, search_documents, sync_get_filters"
+        "from .services import es, index_document, get_indexed_fieldnames, search_documents, sync_get_filters, get_filter_query, filter_documents"
     ]
 
 
@@ -222,7 +223,7 @@ def get_external_model(external_model_name, lang):
 
 
 def get_filter_rules(model_name):
-    return DB.rules.find({"model": model_name, "is_facet": True}, {"_id": 0})
+    return [rule for rule in get_rules(model_name) if rule["is_facet"]]
 
 
 def build_filter_model_properties(model_name, lang):
@@ -421,7 +422,7 @@ def generate_services(model_name, output_file):
     """Write services.py file from model_name"""
     template = env.get_template("services.tpl")
     with open(output_file, "w") as f:
-        py_file = template.render(model_name=model_name)
+        py_file = template.render(model_name=model_name, search_dir=SEARCH_DIR)
         f.write(py_file)
 
 
@@ -460,8 +461,12 @@ def generate_app(back_name="test_back"):
         os.makedirs(back_dir)
     if not os.path.exists(apps_dir):
         os.makedirs(apps_dir)
+    # services of the generated app resolve controlled vocabularies, search and filter with them
+    shutil.copy(os.path.join(curr_dir, "reference_utils.py"), apps_dir)
+    shutil.copy(os.path.join(curr_dir, "search_backend.py"), apps_dir)
+    shutil.copy(os.path.join(curr_dir, "facet_bitmaps.py"), apps_dir)
     print("Creating app")
-    model_list = DB.rules.distinct("model") + ["rule"]
+    model_list = RULES.models() + ["rule"]
     for i, model_name in enumerate(model_list):
         if i == 0:
             generate_endpoint(apps_dir, model_name, previous_models=[])
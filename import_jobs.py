@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# file: import_jobs.py
+
+import os
+import hashlib
+import datetime
+
+# collection storing the checkpoints of long running imports
+JOBS_COLLECTION = "_jobs"
+
+
+def file_signature(filepath):
+    '''size and modification time of a file, a checkpoint is only valid for the same file'''
+    if filepath is None or not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ImportJob:
+    '''
+    Checkpoints of an import stored in db._jobs:
+    file, last committed csv row, number of committed batches and finished steps
+    - items(rows) numbers csv rows and skips the ones committed by the resumed run
+    - write(bulk_writer, docs) inserts docs under an _id derived from (job, run, row number):
+    a row written again by a resumed run is rejected as a duplicate, so that writes happen
+    exactly once. Each new run draws a new run id: rerunning a job (or a reordered file)
+    never collides with the rows of a previous run
+    - commit(rows) is the on_flush callback of the BulkWriter: the checkpoint moves
+    once a batch is acknowledged by mongo
+    - steps (e.g. reference tables) are marked done with mark(), is_done() on resume
+    resume=True continues the last unfinished run of job_id if its file is unchanged
+    '''
+
+    def __init__(self, db, job_id, filepath=None, resume=False):
+        self.collection = db[JOBS_COLLECTION]
+        self.job_id = job_id
+        self.filepath = filepath
+        self.signature = file_signature(filepath)
+        self.row = 0
+        self.batches = 0
+        self.steps = []
+        self.resumed = False
+        self.run = os.urandom(8).hex()
+        job = self.collection.find_one({"_id": job_id})
+        if resume and job is not None:
+            if job["status"] == "done":
+                print(f"Job {job_id} already done, starting over")
+            elif job["signature"] != self.signature:
+                print(f"Job {job_id}: {filepath} changed since the last run, starting over")
+            else:
+                self.row = job["row"]
+                self.batches = job["batches"]
+                self.steps = job["steps"]
+                # runs checkpointed before run ids keep the ids of (job, row number)
+                self.run = job.get("run")
+                self.resumed = True
+                print(f"Job {job_id}: resuming after row {self.row} ({self.batches} batches committed)")
+        self.collection.replace_one({"_id": job_id}, {
+            "file": filepath,
+            "signature": self.signature,
+            "run": self.run,
+            "status": "running",
+            "row": self.row,
+            "batches": self.batches,
+            "steps": self.steps,
+            "error": None,
+            "started": datetime.datetime.now(),
+            "updated": datetime.datetime.now(),
+        }, upsert=True)
+
+    def update(self, **values):
+        values["updated"] = datetime.datetime.now()
+        self.collection.update_one({"_id": self.job_id}, {"$set": values})
+
+    def items(self, rows):
+        '''yield (row, {"row": number}) for rows after the checkpoint, numbers start at 1'''
+        for number, row in enumerate(rows, start=1):
+            if number > self.row:
+                yield row, {"row": number}
+
+    def doc_id(self, number):
+        from bson import ObjectId
+        key = f"{self.job_id}:{number}" if self.run is None else f"{self.job_id}:{self.run}:{number}"
+        return ObjectId(hashlib.sha1(key.encode("utf-8")).hexdigest()[:24])
+
+    def write(self, bulk_writer, docs):
+        '''write docs produced from items(), their "_import" meta is removed'''
+        for doc in docs:
+            meta = doc.pop("_import")
+            doc["_id"] = self.doc_id(meta["row"])
+            bulk_writer.insert(doc, row=meta["row"])
+        return docs
+
+    def commit(self, rows):
+        '''checkpoint after a flushed batch of rows'''
+        self.batches += 1
+        self.row = max([self.row] + [row for row in rows if isinstance(row, int)])
+        self.update(row=self.row, batches=self.batches)
+
+    def is_done(self, step):
+        return step in self.steps
+
+    def mark(self, step):
+        self.steps.append(step)
+        self.update(steps=self.steps)
+
+    def finish(self):
+        self.update(status="done")
+
+    def fail(self, error):
+        self.update(status="failed", error=repr(error))
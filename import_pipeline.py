@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# file: import_pipeline.py
+
+import time
+import queue
+import threading
+
+# number of chunks waiting between two stages
+QUEUE_SIZE = 4
+
+STOP = object()
+
+
+class Stage:
+    '''
+    One step of an import pipeline
+    - func takes a chunk (list of rows) and returns the transformed chunk
+    - each stage runs in a single thread so that chunks leave it in order
+      (import jobs checkpoint the last written row, see ImportJob.commit)
+    '''
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.rows = 0
+        self.seconds = 0.0
+
+    def record(self, nb_rows, seconds):
+        self.rows += nb_rows
+        self.seconds += seconds
+
+    def rows_per_second(self):
+        if self.seconds == 0:
+            return 0
+        return round(self.rows / self.seconds, 1)
+
+
+class ImportPipeline:
+    '''
+    Streams rows through stages (e.g. read > cast > translate > validate > write)
+    running in their own threads and linked by bounded queues,
+    so that memory stays constant whatever the size of the source
+    '''
+
+    def __init__(self, stages, chunk_size=200, queue_size=QUEUE_SIZE, name="import"):
+        self.stages = stages
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.name = name
+        self.read = Stage("read", None)
+        self.errors = []
+        self.failed = threading.Event()
+
+    def run_worker(self, stage, inbox, outbox):
+        while True:
+            chunk = inbox.get()
+            if chunk is STOP:
+                break
+            if self.failed.is_set():
+                # drain the queue so that upstream stages are not blocked
+                continue
+            start = time.perf_counter()
+            try:
+                chunk = stage.func(chunk)
+            except Exception as e:
+                self.errors.append((stage.name, e))
+                self.failed.set()
+                continue
+            stage.record(len(chunk), time.perf_counter() - start)
+            if outbox is not None:
+                outbox.put(chunk)
+        if outbox is not None:
+            outbox.put(STOP)
+
+    def read_rows(self, rows, outbox):
+        '''put the rows into the first queue by chunks, until the end or a failed stage'''
+        chunk = []
+        start = time.perf_counter()
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                self.read.record(len(chunk), time.perf_counter() - start)
+                outbox.put(chunk)
+                chunk = []
+                if self.failed.is_set():
+                    return
+                start = time.perf_counter()
+        if len(chunk) > 0 and not self.failed.is_set():
+            self.read.record(len(chunk), time.perf_counter() - start)
+            outbox.put(chunk)
+
+    def run(self, rows):
+        '''run the pipeline on an iterable of rows, return the stage statistics'''
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i+1] if i + 1 < len(self.stages) else None
+            thread = threading.Thread(target=self.run_worker, args=(stage, queues[i], outbox), daemon=True)
+            thread.start()
+            threads.append(thread)
+        try:
+            self.read_rows(rows, queues[0])
+        except BaseException:
+            # a failing source: the stages drop the chunks already read
+            self.failed.set()
+            raise
+        finally:
+            # the stages always stop, they drain their queue so these puts never block
+            queues[0].put(STOP)
+            for thread in threads:
+                thread.join()
+        if len(self.errors) > 0:
+            stage_name, error = self.errors[0]
+            print(f"Error in {self.name} stage {stage_name}: {error}")
+            raise error
+        self.report()
+        return self.stats()
+
+    def stats(self):
+        return {
+            stage.name: {"rows": stage.rows, "rows_per_second": stage.rows_per_second()}
+            for stage in [self.read] + self.stages
+        }
+
+    def report(self):
+        for stage_name, stats in self.stats().items():
+            print(f"{self.name} {stage_name}: {stats['rows']} rows ({stats['rows_per_second']} rows/s)")
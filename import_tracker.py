@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# file: import_tracker.py
+
+import re
+import json
+import hashlib
+import datetime
+import itertools
+
+from bulk_utils import BulkWriter
+
+# collection storing the content hash of every imported csv row
+IMPORTS_COLLECTION = "_imports"
+
+
+def row_hash(row):
+    '''content hash of a csv row'''
+    return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ImportTracker:
+    '''
+    Incremental import of a csv into a collection
+    - diff() keeps only the rows whose content hash changed since the last import
+    - upsert() writes them (docs carry their row meta under "_import")
+    - tombstone() deletes the docs whose row disappeared from the csv and keeps a tombstone
+    - changes lists the ids inserted, updated and deleted so that indexing can stay incremental
+    - a full import drops the collection: reset() forgets its rows before they are upserted,
+    or record() stores the hashes of the rows written by an ImportJob
+    Rows are identified by key_field if given, else by their content hash and their occurrence
+    in the run: the n-th identical row is keyed "<hash>:<n>" (n > 1), so that duplicated rows
+    each keep their own doc
+    '''
+
+    def __init__(self, db, collection_name, key_field=None):
+        self.db = db
+        self.collection_name = collection_name
+        self.key_field = key_field
+        self.run = datetime.datetime.now()
+        self.changes = {"inserted": [], "updated": [], "deleted": []}
+        self.occurrences = {}
+        self.hash_writer = BulkWriter(db[IMPORTS_COLLECTION], name=f"{IMPORTS_COLLECTION} {collection_name}")
+
+    def row_id(self, key):
+        return f"{self.collection_name}:{key}"
+
+    def reset(self):
+        '''forget every row of the collection (dropped by a full import)'''
+        self.db[IMPORTS_COLLECTION].delete_many({"_id": {"$regex": f"^{re.escape(self.collection_name)}:"}})
+
+    def meta(self, row):
+        '''{"key", "hash", "doc_id": None} of a row, rows must be passed in csv order'''
+        content_hash = row_hash(row)
+        if self.key_field is not None and row.get(self.key_field, "") != "":
+            key = row[self.key_field]
+        else:
+            occurrence = self.occurrences.get(content_hash, 0) + 1
+            self.occurrences[content_hash] = occurrence
+            key = content_hash if occurrence == 1 else f"{content_hash}:{occurrence}"
+        return {"key": key, "hash": content_hash, "doc_id": None}
+
+    def diff(self, rows):
+        '''return [(row, meta)] for new or changed rows and mark every row as seen'''
+        metas = [self.meta(row) for row in rows]
+        stored = {
+            imported["_id"]: imported
+            for imported in self.db[IMPORTS_COLLECTION].find(
+                {"_id": {"$in": [self.row_id(m["key"]) for m in metas]}}
+            )
+        }
+        changed = []
+        for row, meta in zip(rows, metas):
+            imported = stored.get(self.row_id(meta["key"]))
+            if imported is not None and not imported["deleted"]:
+                meta["doc_id"] = imported["doc_id"]
+                if imported["hash"] == meta["hash"]:
+                    continue
+            changed.append((row, meta))
+        if len(stored) > 0:
+            self.db[IMPORTS_COLLECTION].update_many(
+                {"_id": {"$in": list(stored)}}, {"$set": {"run": self.run}}
+            )
+        return changed
+
+    def upsert(self, bulk_writer, docs):
+        '''write docs produced from diff() rows, their "_import" meta is removed'''
+        from bson import ObjectId
+        from pymongo import ReplaceOne
+        for doc in docs:
+            meta = doc.pop("_import")
+            if meta["doc_id"] is None:
+                doc_id = ObjectId()
+                self.changes["inserted"].append(doc_id)
+            else:
+                doc_id = meta["doc_id"]
+                self.changes["updated"].append(doc_id)
+            doc["_id"] = doc_id
+            bulk_writer.add(ReplaceOne({"_id": doc_id}, doc, upsert=True), row=meta["key"])
+            self.store(meta, doc_id)
+        return docs
+
+    def store(self, meta, doc_id):
+        from pymongo import UpdateOne
+        self.hash_writer.add(UpdateOne(
+            {"_id": self.row_id(meta["key"])},
+            {"$set": {
+                "collection": self.collection_name,
+                "key": meta["key"],
+                "hash": meta["hash"],
+                "doc_id": doc_id,
+                "run": self.run,
+                "deleted": False,
+                "date": datetime.datetime.now(),
+            }},
+            upsert=True,
+        ))
+
+    def record(self, items, chunk_size=1000):
+        '''
+        store the hashes of a full import from [(csv row, doc id)] in csv order, replacing the
+        rows known for the collection: the next incremental import only applies changed rows.
+        Rows whose doc was not written (invalid or failed) are left out and inserted next time
+        '''
+        self.reset()
+        self.occurrences = {}
+        items = iter(items)
+        recorded = 0
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if len(chunk) == 0:
+                break
+            written = {
+                doc["_id"]
+                for doc in self.db[self.collection_name].find({"_id": {"$in": [doc_id for _, doc_id in chunk]}}, {"_id": 1})
+            }
+            for row, doc_id in chunk:
+                meta = self.meta(row)
+                if doc_id in written:
+                    self.store(meta, doc_id)
+                    recorded += 1
+        self.hash_writer.flush()
+        print(f"{self.collection_name}: hashes of {recorded} rows recorded")
+        return recorded
+
+    def tombstone(self):
+        '''delete docs of rows not seen during this run'''
+        query = {"collection": self.collection_name, "run": {"$ne": self.run}, "deleted": False}
+        doc_ids = [imported["doc_id"] for imported in self.db[IMPORTS_COLLECTION].find(query, {"doc_id": 1})]
+        for i in range(0, len(doc_ids), 1000):
+            self.db[self.collection_name].delete_many({"_id": {"$in": doc_ids[i:i+1000]}})
+        self.db[IMPORTS_COLLECTION].update_many(
+            query, {"$set": {"deleted": True, "date": datetime.datetime.now()}}
+        )
+        self.changes["deleted"].extend(doc_ids)
+        return doc_ids
+
+    def finish(self, bulk_writer):
+        '''
+        after bulk_writer is flushed: store hashes, forget rows that failed to be written
+        so that they are retried next time, then tombstone disappeared rows
+        '''
+        self.hash_writer.flush()
+        failed = [self.row_id(error["row"]) for error in bulk_writer.errors]
+        if len(failed) > 0:
+            self.db[IMPORTS_COLLECTION].update_many({"_id": {"$in": failed}}, {"$set": {"hash": ""}})
+        self.tombstone()
+        print(
+            f"{self.collection_name}: {len(self.changes['inserted'])} new, "
+            f"{len(self.changes['updated'])} changed, {len(self.changes['deleted'])} deleted"
+        )
+        return self.changes
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# file: index_bulk.py
+
+import time
+import queue
+import threading
+
+# actions sent in one _bulk request
+INDEX_CHUNK_SIZE = 500
+# max size of one _bulk request
+INDEX_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+# threads sending _bulk requests
+INDEX_WORKERS = 4
+# retries of documents rejected with 429 (too many requests), with exponential backoff
+INDEX_MAX_RETRIES = 5
+INDEX_INITIAL_BACKOFF = 2
+
+STOP = object()
+
+
+class BulkIndexer:
+    '''
+    Send index actions to elasticsearch through the _bulk API
+    - `workers` threads each stream chunks of chunk_size actions (at most max_chunk_bytes)
+    - documents rejected with 429 are retried max_retries times with exponential backoff
+    - errors are collected per document instead of stopping the indexation
+    - report() prints counts and throughput
+    Used as a context manager, pending actions are sent and reported on exit
+    '''
+
+    def __init__(self, client, workers=INDEX_WORKERS, chunk_size=INDEX_CHUNK_SIZE,
+                 max_chunk_bytes=INDEX_MAX_CHUNK_BYTES, max_retries=INDEX_MAX_RETRIES,
+                 initial_backoff=INDEX_INITIAL_BACKOFF, name="index"):
+        self.client = client
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.name = name
+        self.errors = []
+        self.nb_actions = 0
+        self.success = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(chunk_size * workers * 2)
+        self.threads = []
+        self.start = time.perf_counter()
+        for _ in range(workers):
+            thread = threading.Thread(target=self.run_worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def actions(self, state):
+        while True:
+            action = self.queue.get()
+            if action is STOP:
+                state["stopped"] = True
+                return
+            yield action
+
+    def run_worker(self):
+        state = {"stopped": False}
+        try:
+            self.send(state)
+        except Exception as e:
+            with self.lock:
+                self.errors.append({"index": None, "id": None, "op": None, "status": None, "error": repr(e)})
+            # drain the queue so that add() is not blocked
+            if not state["stopped"]:
+                for _ in self.actions(state):
+                    pass
+
+    def send(self, state):
+        from elasticsearch7.helpers import streaming_bulk
+        results = streaming_bulk(
+            self.client,
+            self.actions(state),
+            chunk_size=self.chunk_size,
+            max_chunk_bytes=self.max_chunk_bytes,
+            max_retries=self.max_retries,
+            initial_backoff=self.initial_backoff,
+            raise_on_error=False,
+            raise_on_exception=False,
+        )
+        for ok, item in results:
+            with self.lock:
+                if ok:
+                    self.success += 1
+                    continue
+                op, result = next(iter(item.items()))
+                if op == "delete" and result.get("status") == 404:
+                    # the document was already missing from the index
+                    self.success += 1
+                    continue
+                self.errors.append({
+                    "index": result.get("_index"),
+                    "id": result.get("_id"),
+                    "op": op,
+                    "status": result.get("status"),
+                    "error": result.get("error", result.get("exception")),
+                })
+
+    def add(self, action):
+        '''queue a bulk action, e.g. {"_index": ..., "_id": ..., "_source": {...}}'''
+        self.nb_actions += 1
+        self.queue.put(action)
+
+    def close(self):
+        '''send pending actions and wait for the workers'''
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "name": self.name,
+            "actions": self.nb_actions,
+            "success": self.success,
+            "errors": len(self.errors),
+            "seconds": round(elapsed, 3),
+            "docs_per_second": round(self.nb_actions / elapsed, 1) if elapsed > 0 else 0,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            f"{stats['name']}: {stats['actions']} actions, {stats['success']} indexed, "
+            f"{stats['errors']} errors in {stats['seconds']}s ({stats['docs_per_second']} docs/s)"
+        )
+        for error in self.errors:
+            print(f"Error {error['index']} {error['id']} ({error['status']}): {error['error']}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        if exc_type is None:
+            self.report()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# file: index_sync.py
+
+import time
+import datetime
+import argparse
+from .utils import AVAILABLE_LANG as LANGS
+from .utils import DB
+from .clients import get_es
+from .index_bulk import BulkIndexer
+from .index_utils import get_index_name, build_index_doc, select_index_fields, reconcile_index
+
+# collection storing the change stream resume token of the sync
+SYNC_COLLECTION = "_sync"
+SYNC_ID = "index_sync"
+SYNC_MODELS = ["dataset", "organization"]
+# changes sent in one batch of _bulk requests
+SYNC_BATCH_SIZE = 500
+# max seconds a change waits before its batch is sent
+SYNC_MAX_WAIT = 1.0
+# a batch with failed documents is sent again SYNC_MAX_RETRIES times (backoff in seconds, doubled)
+SYNC_MAX_RETRIES = 3
+SYNC_RETRY_BACKOFF = 2
+# events of a document, others (create, createIndexes, modify...) have no documentKey
+DOCUMENT_OPERATIONS = ["insert", "update", "replace", "delete"]
+# events after which the indexes are reconciled and the change stream re-opened
+RESET_OPERATIONS = ["drop", "rename", "dropDatabase", "invalidate"]
+
+
+class IndexSync:
+    '''
+    Keep the elasticsearch indexes in sync with mongo by tailing a change stream
+    on the model collections (mongo must run as a replica set)
+    - inserted, updated and replaced docs are projected per lang with the index rules
+    and indexed, deleted docs are removed from every lang index
+    - changes are sent by batches of batch_size or every max_wait seconds
+    - the resume token is stored in db._sync once every document of a batch is indexed,
+    a restarted sync continues where it stopped. A batch with failed documents is retried
+    max_retries times, then the sync stops without moving the token
+    - the lag between a change in mongo and its indexation is reported per batch
+    - a dropped or renamed collection (or database) reconciles the indexes with mongo
+    and re-opens the stream, other events without a document are skipped
+    '''
+
+    def __init__(self, models=SYNC_MODELS, langs=LANGS, batch_size=SYNC_BATCH_SIZE, max_wait=SYNC_MAX_WAIT,
+                 max_retries=SYNC_MAX_RETRIES, retry_backoff=SYNC_RETRY_BACKOFF):
+        self.models = {f"{model}s": model for model in models}
+        self.langs = list(langs)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.changes = 0
+        self.max_lag = 0.0
+
+    def load_token(self):
+        state = DB[SYNC_COLLECTION].find_one({"_id": SYNC_ID})
+        if state is None:
+            return None
+        return state["resume_token"]
+
+    def save_token(self, resume_token):
+        DB[SYNC_COLLECTION].update_one(
+            {"_id": SYNC_ID},
+            {"$set": {"resume_token": resume_token, "date": datetime.datetime.now()}},
+            upsert=True,
+        )
+
+    def actions(self, change):
+        '''bulk actions of a change event for every lang index'''
+        if change["operationType"] not in DOCUMENT_OPERATIONS:
+            return []
+        model = self.models[change["ns"]["coll"]]
+        doc_id = str(change["documentKey"]["_id"])
+        doc = change.get("fullDocument")
+        if change["operationType"] == "delete" or doc is None:
+            return [
+                {"_op_type": "delete", "_index": get_index_name(model, lang), "_id": doc_id}
+                for lang in self.langs
+            ]
+        doc = select_index_fields(model, doc, self.langs)
+        return [
+            {"_index": get_index_name(model, lang), "_id": doc_id, "_source": build_index_doc(model, doc, lang)}
+            for lang in self.langs
+            if lang in doc
+        ]
+
+    def index_batch(self, batch):
+        '''index the changes of batch, returns the errors of the failed documents'''
+        with BulkIndexer(get_es(), workers=1, name="sync") as indexer:
+            for change in batch:
+                for action in self.actions(change):
+                    indexer.add(action)
+        return indexer.errors
+
+    def send(self, batch, resume_token):
+        '''index batch (retried while documents fail) then store resume_token'''
+        for attempt in range(self.max_retries + 1):
+            errors = self.index_batch(batch)
+            if len(errors) == 0:
+                break
+            if attempt < self.max_retries:
+                backoff = self.retry_backoff * 2 ** attempt
+                print(f"Error: {len(errors)} documents not synced, batch retried in {backoff}s")
+                time.sleep(backoff)
+        else:
+            # the changes are replayed from the stored token by the next run
+            raise RuntimeError(f"{len(errors)} documents could not be synced after {self.max_retries} retries")
+        self.save_token(resume_token)
+        now = time.time()
+        lags = [now - change["clusterTime"].time for change in batch if "clusterTime" in change]
+        self.changes += len(batch)
+        if len(lags) > 0:
+            self.max_lag = max(self.max_lag, max(lags))
+            print(
+                f"Synced {len(batch)} changes ({self.changes} in total), "
+                f"lag avg {sum(lags) / len(lags):.2f}s max {max(lags):.2f}s"
+            )
+
+    def watch(self, resume_token):
+        pipeline = [{"$match": {"$or": [
+            {"ns.coll": {"$in": list(self.models)}},
+            {"to.coll": {"$in": list(self.models)}},
+            {"operationType": {"$in": ["dropDatabase", "invalidate"]}},
+        ]}}]
+        return DB.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=resume_token,
+            max_await_time_ms=int(self.max_wait * 1000),
+        )
+
+    def reset(self):
+        '''open a stream from now and reconcile the indexes with mongo'''
+        # opened first: changes made during the reconciliation are synced afterwards
+        stream = self.watch(None)
+        for model in self.models.values():
+            reconcile_index(model, self.langs)
+        if stream.resume_token is not None:
+            self.save_token(stream.resume_token)
+        return stream
+
+    def tail(self, stream, saved_token):
+        '''sync the changes of stream, returns the re-opened stream after a reset event (else None)'''
+        batch = []
+        started = time.monotonic()
+        while stream.alive:
+            change = stream.try_next()
+            if change is not None and change["operationType"] in RESET_OPERATIONS:
+                if len(batch) > 0:
+                    self.send(batch, stream.resume_token)
+                print(f"{change['operationType']} event, reconciling indexes before tailing changes")
+                return self.reset()
+            if change is not None and change["operationType"] not in DOCUMENT_OPERATIONS:
+                if len(batch) == 0:
+                    self.save_token(stream.resume_token)
+                    saved_token = stream.resume_token
+                continue
+            if change is not None:
+                if len(batch) == 0:
+                    started = time.monotonic()
+                batch.append(change)
+            full = len(batch) >= self.batch_size
+            waited = len(batch) > 0 and time.monotonic() - started >= self.max_wait
+            if full or waited or (change is None and len(batch) > 0):
+                self.send(batch, stream.resume_token)
+                saved_token = stream.resume_token
+                batch = []
+            elif change is None and stream.resume_token != saved_token:
+                # idle: keep the position even without changes on the synced collections
+                self.save_token(stream.resume_token)
+                saved_token = stream.resume_token
+        return None
+
+    def run(self):
+        '''tail the change stream until interrupted'''
+        from pymongo.errors import OperationFailure
+        resume_token = self.load_token()
+        try:
+            stream = self.watch(resume_token)
+        except OperationFailure as e:
+            # the oplog does not hold the stored position anymore
+            print(f"Error: sync cannot resume ({e}), reconciling indexes before tailing changes")
+            stream = self.reset()
+        print(f"Syncing {', '.join(self.models)} into elasticsearch")
+        while stream is not None:
+            with stream:
+                next_stream = self.tail(stream, resume_token)
+            stream = next_stream
+            resume_token = None if stream is None else stream.resume_token
+
+parser = argparse.ArgumentParser(description="Sync elasticsearch indexes with mongo changes")
+parser.add_argument("--batch-size", type=int, default=SYNC_BATCH_SIZE)
+parser.add_argument("--max-wait", type=float, default=SYNC_MAX_WAIT, help="seconds")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    try:
+        IndexSync(batch_size=args.batch_size, max_wait=args.max_wait).run()
+    except KeyboardInterrupt:
+        print("Sync stopped")
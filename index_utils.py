@@ -1,26 +1,54 @@
-from pymongo import MongoClient
-from elasticsearch7 import Elasticsearch
-from elasticsearch7 import exceptions as es_exceptions
+import json
+import time
+import hashlib
 import datetime
+import argparse
 from .utils import AVAILABLE_LANG as LANGS
-from .utils import DB
+from .utils import DB, RULES
+from .clients import LazyElasticsearch, get_es, get_search
+from .index_bulk import BulkIndexer, INDEX_WORKERS, INDEX_CHUNK_SIZE
 # import settings
-es = Elasticsearch("http://localhost:9200")
+es = LazyElasticsearch()
+
+# index settings while loading a full index: no refresh, asynchronous translog
+BULK_LOAD_SETTINGS = {
+    "refresh_interval": "-1",
+    "translog": {"durability": "async", "sync_interval": "30s", "flush_threshold_size": "1gb"},
+}
+# index settings restored once loaded
+SERVING_SETTINGS = {
+    "refresh_interval": "1s",
+    "translog": {"durability": "request", "sync_interval": "5s", "flush_threshold_size": "512mb"},
+}
 
 def get_indexed_and_facet_fields(model="dataset"):
-    return [n["slug"] for n in list(DB.rules.find({"model":model, "$or":[{"is_indexed":True}, {"is_facet":True}]}, {"slug":1}))]
+    return RULES.fields(model, "search")
 
 def get_search_rules(model):
-    return list(DB.rules.find({"model":model, "$or":[{"is_indexed":True}, {"is_facet":True}]}))
+    return [RULES.get_rule(model, slug) for slug in RULES.fields(model, "search")]
+
+def get_index_fields(model="dataset"):
+    '''fields kept in index documents: searchable, facets and short display fields'''
+    fields = RULES.fields(model, "search")
+    return fields + [f for f in RULES.fields(model, "display") if f not in fields]
 
 def create_mapping(model="dataset", lang=None):
+    '''
+    mapping of the index fields (see get_index_fields):
+    searchable fields are analyzed, facets are keywords
+    and display fields are only stored in _source
+    '''
     map_property = {}
     if lang == "fr":
         analyzer = "std_french"
     else:
         analyzer = "std_english"
-    for rules in get_search_rules(model):
+    for slug in get_index_fields(model):
+        rules = RULES.get_rule(model, slug)
         prop_key = rules["slug"]
+        if rules.get("is_indexed") is not True:
+            map_property[prop_key] = get_unsearched_mapping(rules)
+            continue
         if rules["slug"] == "organizations":
             map_property[prop_key] = {"type": "nested"}
         if rules["datatype"] == "object":
@@ -56,19 +84,41 @@ def create_mapping(model="dataset", lang=None):
     print(map_property)
     return map_property
 
+def get_unsearched_mapping(rules):
+    '''mapping of a facet (keyword) or of a display field (not indexed)'''
+    facet = rules.get("is_facet") is True
+    if rules["slug"] == "organizations" and facet:
+        return {"type": "nested"}
+    if rules["datatype"] in ["object", "dict"]:
+        if facet and rules["reference_table"] != "":
+            return {"type": "keyword"}
+        if facet:
+            return {"type": "nested"}
+        return {"type": "object", "enabled": False}
+    if rules["datatype"] == "boolean":
+        return {"type": "boolean", "index": facet}
+    if rules["datatype"] in ["number", "integer", "int"] and rules["constraint"] != "range":
+        return {"type": "integer", "index": facet}
+    if facet:
+        return {"type": "keyword"}
+    return {"type": "keyword", "index": False, "doc_values": False}
+
+def get_index_size(index_name):
+    '''(documents, bytes) of the primary shards of an index'''
+    stats = es.indices.stats(index=index_name, metric="docs,store")["_all"]["primaries"]
+    return stats["docs"]["count"], stats["store"]["size_in_bytes"]
+
 def delete_index(model, lang=None):
     if lang is None:
         index_name = f"{model}"
     else:    
         index_name = f"{model}_{lang}"
+    # versioned indexes behind the alias (see rebuild_index)
+    es.indices.delete(index=f"{index_name}_v*", ignore=[400, 404])
     es.indices.delete(index=index_name, ignore=[400, 404])
-def create_index(model="dataset", lang=None):
-    if lang is None:
-        index_name = f"{model}"
-    else:    
-        index_name = f"{model}_{lang}"
-    print(f"Creating {index_name}")
-    settings = {
+def get_index_settings():
+    '''serving settings of every index (analyzers included)'''
+    return {
                 "number_of_shards": 1,
                 "number_of_replicas": 0,
                 "analysis": {
@@ -91,65 +141,203 @@ def create_index(model="dataset", lang=None):
                     }
                 }            
     }
-    config = {"settings": settings, "mappings": {"properties":create_mapping(model, lang)}}
-    mappings = {"properties": create_mapping(lang)}
-    i = es.indices.create(index=index_name, settings=config["settings"], mappings=config["mappings"], ignore=400)
+
+def fingerprint(value):
+    '''deterministic hash of a json value (keys sorted)'''
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_index_meta(settings, properties):
+    '''
+    _meta stored in the mapping of an index:
+    fingerprint of the settings and of each field mapping, and of both together
+    '''
+    return {
+        "fingerprint": fingerprint({"settings": settings, "properties": properties}),
+        "settings_fingerprint": fingerprint(settings),
+        "properties": {field: fingerprint(mapping) for field, mapping in properties.items()},
+    }
+
+def get_index_config(model="dataset", lang=None):
+    '''settings and mappings of (model, lang) derived from the rules, with their fingerprint in _meta'''
+    settings = get_index_settings()
+    properties = create_mapping(model, lang)
+    return {
+        "settings": settings,
+        "mappings": {"_meta": get_index_meta(settings, properties), "properties": properties},
+    }
+
+def create_index(model="dataset", lang=None, bulk_load=False, index_name=None):
+    '''
+    create the index of (model, lang), with ingest settings if bulk_load (see finish_bulk_load)
+    index_name: physical index name, default <model>_<lang>
+    '''
+    if index_name is None:
+        index_name = get_index_name(model, lang)
+    print(f"Creating {index_name}")
+    config = get_index_config(model, lang)
+    # the fingerprint is computed on the serving settings, ingest ones are temporary
+    settings = dict(config["settings"])
+    if bulk_load:
+        settings.update(BULK_LOAD_SETTINGS)
+    i = es.indices.create(index=index_name, settings=settings, mappings=config["mappings"], ignore=400)
     print(i)
     #print(f"Created index {i['index']}: {i['acknowledged']}")
     #return i["acknowledged"]
     return(i)
 
-def index_documents(model="dataset", lang=None):
-    if lang is None:
-        index_name = f"{model}"
-    else:    
-        index_name = f"{model}_{lang}"
-    col_name = f"{model}s"
-    print(f"Indexing {col_name} from DB into {index_name}")
-    fields = get_indexed_and_facet_fields(model)
+def get_live_meta(index_name):
+    '''_meta of the index (or alias) index_name, None if it does not exist or has no fingerprint'''
+    if not es.indices.exists(index=index_name):
+        return None
+    mappings = es.indices.get_mapping(index=index_name)
+    for mapping in mappings.values():
+        return mapping["mappings"].get("_meta")
+    return None
+
+def compare_index_meta(live_meta, meta):
+    '''
+    "unchanged": same fingerprint
+    "additive": same settings, fields were only added to the mapping
+    "changed": the index has to be rebuilt (no fingerprint, settings or existing fields changed)
+    '''
+    if live_meta is None or "fingerprint" not in live_meta:
+        return "changed"
+    if live_meta["fingerprint"] == meta["fingerprint"]:
+        return "unchanged"
+    if live_meta["settings_fingerprint"] != meta["settings_fingerprint"]:
+        return "changed"
+    for field, field_fingerprint in live_meta["properties"].items():
+        if meta["properties"].get(field) != field_fingerprint:
+            return "changed"
+    return "additive"
+
+def get_index_status(model="dataset", lang=None):
+    '''compare the live index of (model, lang) with the mapping derived from the rules (see compare_index_meta)'''
+    config = get_index_config(model, lang)
+    return compare_index_meta(get_live_meta(get_index_name(model, lang)), config["mappings"]["_meta"]), config
+
+def extend_mapping(model="dataset", lang=None, config=None):
+    '''add the new fields of the rules to the live index of (model, lang) and update its fingerprint'''
+    if config is None:
+        config = get_index_config(model, lang)
+    index_name = get_index_name(model, lang)
+    live_meta = get_live_meta(index_name)
+    properties = {
+        field: mapping
+        for field, mapping in config["mappings"]["properties"].items()
+        if field not in live_meta["properties"]
+    }
+    print(f"Adding {', '.join(properties)} to {index_name}")
+    es.indices.put_mapping(index=index_name, body={"_meta": config["mappings"]["_meta"], "properties": properties})
+    return list(properties)
+
+def get_index_name(model, lang=None):
     if lang is None:
-        display_fields = {f"{f}":1 for f in fields}    
-    else:
-        display_fields = {f"{lang}.{f}":1 for f in fields}
+        return f"{model}"
+    return f"{model}_{lang}"
+
+def build_index_doc(model, doc, lang=None):
+    '''document sent to the index of lang from a mongo document: only the index fields of model'''
+    doc_id = str(doc["_id"])
+    values = doc[lang] if lang is not None else doc
+    index_doc = {k: values[k] for k in get_index_fields(model) if k in values}
+    index_doc["id"] = doc_id
+    try:
+        org_fields = get_index_fields("organization")
+        index_doc["organizations"] = [
+            {**{"id":str(o["_id"])}, **{k: v for k, v in o[lang].items() if k in org_fields}}
+            for o in index_doc["organizations"] if o is not None
+        ]
+    except (KeyError, TypeError):
+        pass
+    return index_doc
+
+def get_index_projection(model, langs=LANGS):
+    '''mongo projection of the fields indexed for langs'''
+    fields = get_index_fields(model)
+    display_fields = {}
+    for lang in langs:
+        if lang is None:
+            display_fields.update({f"{f}":1 for f in fields})
+        else:
+            display_fields.update({f"{lang}.{f}":1 for f in fields})
     display_fields["_id"] = 1
-    errors = 0
-    success = 0
-    doc_to_index = DB[col_name].count_documents({})
-    for doc in DB[col_name].find({}, display_fields):
-        doc_id = str(doc["_id"])
-        index_doc = doc[lang]
-        index_doc["id"] = doc_id
-        try:
-            index_doc["organizations"] = [{**{"id":str(o["_id"])}, **o[lang]} for o in index_doc["organizations"] if o is not None]
-        except KeyError:
-            pass
-        
-        try:
-            response = es.index(index = index_name,id = doc_id, document = index_doc,request_timeout=45)
-            # print(response)
-            success+=1
-        except es_exceptions.RequestError as e:
-            errors+=1
-            print(doc)
-    doc_indexed = es.count({})
-    print(doc_indexed["count"], "/", doc_to_index)
-    print(f"success: {success} errors: {errors}")       
+    return display_fields
+
+def select_index_fields(model, doc, langs=LANGS):
+    '''keep the fields of a full mongo document selected by get_index_projection'''
+    fields = get_index_fields(model)
+    selected = {"_id": doc["_id"]}
+    for lang in langs:
+        if lang is None:
+            selected.update({f: doc[f] for f in fields if f in doc})
+        elif lang in doc:
+            selected[lang] = {f: doc[lang][f] for f in fields if f in doc[lang]}
+    return selected
+
+def index_model(model="dataset", langs=LANGS, query=None, index_names=None, workers=INDEX_WORKERS, chunk_size=INDEX_CHUNK_SIZE):
+    '''
+    index the docs of model matching query into the index of every lang in one pass:
+    each mongo document is read once and sent through the _bulk API (see index_bulk.BulkIndexer)
+    index_names: {lang: index name} to index into other indexes than <model>_<lang>
+    returns the indexation stats
+    '''
+    langs = list(langs)
+    if index_names is None:
+        index_names = {lang: get_index_name(model, lang) for lang in langs}
+    col_name = f"{model}s"
+    print(f"Indexing {col_name} from DB into {', '.join(index_names.values())}")
+    display_fields = get_index_projection(model, langs)
+    with BulkIndexer(get_es(), workers, chunk_size, name=col_name) as indexer:
+        for doc in DB[col_name].find(query or {}, display_fields).batch_size(chunk_size):
+            for lang in langs:
+                indexer.add({
+                    "_index": index_names[lang],
+                    "_id": str(doc["_id"]),
+                    "_source": build_index_doc(model, doc, lang),
+                })
+    return indexer.stats()
+
+def index_documents(model="dataset", lang=None):
+    index_model(model, [lang])
+    doc_indexed = es.count(index=get_index_name(model, lang))
+    print(doc_indexed["count"], "/", DB[f"{model}s"].count_documents({}))
 
 def index_document(model, doc):
+    search = get_search()
     for lang in LANGS:
         index_name = f"{model}_{lang}"
-        fields = get_indexed_and_facet_fields(model)
-        fields.append("_id")
         doc_id = str(doc["_id"])
-        index_doc = doc[lang]
-        index_doc["_id"] = doc_id
-        response = es.index(index = index_name,id = doc_id, document = index_doc,request_timeout=45)
+        index_doc = build_index_doc(model, doc, lang)
+        response = search.index(index_name, doc_id, index_doc)
         print(response)
 
-def setup_indexes():
+def is_local_search():
+    return get_search().name == "local"
+
+def rebuild_local_index(model="dataset", langs=LANGS, chunk_size=INDEX_CHUNK_SIZE):
+    '''
+    rebuild the indexes of model in the local search backend (see search_backend.LocalBackend),
+    in one pass over mongo, returns False if documents were not indexed
+    '''
+    search = get_search()
+    langs = list(langs)
+    for lang in langs:
+        search.delete_index(get_index_name(model, lang))
+        search.create_index(get_index_name(model, lang))
+    actions = (
+        {"_index": get_index_name(model, lang), "_id": str(doc["_id"]), "_source": build_index_doc(model, doc, lang)}
+        for doc in DB[f"{model}s"].find({}, get_index_projection(model, langs)).batch_size(chunk_size)
+        for lang in langs
+    )
+    stats = search.bulk(actions)
+    print(f"{model}s: {stats['success']} documents indexed locally, {stats['errors']} errors")
+    return stats["errors"] == 0
+
+def setup_indexes(bulk_load=False):
     for model in ["dataset", "organization"]:
         for lang in LANGS:
-            create_index(model, lang)
+            create_index(model, lang, bulk_load)
 def delete_indexes():
     for model in ["dataset", "organization"]:
         for lang in LANGS:
@@ -165,16 +353,250 @@ def delete_documents(model, lang=None):
         index_name = f"{model}_{lang}"
     es.delete_by_query(index=[index_name], body={"query": {"match_all": {}}})
 
+def finish_bulk_load(index_name):
+    '''restore the serving settings of a bulk loaded index, merge its segments and make it searchable'''
+    es.indices.put_settings(index=index_name, body={"index": SERVING_SETTINGS})
+    es.indices.forcemerge(index=index_name, max_num_segments=1, request_timeout=600)
+    es.indices.refresh(index=index_name)
+
+def get_index_versions(alias):
+    '''versions of the physical indexes <alias>_v<version>, sorted'''
+    versions = []
+    for index_name in es.indices.get(index=f"{alias}_v*"):
+        version = index_name[len(alias) + 2:]
+        if version.isdigit():
+            versions.append(int(version))
+    return sorted(versions)
+
+def swap_alias(alias, index_name):
+    '''point alias to index_name only, in one atomic update'''
+    actions = [{"add": {"index": index_name, "alias": alias}}]
+    if es.indices.exists_alias(name=alias):
+        for current in es.indices.get_alias(name=alias):
+            if current != index_name:
+                actions.insert(0, {"remove": {"index": current, "alias": alias}})
+    elif es.indices.exists(index=alias):
+        # index created before aliases: replaced in the same update
+        actions.append({"remove_index": {"index": alias}})
+    es.indices.update_aliases(body={"actions": actions})
+
+def delete_old_versions(alias, keep=1):
+    '''delete the physical indexes of alias not read anymore, except the `keep` last ones'''
+    read = set(es.indices.get_alias(name=alias)) if es.indices.exists_alias(name=alias) else set()
+    old = [f"{alias}_v{v}" for v in get_index_versions(alias) if f"{alias}_v{v}" not in read]
+    for index_name in old[:max(len(old) - keep, 0)]:
+        print(f"Deleting {index_name}")
+        es.indices.delete(index=index_name, ignore=[404])
+
+def rebuild_index(model="dataset", langs=LANGS, bulk_load=True, keep=1):
+    '''
+    zero downtime rebuild of the indexes of model: <model>_<lang> are read aliases
+    of versioned indexes <model>_<lang>_v<version>
+    - new versions are filled in the background (one pass over mongo for every lang)
+    - their document counts are checked against mongo
+    - then each alias is swapped atomically and old versions are deleted (`keep` are kept for rollback)
+    if the counts do not match, the new versions are deleted and the aliases are unchanged
+    '''
+    if is_local_search():
+        return rebuild_local_index(model, langs)
+    langs = list(langs)
+    aliases = {lang: f"{model}_{lang}" for lang in langs}
+    index_names = {}
+    for lang, alias in aliases.items():
+        versions = get_index_versions(alias)
+        index_names[lang] = f"{alias}_v{versions[-1] + 1 if versions else 1}"
+        # errors (400) are returned, not raised, by create_index
+        response = create_index(model, lang, bulk_load, index_names[lang])
+        if not response.get("acknowledged"):
+            print(f"Error: {index_names[lang]} was not created ({response.get('error')}), aliases unchanged")
+            for index_name in list(index_names.values())[:-1]:
+                es.indices.delete(index=index_name, ignore=[404])
+            return False
+    index_model(model, langs, index_names=index_names)
+    for index_name in index_names.values():
+        if bulk_load:
+            finish_bulk_load(index_name)
+        else:
+            es.indices.refresh(index=index_name)
+    expected = DB[f"{model}s"].count_documents({})
+    counts = {lang: es.count(index=index_name)["count"] for lang, index_name in index_names.items()}
+    if any(count != expected for count in counts.values()):
+        print(f"Error: {model} indexes {counts} do not match the {expected} {model}s, aliases unchanged")
+        for index_name in index_names.values():
+            es.indices.delete(index=index_name, ignore=[404])
+        return False
+    for lang, alias in aliases.items():
+        _, size = get_index_size(index_names[lang])
+        if es.indices.exists(index=alias):
+            _, previous_size = get_index_size(alias)
+            print(f"{alias}: {previous_size / 1e6:.1f}MB before, {size / 1e6:.1f}MB after")
+        swap_alias(alias, index_names[lang])
+        print(f"{alias} > {index_names[lang]} ({counts[lang]} docs, {size / 1e6:.1f}MB)")
+        delete_old_versions(alias, keep)
+    return True
+
+def json_default(value):
+    '''serialize values the way the elasticsearch client does (dates as iso strings)'''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+def index_doc_hash(index_doc):
+    '''content hash of an index document, equal for the mongo projection and the es _source'''
+    content = json.dumps(index_doc, sort_keys=True, ensure_ascii=False, default=json_default)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def scan_index_hashes(index_name, page_size=1000):
+    '''yield (_id, content hash) of every document of index_name with a point in time and search_after'''
+    pit_id = es.open_point_in_time(index=index_name, keep_alive="2m")["id"]
+    search_after = None
+    try:
+        while True:
+            body = {
+                "size": page_size,
+                "pit": {"id": pit_id, "keep_alive": "2m"},
+                "sort": [{"_shard_doc": "asc"}],
+                "track_total_hits": False,
+            }
+            if search_after is not None:
+                body["search_after"] = search_after
+            res = es.search(body=body)
+            hits = res["hits"]["hits"]
+            if len(hits) == 0:
+                break
+            pit_id = res.get("pit_id", pit_id)
+            for hit in hits:
+                yield hit["_id"], index_doc_hash(hit["_source"])
+            search_after = hits[-1]["sort"]
+    finally:
+        es.close_point_in_time(body={"id": pit_id})
+
+def reconcile_index(model="dataset", langs=LANGS, repair=True, chunk_size=INDEX_CHUNK_SIZE):
+    '''
+    compare the indexes of model with mongo through a content hash of each index document
+    - missing: in mongo, not in the index
+    - stale: in both, with a different content
+    - orphaned: in the index, not in mongo
+    if repair, only those documents are reindexed or deleted through the _bulk API
+    returns {lang: {"missing": [...], "stale": [...], "orphaned": [...]}}
+    '''
+    langs = list(langs)
+    col_name = f"{model}s"
+    expected = {lang: {} for lang in langs}
+    for doc in DB[col_name].find({}, get_index_projection(model, langs)).batch_size(chunk_size):
+        for lang in langs:
+            expected[lang][str(doc["_id"])] = index_doc_hash(build_index_doc(model, doc, lang))
+    report = {}
+    for lang in langs:
+        hashes = expected[lang]
+        stale = []
+        orphaned = []
+        for doc_id, content_hash in scan_index_hashes(get_index_name(model, lang)):
+            expected_hash = hashes.pop(doc_id, None)
+            if expected_hash is None:
+                orphaned.append(doc_id)
+            elif expected_hash != content_hash:
+                stale.append(doc_id)
+        report[lang] = {"missing": list(hashes), "stale": stale, "orphaned": orphaned}
+        print(
+            f"{get_index_name(model, lang)}: {len(hashes)} missing, "
+            f"{len(stale)} stale, {len(orphaned)} orphaned"
+        )
+    if repair:
+        repair_index(model, report, chunk_size)
+    return report
+
+def repair_index(model, report, chunk_size=INDEX_CHUNK_SIZE):
+    '''reindex missing and stale documents, delete orphaned ones (report of reconcile_index)'''
+    from bson import ObjectId
+    langs = list(report)
+    with BulkIndexer(get_es(), chunk_size=chunk_size, name=f"repair {model}s") as indexer:
+        for lang in langs:
+            index_name = get_index_name(model, lang)
+            for doc_id in report[lang]["orphaned"]:
+                indexer.add({"_op_type": "delete", "_index": index_name, "_id": doc_id})
+            to_index = report[lang]["missing"] + report[lang]["stale"]
+            for i in range(0, len(to_index), chunk_size):
+                ids = [ObjectId(doc_id) for doc_id in to_index[i:i+chunk_size]]
+                for doc in DB[f"{model}s"].find({"_id": {"$in": ids}}, get_index_projection(model, [lang])):
+                    indexer.add({
+                        "_index": index_name,
+                        "_id": str(doc["_id"]),
+                        "_source": build_index_doc(model, doc, lang),
+                    })
+    return indexer.stats()
+
 def populate_indexes():
-    for lang in LANGS:
-        for model in ["dataset", "organization"]:
-            index_documents(model, lang)    
+    for model in ["dataset", "organization"]:
+        index_model(model, LANGS)
+
+def sync_index(model="dataset", langs=LANGS, bulk_load=False):
+    '''
+    bring the indexes of model up to date with the rules and mongo, rebuilding only what has to be:
+    - mapping changed (or no index): zero downtime rebuild (see rebuild_index)
+    - fields added: put_mapping of the new fields, then reconcile
+    - mapping unchanged: reconcile only (documents changed in mongo are reindexed)
+    returns False if a rebuild failed
+    the local search backend has no mapping: its indexes are rebuilt
+    '''
+    if is_local_search():
+        return rebuild_local_index(model, langs)
+    to_rebuild = []
+    to_reconcile = []
+    for lang in langs:
+        status, config = get_index_status(model, lang)
+        print(f"{get_index_name(model, lang)}: mapping {status}")
+        if status == "changed":
+            to_rebuild.append(lang)
+            continue
+        if status == "additive":
+            extend_mapping(model, lang, config)
+        to_reconcile.append(lang)
+    success = True
+    if len(to_rebuild) > 0:
+        success = rebuild_index(model, to_rebuild, bulk_load)
+    if len(to_reconcile) > 0:
+        reconcile_index(model, to_reconcile)
+    return success
+
+def init_indexation(bulk_load=False, force=False):
+    '''
+    bring every index up to date (see sync_index), returns the time until they are all searchable
+    force: rebuild every index behind its alias (see rebuild_index) even if its mapping is unchanged
+    bulk_load: rebuilt indexes are created with BULK_LOAD_SETTINGS
+    then restored to SERVING_SETTINGS, force merged and refreshed
+    '''
+    start = time.perf_counter()
+    if force:
+        success = all([rebuild_index(model, LANGS, bulk_load) for model in ["dataset", "organization"]])
+    else:
+        success = all([sync_index(model, LANGS, bulk_load) for model in ["dataset", "organization"]])
+    searchable = time.perf_counter() - start
+    print(f"Indexes searchable after {searchable:.2f}s (bulk load: {bulk_load})")
+    if not success:
+        raise RuntimeError("Error: indexation failed, previous indexes are still served")
+    return searchable
 
-def init_indexation():
-    delete_indexes()
-    setup_indexes()
-    # delete_index_documents()
-    populate_indexes()
+def benchmark_indexation():
+    '''rebuild the indexes with and without bulk load settings and compare the time to searchable'''
+    default = init_indexation(bulk_load=False, force=True)
+    bulk_load = init_indexation(bulk_load=True, force=True)
+    print(f"Time to searchable: default {default:.2f}s, bulk load {bulk_load:.2f}s")
+    return {"default": default, "bulk_load": bulk_load}
+
+parser = argparse.ArgumentParser(description="Rebuild the elasticsearch indexes from mongo")
+parser.add_argument("--bulk-load", action="store_true", help="ingest settings while indexing")
+parser.add_argument("--benchmark", action="store_true", help="compare time to searchable with and without --bulk-load")
+parser.add_argument("--reconcile", action="store_true", help="compare indexes with mongo and repair the differences")
+parser.add_argument("--force", action="store_true", help="rebuild the indexes even if their mapping is unchanged")
+parser.add_argument("--dry-run", action="store_true", help="with --reconcile, only report the differences")
 
 if __name__=="__main__":
-    init_indexation()
\ No newline at end of file
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_indexation()
+    elif args.reconcile:
+        for model in ["dataset", "organization"]:
+            reconcile_index(model, LANGS, repair=not args.dry_run)
+    else:
+        init_indexation(args.bulk_load, args.force)
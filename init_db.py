@@ -6,14 +6,26 @@ from csv import DictReader, DictWriter
 import pymongo
 
 from .utils import translate
-from .utils import DB
+from .utils import DB, RULES
+from .rules_utils import bump_version
+from .bulk_utils import BulkWriter
 from .utils import meta_dir, data_dir
+from .db_import_utils import import_references_from_csv
 
 
 
-def init_meta():
+def init_meta(incremental=False):
+    '''
+    load rules and references
+    incremental: references are not dropped, only changed rows are translated and upserted
+    returns the changed ids per reference table
+    '''
     DB.rules.drop()
     import_rules()
+    if incremental:
+        return import_references_from_csv(
+            incremental=True, import_dir=os.path.join(data_dir, "references")
+        )
     DB.references.drop()
     import_references()
     
@@ -27,7 +39,7 @@ def import_rules():
     DB[coll_name].drop()
     rules_doc = os.path.join(meta_dir,"rules.csv")
     print(f"Creating {coll_name} table")
-    with open(rules_doc, "r") as f:
+    with open(rules_doc, "r") as f, BulkWriter(DB[coll_name]) as bulk_writer:
         reader = DictReader(f, delimiter=",")
         for row in reader:
             
@@ -46,7 +58,9 @@ def import_rules():
                         row[k] = int(v)
                     except ValueError:
                         row[k] = str(v)
-            _id = DB[coll_name].insert_one(row).inserted_id
+            bulk_writer.insert(row)
+    bump_version(DB, coll_name)
+    RULES.reload()
             
 
 def import_references():
@@ -59,7 +73,7 @@ def import_references():
     - update ref_table csv files back again with db
     '''
     DB.references.drop()
-    for ref_table in DB.rules.distinct("reference_table"):
+    for ref_table in RULES.reference_tables():
         if ref_table != "":
             DB[ref_table].drop()
             print(f"Creating {ref_table} table")
@@ -69,7 +83,7 @@ def import_references():
             ref_file =  os.path.join(data_dir, "references", ref_table+".csv")
             meta_reference["refs"] = [] 
             try:
-                with open(ref_file, "r") as f:            
+                with open(ref_file, "r") as f, BulkWriter(DB[ref_table]) as bulk_writer:
                     reader = DictReader(f, delimiter=",")
                     
                     for row in reader:
@@ -91,10 +105,7 @@ def import_references():
                             if clean_row["uri"] != "":
                                 meta_reference["root_uri"] = "/".join(row["uri"].split("/")[:-1])
                         meta_reference["refs"].append(clean_row)            
-                        try:
-                            ref_id = DB[ref_table].insert_one(clean_row)
-                        except pymongo.errors.DuplicateKeyError:
-                            pass
+                        bulk_writer.insert(clean_row)
                         del clean_row
                 with open(ref_file, "w") as f:        
                     one_record = DB[ref_table].find_one({}, {"_id":0})
@@ -3,10 +3,10 @@ import json
 import itertools
 from jsonschema_to_openapi.convert import convert
 from pydantic import create_model
-from rules_utils import (get_mandatory_fields, get_rules)
+from utils import (get_mandatory_fields, get_rules)
 from utils import data_dir, schema_dir
-from utils import DB
-from utils import get_json_ref_type, get_json_type, 
+from utils import DB, RULES
+from utils import get_json_ref_type, get_json_type
 
 def create_json_schema_from_example(model):
     model_name = model.title()
@@ -34,7 +34,7 @@ def create_reference_json_schema():
 
 def create_json_schema(model_name, model_name_title, model_rules, lang):
     '''Given rules for one model build a jsonschema dict'''
-    if model_name not in DB.rules.distinct("model"):
+    if model_name not in RULES.models():
         raise NameError("Model: {} doesn't exists".format(model_name))
     doc_root = { 
         "$schema": "https://json-schema.org/draft/2020-12/schema",
@@ -119,7 +119,7 @@ def create_json_schemas():
 
 def create_json_model():
     '''generate JSON empty file from rules table'''
-    rules = [rule for rule in DB["rules"].find({},{})]
+    rules = [rule for model_name in RULES.models() for rule in get_rules(model_name)]
 
     final_models = {}
     for  model_name, field_rules in itertools.groupby(rules, key=lambda x:x["model"]):
@@ -2,41 +2,110 @@
 #!/usr/bin/.venv/python3.8
 import os
 import shutil
+from functools import partial
 from scripts.utils import *
-from scripts.db_import_utils import import_from_csv, import_rules_from_csv, import_references_from_csv, import_model_from_csv
-#tmp
-from scripts.populate_db import init_data
-from scripts.index_utils import init_indexation
+from scripts.utils import RULES, cache_dir, curr_dir, parent_dir
+from scripts.utils import translation_pool
+from scripts.db_import_utils import import_rules_from_csv, import_reference_table
+from scripts.populate_db import import_organizations, import_datasets, register_dataset_comments, create_default_users
+from scripts.index_utils import sync_index
 from scripts.generate_api import generate_app
-
-# from scripts.setup_index import create_index
-# from scripts.setup_index import index_documents
-from scripts.setup_index import init_indexation
+from scripts.scheduler import Scheduler, Task
 import argparse
 
 LANGS = ["en", "fr"]
+STATE_FILE = os.path.join(cache_dir, "pipeline_state.json")
 parser = argparse.ArgumentParser()
 parser.add_argument("app_name")
+parser.add_argument("--workers", type=int, default=4, help="number of stages run concurrently")
+parser.add_argument("--force", action="store_true", help="run every stage even if its inputs are unchanged")
+parser.add_argument("--translation-workers", type=int, default=4, help="translation processes shared by the imports")
 
 
-if __name__ == "__main__":
-    args = parser.parse_args()
-    app_name = args.app_name
-    print(f"Creating {app_name}")
-    print("Initialize DB")
-    import_rules_from_csv()
-    import_references_from_csv()
-    #tmp
-    print("Populate db")
-    init_data()
-
-    print("Initialize indexation")
-    init_indexation()
-    print(f"Generate new app into {app_name}")
-    back_app_name = "v3"
-    back_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), app_name)
+def import_all_datasets():
+    DB.datasets.drop()
+    import_datasets()
+    DB.comments.drop()
+    register_dataset_comments()
+
+
+def reindex(model, langs):
+    '''every lang index of model in one pass over mongo (see index_utils.index_model)'''
+    if not sync_index(model, langs):
+        raise RuntimeError(f"Error: {model} indexes were not rebuilt")
+
+
+def generate(app_name, back_dir):
     try:
         shutil.rmtree(back_dir)
     except FileNotFoundError:
         pass
     generate_app(app_name)
+
+
+def build_meta_tasks():
+    '''rules come first: they declare the reference tables of the next stages'''
+    return [
+        Task("rules", import_rules_from_csv, files=[os.path.join(data_dir, "import", "rules.csv")]),
+    ]
+
+
+def build_tasks(app_name):
+    '''stages depending on rules: references > organizations > datasets > indexes, codegen'''
+    ref_tables = [ref_table for ref_table in RULES.reference_tables() if ref_table != ""]
+    tasks = [
+        Task(
+            ref_table,
+            partial(import_reference_table, ref_table),
+            files=[os.path.join(data_dir, "import", ref_table + ".csv")],
+            inputs=["rules"],
+        )
+        for ref_table in ref_tables
+    ]
+    tasks.append(Task(
+        "organizations",
+        import_organizations,
+        files=[os.path.join(data_dir, "organizations", "organizations_fr.csv")],
+        inputs=["rules"] + ref_tables,
+    ))
+    tasks.append(Task(
+        "datasets",
+        import_all_datasets,
+        files=[os.path.join(data_dir, "datasets", "datasets_fr.csv")],
+        inputs=["rules", "organizations"] + ref_tables,
+        outputs=["datasets", "comments"],
+    ))
+    tasks.append(Task(
+        "users",
+        create_default_users,
+        files=[os.path.join(curr_dir, "populate_db.py")],
+        inputs=["rules"],
+    ))
+    for model in ["dataset", "organization"]:
+        tasks.append(Task(
+            f"index_{model}",
+            partial(reindex, model, LANGS),
+            inputs=["rules", f"{model}s"],
+        ))
+    back_dir = os.path.join(parent_dir, app_name)
+    tasks.append(Task(
+        "codegen",
+        partial(generate, app_name, back_dir),
+        inputs=["rules"] + ref_tables,
+        creates=[back_dir],
+    ))
+    return tasks
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    app_name = args.app_name
+    print(f"Creating {app_name}")
+    print("Initialize DB")
+    success = Scheduler(build_meta_tasks(), STATE_FILE, args.workers, args.force).run()
+    if success:
+        with translation_pool(args.translation_workers):
+            print("Populate db, initialize indexation and generate new app")
+            success = Scheduler(build_tasks(app_name), STATE_FILE, args.workers, args.force).run()
+    if not success:
+        raise SystemExit(1)
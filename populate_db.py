@@ -8,51 +8,88 @@ import datetime
 from utils import (SWITCH_LANGS, AVAILABLE_LANG)
 from utils import DB
 from utils import data_dir
-from utils import (translate, translate_doc)
-from utils import cast_type_for_import
+from utils import (translate, translate_doc, translate_docs)
+from utils import chunked, translation_pool
+from utils import TRANSLATION_CHUNK_SIZE, TRANSLATION_WORKERS
+from bulk_utils import BulkWriter, BULK_BATCH_SIZE
+from import_pipeline import ImportPipeline, Stage
+from db_import_utils import translate_model_docs, validate_model_docs, get_key_field
+from db_import_utils import cast_changed_rows
+from import_tracker import ImportTracker
+from rules_utils import bump_version
 
-def import_organizations(lang="fr"):
+def import_organizations(lang="fr", batch_size=BULK_BATCH_SIZE, incremental=False):
     """import_organizations
     insert organization defined by rules into DB.organizations from data/organizations/organizations_fr.csv
+    incremental: only upsert new or changed organizations and delete removed ones, returns the changed ids
     """
-    DB.organizations.drop()
+    if not incremental:
+        DB.organizations.drop()
     org_doc = os.path.abspath(
         os.path.join(data_dir, "organizations", f"organizations_{lang}.csv")
     )
     print(f"Create Organizations by inserting {org_doc}")
-    with open(org_doc, "r") as f:
+    with open(org_doc, "r") as f, BulkWriter(DB.organizations, batch_size) as bulk_writer:
         reader = DictReader(f, delimiter=",")
-        for row in reader:
+        tracker = ImportTracker(DB, "organizations", key_field=get_key_field("organization"))
+        if not incremental:
+            # the hashes of the dropped organizations are forgotten, the new ones stored
+            tracker.reset()
+        for row, meta in (item for rows in chunked(reader) for item in tracker.diff(rows)):
             org = {"fr": {}, "en": {}}
-            org[{lang}] = row
-            other_lang = SWITCH_LANGS[{lang}]
+            org[lang] = row
+            other_lang = SWITCH_LANGS[lang]
             org[other_lang] = translate_doc("organization", org, _from=lang)
-            db_org = DB.organizations.insert_one(org)
+            org["_import"] = meta
+            tracker.upsert(bulk_writer, [org])
             # create_logs("admin","create", "organization", True, "OK", scope=None, ref_id=db_org.inserted_id)
+    changes = tracker.finish(bulk_writer)
     print(DB.organizations.count_documents({}), "organization inserted")
+    # caches of the documents (facet bitmaps of the services) are rebuilt
+    bump_version(DB, "organizations")
+    if incremental:
+        return changes
 
-def import_datasets(rebuild=False, lang="fr"):
+def import_datasets(rebuild=False, lang="fr", workers=TRANSLATION_WORKERS, chunk_size=TRANSLATION_CHUNK_SIZE, batch_size=BULK_BATCH_SIZE, incremental=False):
+    '''import datasets from data/datasets/datasets_<lang>.csv
+    incremental: only new or changed rows are translated and upserted, removed rows are deleted
+    returns the changed ids
+    '''
     datasets_doc = os.path.abspath(
         os.path.join(data_dir, "datasets", f"datasets_{lang}.csv")
     )
     print(f"Create Datasets by inserting {datasets_doc}")
-    with open(datasets_doc, "r") as f:
+    with translation_pool(workers), open(datasets_doc, "r") as f, BulkWriter(DB.datasets, batch_size) as bulk_writer:
         reader = DictReader(f, delimiter=",")
-        for row in reader:
-            dataset = {"fr": {}, "en": {}}
-            other_lang = SWITCH_LANGS[lang]
-            dataset[lang] = {
-                k: cast_type_for_import("dataset", k, v) for k, v in row.items()
-            }
-            dataset[other_lang] = translate_doc("dataset", dataset, _from=lang)
-            DB.datasets.insert_one(dataset)
+        tracker = ImportTracker(DB, "datasets", key_field=get_key_field("dataset"))
+        if not incremental:
+            # full imports run on a dropped collection (see init_data): every row is new
+            tracker.reset()
+        ImportPipeline([
+            Stage("diff", tracker.diff),
+            Stage("cast", lambda items: cast_changed_rows("dataset", lang, items)),
+            Stage("translate", lambda datasets: translate_model_docs("dataset", lang, datasets)),
+            Stage("validate", lambda datasets: validate_model_docs("dataset", datasets, lang)),
+            Stage("write", lambda datasets: tracker.upsert(bulk_writer, datasets)),
+        ], chunk_size, name="datasets").run(reader)
+    changes = tracker.finish(bulk_writer)
     print(DB.datasets.count_documents({}), "datasets")
+    bump_version(DB, "datasets")
+    if incremental:
+        return changes
 
-def register_dataset_comments():
+def register_dataset_comments(dataset_ids=None):
+    '''register comments fields of datasets as comments, only for dataset_ids if given'''
     dataset = DB.datasets.find_one()
+    if dataset is None:
+        return
     comments_fields = {"fr."+key: 1 for key in dataset["fr"] if "comment" in key}
     comments_fields["_id"] = 1
-    for dataset in DB.datasets.find({}, comments_fields):
+    query = {}
+    if dataset_ids is not None:
+        query = {"_id": {"$in": dataset_ids}}
+        DB.comments.delete_many({"perimeter": "dataset", "ref_id": {"$in": dataset_ids}})
+    for dataset in DB.datasets.find(query, comments_fields):
         dataset_id = dataset["_id"]
         del dataset["_id"]
         for k, v in dataset.items():
@@ -87,7 +124,11 @@ def create_default_users():
             "lang": "fr",
         },
     ]
-    _id = DB.users.insert_many(default_users)
+    # upserted by username: the pipeline reruns it when rules or the default users change
+    user_ids = []
+    for user in default_users:
+        DB.users.update_one({"username": user["username"]}, {"$set": user}, upsert=True)
+        user_ids.append(DB.users.find_one({"username": user["username"]}, {"_id": 1})["_id"])
     create_logs(
         "admin",
         action="create",
@@ -95,12 +136,11 @@ def create_default_users():
         status=True,
         message="OK",
         scope=None,
-        ref_id=_id.inserted_ids,
+        ref_id=user_ids,
     )
     pipeline = [{"$project": {"id": {"$toString": "$_id"}, "_id": 0, "value": 1}}]
     DB.users.aggregate(pipeline)
-    # print(_id.inserted_ids)
-    return _id.inserted_ids
+    return user_ids
 
 def create_comment(username, text="Ceci est un commentaire test"):
     default_user = DB.users.find_one({"username": username}, {"username": 1, "lang": 1})
@@ -153,7 +193,21 @@ def create_logs(
     }
 
 
-def init_data():
+def init_data(incremental=False):
+    '''
+    load organizations, datasets, comments and default users
+    incremental: keep the current data and only apply rows changed since the last import,
+    returns the changed ids per collection for incremental indexing
+    '''
+    if incremental:
+        changes = {
+            "organizations": import_organizations(incremental=True),
+            "datasets": import_datasets(incremental=True),
+        }
+        register_dataset_comments(changes["datasets"]["inserted"] + changes["datasets"]["updated"])
+        # comments of the tombstoned datasets go with them
+        DB.comments.delete_many({"perimeter": "dataset", "ref_id": {"$in": changes["datasets"]["deleted"]}})
+        return changes
     DB.organizations.drop()
     import_organizations()
     DB.datasets.drop()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# file: reference_utils.py
+
+# this module is also copied into the generated apps (see generate_api.generate_app):
+# it must only depend on the db passed to ReferenceRegistry
+
+import time
+
+REFERENCE_KEYS = ["name_fr", "name_en", "uri"]
+
+
+class ReferenceTable:
+    '''
+    Compact lookups of a ref_* table
+    - translations[_from]: name in _from > name in the other lang
+    - uris[lang]: name in lang > uri
+    - labels[key]: name_fr, name_en or uri > reference row, per key so that a name
+      in one lang does not hide the row of the same name in the other lang
+    - values[key]: distinct non empty values of name_fr, name_en and uri in table order
+    '''
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.translations = {"fr": {}, "en": {}}
+        self.uris = {"fr": {}, "en": {}}
+        self.labels = {key: {} for key in REFERENCE_KEYS}
+        self.values = {key: [] for key in REFERENCE_KEYS}
+        seen = {key: set() for key in REFERENCE_KEYS}
+        for row in rows:
+            name_fr, name_en, uri = row.get("name_fr"), row.get("name_en"), row.get("uri")
+            if name_fr is not None:
+                self.translations["fr"].setdefault(name_fr, name_en)
+                self.uris["fr"].setdefault(name_fr, uri)
+            if name_en is not None:
+                self.translations["en"].setdefault(name_en, name_fr)
+                self.uris["en"].setdefault(name_en, uri)
+            for key in REFERENCE_KEYS:
+                value = row.get(key)
+                if value is None or value == "":
+                    continue
+                if value not in seen[key]:
+                    seen[key].add(value)
+                    self.values[key].append(value)
+                self.labels[key].setdefault(value, row)
+
+
+class ReferenceRegistry:
+    '''
+    In-memory copy of the reference tables (ref_*), loaded on first use
+    - the version stamp of a table in db.versions is checked at most every `check_interval` seconds
+    and the table is reloaded when it changed (import_reference_table bumps it)
+    - lookups take lists of values: one call per document field, no db query
+    Unknown values are returned unchanged
+    '''
+
+    def __init__(self, db, check_interval=5):
+        self.db = db
+        self.check_interval = check_interval
+        self._tables = {}
+        self._checked_at = {}
+
+    def get_version(self, ref_table):
+        stamp = self.db.versions.find_one({"_id": ref_table})
+        if stamp is None:
+            return None
+        return stamp["version"]
+
+    def load(self, ref_table):
+        version = self.get_version(ref_table)
+        rows = self.db[ref_table].find({}, {"_id": 0, "name_fr": 1, "name_en": 1, "uri": 1})
+        self._tables[ref_table] = ReferenceTable(rows, version)
+        self._checked_at[ref_table] = time.monotonic()
+        return self._tables[ref_table]
+
+    def invalidate(self, ref_table=None):
+        '''force a version check of ref_table (every table if None) on next access'''
+        if ref_table is None:
+            self._checked_at = {}
+        else:
+            self._checked_at.pop(ref_table, None)
+
+    def table(self, ref_table):
+        '''ReferenceTable of ref_table, reloaded if its version stamp changed'''
+        table = self._tables.get(ref_table)
+        if table is None:
+            return self.load(ref_table)
+        now = time.monotonic()
+        if now - self._checked_at.get(ref_table, 0) < self.check_interval:
+            return table
+        self._checked_at[ref_table] = now
+        if self.get_version(ref_table) != table.version:
+            return self.load(ref_table)
+        return table
+
+    def translate(self, ref_table, values, _from="fr"):
+        '''translate a list of names from _from into the other lang'''
+        translations = self.table(ref_table).translations[_from]
+        return [
+            value if value == "" or translations.get(value) is None else translations[value]
+            for value in values
+        ]
+
+    def translate_one(self, ref_table, value, _from="fr"):
+        return self.translate(ref_table, [value], _from)[0]
+
+    def uris(self, ref_table, values, lang="fr"):
+        '''uri of a list of names in lang (None if unknown)'''
+        uris = self.table(ref_table).uris[lang]
+        return [uris.get(value) for value in values]
+
+    def names(self, ref_table, values, lang="fr"):
+        '''
+        resolve names in any lang or uris into names in lang: a value is looked up
+        as a name in lang, then as a name in the other lang, then as a uri
+        (same order as export_aggregation.reference_label_expr)
+        '''
+        labels = self.table(ref_table).labels
+        key = f"name_{lang}"
+        other_key = f"name_{'en' if lang == 'fr' else 'fr'}"
+        names = []
+        for value in values:
+            row = labels[key].get(value) or labels[other_key].get(value) or labels["uri"].get(value)
+            names.append(value if row is None else row.get(key) or value)
+        return names
+
+    def values(self, ref_table, key="name_fr"):
+        '''distinct values of name_fr, name_en or uri'''
+        return list(self.table(ref_table).values[key])
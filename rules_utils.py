@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# file: rules_utils.py
+
+import time
+import datetime
+
+# named selections of rules, keyed the way utils helpers query DB.rules
+RULE_FLAGS = {
+    "multiple": lambda r: r.get("multiple") is True,
+    "mandatory": lambda r: r.get("mandatory") is True,
+    "translated": lambda r: r.get("translation") is True,
+    "not_translated": lambda r: r.get("translation") is False,
+    "to_translate": lambda r: r.get("translation") is True
+    and r.get("reference_table") == ""
+    and r.get("is_controled") is False,
+    "indexed": lambda r: r.get("indexed") is True,
+    "is_indexed": lambda r: r.get("is_indexed") is True,
+    "facet": lambda r: r.get("is_facet") is True,
+    "search": lambda r: r.get("is_indexed") is True or r.get("is_facet") is True,
+    "reference": lambda r: r.get("reference_table") != "",
+    # short fields shown in result lists, ordered by ITEM_order (-1: hidden)
+    "display": lambda r: type(r.get("ITEM_order")) is int and r.get("ITEM_order") > 0,
+}
+
+
+def get_version(db, name):
+    '''get the version stamp of collection `name` stored in db.versions'''
+    stamp = db.versions.find_one({"_id": name})
+    if stamp is None:
+        return None
+    return stamp["version"]
+
+
+def bump_version(db, name):
+    '''increment the version stamp of collection `name` after a (re)import'''
+    stamp = db.versions.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"version": 1}, "$set": {"date": datetime.datetime.now()}},
+        upsert=True,
+        return_document=True,
+    )
+    return stamp["version"]
+
+
+class RulesRegistry:
+    '''
+    In-memory copy of the rules collection
+    - rules are indexed by (model, slug), by model and by flag (see RULE_FLAGS)
+    - the version stamp in db.versions is checked at most every `check_interval` seconds
+    and the registry is reloaded when it changed
+    Rules returned are shared: treat them as read-only
+    '''
+
+    def __init__(self, db, check_interval=5):
+        self.db = db
+        self.check_interval = check_interval
+        self.version = None
+        self.loaded = False
+        self._checked_at = 0
+        self._rules = {}
+        self._by_model = {}
+        self._flags = {}
+        self._flag_sets = {}
+        self._slugs = set()
+
+    def load(self):
+        '''load every rule from db.rules and build the indexes'''
+        rules = {}
+        by_model = {}
+        flags = {}
+        for rule in self.db.rules.find({}):
+            model = rule.get("model")
+            rules[(model, rule.get("slug"))] = rule
+            by_model.setdefault(model, []).append(
+                {k: v for k, v in rule.items() if k != "_id"}
+            )
+            for flag, selector in RULE_FLAGS.items():
+                if selector(rule):
+                    flags.setdefault((model, flag), []).append(rule["slug"])
+        self._rules = rules
+        self._by_model = by_model
+        self._flags = flags
+        self._flag_sets = {k: set(v) for k, v in flags.items()}
+        self._slugs = {slug for _, slug in rules}
+        self.version = get_version(self.db, "rules")
+        self._checked_at = time.monotonic()
+        self.loaded = True
+
+    def reload(self):
+        self.load()
+
+    def invalidate(self):
+        '''force a version check on next access'''
+        self._checked_at = 0
+
+    def refresh(self):
+        '''reload rules if never loaded or if the rules version stamp changed'''
+        if not self.loaded:
+            self.load()
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if get_version(self.db, "rules") != self.version:
+            self.load()
+
+    def get_rule(self, model, slug):
+        self.refresh()
+        return self._rules.get((model, slug))
+
+    def get_rules(self, model):
+        self.refresh()
+        return list(self._by_model.get(model, []))
+
+    def fields(self, model, flag):
+        '''list of slugs of model selected by flag'''
+        self.refresh()
+        return list(self._flags.get((model, flag), []))
+
+    def has_flag(self, model, slug, flag):
+        self.refresh()
+        return slug in self._flag_sets.get((model, flag), ())
+
+    def any_flag(self, model, flag):
+        self.refresh()
+        return len(self._flags.get((model, flag), [])) > 0
+
+    def slugs(self):
+        self.refresh()
+        return self._slugs
+
+    def models(self):
+        self.refresh()
+        return list(self._by_model)
+
+    def reference_tables(self):
+        self.refresh()
+        return sorted(
+            {r.get("reference_table") for r in self._rules.values()
+             if r.get("reference_table") is not None}
+        )
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# file: scheduler.py
+
+import os
+import json
+import time
+import hashlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def file_fingerprint(filepath):
+    '''sha1 of the file content, None if the file does not exist'''
+    if not os.path.exists(filepath):
+        return None
+    sha = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Task:
+    '''
+    A stage of the pipeline
+    - files: input files, the task reruns when their content changes
+    - inputs: resources produced by other tasks (e.g. "rules", "datasets"),
+    the task depends on their producers and reruns when one of them ran
+    - outputs: resources produced by the task
+    - creates: paths the task must create, the task reruns if one is missing
+    '''
+
+    def __init__(self, name, func, files=(), inputs=(), outputs=(), creates=()):
+        self.name = name
+        self.func = func
+        self.files = list(files)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs) or [name]
+        self.creates = list(creates)
+        self.status = "pending"
+        self.seconds = 0.0
+
+
+class Scheduler:
+    '''
+    Runs tasks as a DAG on a thread pool
+    - a task starts when every producer of its inputs is done
+    - a task is skipped when its files and the versions of its inputs are unchanged
+    since its last successful run (state kept in state_file)
+    - report() prints the time spent in each task
+    '''
+
+    def __init__(self, tasks, state_file, workers=4, force=False):
+        self.tasks = {task.name: task for task in tasks}
+        self.state_file = state_file
+        self.workers = workers
+        self.force = force
+        self.producers = {}
+        for task in tasks:
+            for output in task.outputs:
+                self.producers[output] = task.name
+        self.state = self.load_state()
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        return {"tasks": {}, "resources": {}}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        with open(self.state_file, "w") as f:
+            json.dump(self.state, f, indent=4)
+
+    def dependencies(self, task):
+        return {self.producers[i] for i in task.inputs if i in self.producers and self.producers[i] != task.name}
+
+    def fingerprint(self, task):
+        content = {
+            "files": {f: file_fingerprint(f) for f in task.files},
+            "inputs": {i: self.state["resources"].get(i) for i in task.inputs},
+        }
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_up_to_date(self, task):
+        if self.force:
+            return False
+        if any(not os.path.exists(path) for path in task.creates):
+            return False
+        last_run = self.state["tasks"].get(task.name)
+        return last_run is not None and last_run["fingerprint"] == self.fingerprint(task)
+
+    def run_task(self, task):
+        if self.is_up_to_date(task):
+            return "skipped"
+        start = time.perf_counter()
+        try:
+            task.func()
+        finally:
+            task.seconds = time.perf_counter() - start
+        return "done"
+
+    def complete(self, task, status):
+        '''record a finished task, a task that ran bumps the version of its outputs'''
+        task.status = status
+        if status == "done":
+            now = datetime.datetime.now().isoformat()
+            for output in task.outputs:
+                self.state["resources"][output] = now
+            self.state["tasks"][task.name] = {"fingerprint": self.fingerprint(task), "date": now}
+            self.save_state()
+
+    def run(self):
+        pending = dict(self.tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                for name, task in list(pending.items()):
+                    deps = [self.tasks[d] for d in self.dependencies(task)]
+                    if any(d.status in ["failed", "blocked"] for d in deps):
+                        task.status = "blocked"
+                        del pending[name]
+                    elif all(d.status in ["done", "skipped"] for d in deps):
+                        running[executor.submit(self.run_task, task)] = task
+                        task.status = "running"
+                        del pending[name]
+                if len(running) == 0:
+                    # unresolvable dependencies (cycle)
+                    for task in pending.values():
+                        task.status = "blocked"
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    try:
+                        self.complete(task, future.result())
+                    except Exception as e:
+                        print(f"Error in task {task.name}: {e!r}")
+                        task.status = "failed"
+        self.report()
+        return all(task.status in ["done", "skipped"] for task in self.tasks.values())
+
+    def report(self):
+        print("Pipeline report")
+        for task in self.tasks.values():
+            print(f"{task.name:<30} {task.status:<8} {task.seconds:8.2f}s")
+        print(f"{'total':<30} {'':<8} {sum(t.seconds for t in self.tasks.values()):8.2f}s")
@@ -0,0 +1,821 @@
+#!/usr/bin/env python3
+# file: search_backend.py
+# self-contained: copied into the generated apps (see generate_api.generate_app)
+
+import os
+import re
+import json
+import math
+import mmap
+import time
+import array
+import atexit
+import threading
+import contextlib
+import argparse
+import unicodedata
+
+# BM25 parameters (elasticsearch defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# results returned by a search when no size is given
+SEARCH_SIZE = 10
+
+LOCAL_INDEX_MAGIC = b"GDSEARCH1\n"
+LOCAL_INDEX_EXTENSION = ".idx"
+# writes of index() and delete() are saved by batches of LOCAL_SAVE_EVERY
+# or LOCAL_SAVE_INTERVAL seconds after the first unsaved write
+LOCAL_SAVE_EVERY = 100
+LOCAL_SAVE_INTERVAL = 1.0
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks (windows): a single process may write into a directory of indexes
+    fcntl = None
+
+STOPWORDS = {
+    "fr": [
+        "au", "aux", "avec", "ce", "ces", "dans", "de", "des", "du", "elle", "en", "et", "eux", "il",
+        "je", "la", "le", "les", "leur", "lui", "ma", "mais", "me", "meme", "mes", "moi", "mon", "ne",
+        "nos", "notre", "nous", "on", "ou", "par", "pas", "pour", "qu", "que", "qui", "sa", "se", "ses",
+        "son", "sur", "ta", "te", "tes", "toi", "ton", "tu", "un", "une", "vos", "votre", "vous",
+        "c", "d", "j", "l", "a", "m", "n", "s", "t", "y", "ete", "est", "sont", "cette", "cet",
+    ],
+    "en": [
+        "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+        "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+        "they", "this", "to", "was", "will", "with",
+    ],
+}
+ELISIONS = {
+    "fr": re.compile(r"\b(?:l|d|j|m|n|s|t|c|qu|jusqu|lorsqu|puisqu|quoiqu)['’]", re.IGNORECASE),
+    "en": re.compile(r"['’]s\b", re.IGNORECASE),
+}
+TOKEN = re.compile(r"\w+")
+
+
+def fold_accents(text):
+    '''"Égalité" > "Egalite"'''
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def analyze(text, lang="en"):
+    '''
+    tokens of a text: lowercased, elisions removed (l'eau > eau, water's > water),
+    accents folded, stopwords of lang removed
+    '''
+    text = str(text).lower()
+    if lang in ELISIONS:
+        text = ELISIONS[lang].sub(" ", text)
+    stopwords = ANALYZER_STOPWORDS.get(lang, set())
+    return [token for token in TOKEN.findall(fold_accents(text)) if token not in stopwords]
+
+
+ANALYZER_STOPWORDS = {lang: {fold_accents(w) for w in words} for lang, words in STOPWORDS.items()}
+
+
+def keyword(value):
+    '''exact value of a keyword field, as matched by term queries'''
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def flatten(value, path=""):
+    '''yield (field path, scalar value) of a document, lists are expanded and objects give "parent.key"'''
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{path}.{key}" if path else key)
+    elif isinstance(value, list):
+        for item in value:
+            yield from flatten(item, path)
+    elif value is not None and path != "":
+        yield path, value
+
+
+def keyword_field(field):
+    '''term queries on the raw keyword of a text field: "title.raw" > "title"'''
+    for suffix in (".raw", ".keyword"):
+        if field.endswith(suffix):
+            return field[:-len(suffix)]
+    return field
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class SearchBackend:
+    '''
+    Operations of a search engine used by index_utils and the generated services:
+    indexes are addressed by name, documents by id, queries use the elasticsearch DSL
+    and search() answers with the shape of an elasticsearch response
+    '''
+    name = None
+    client = None
+
+    def create_index(self, index_name, settings=None, mappings=None):
+        raise NotImplementedError
+
+    def delete_index(self, index_name):
+        raise NotImplementedError
+
+    def exists(self, index_name):
+        raise NotImplementedError
+
+    def index(self, index_name, doc_id, document):
+        raise NotImplementedError
+
+    def delete(self, index_name, doc_id):
+        raise NotImplementedError
+
+    def bulk(self, actions):
+        '''index/delete actions {"_op_type", "_index", "_id", "_source"}, returns {"success", "errors"}'''
+        raise NotImplementedError
+
+    def count(self, index_name):
+        raise NotImplementedError
+
+    def search(self, index_name, query, highlight=None, size=SEARCH_SIZE, from_=0):
+        raise NotImplementedError
+
+    def facets(self, index_name, fields, query=None):
+        '''{field: {value: number of documents matching query}} of keyword fields'''
+        raise NotImplementedError
+
+    def refresh(self, index_name):
+        pass
+
+
+class ElasticsearchBackend(SearchBackend):
+    '''the elasticsearch cluster at url (or an existing client)'''
+    name = "elasticsearch"
+
+    def __init__(self, url="http://localhost:9200", client=None):
+        if client is None:
+            from elasticsearch7 import Elasticsearch
+            client = Elasticsearch(url)
+        self.client = client
+
+    def create_index(self, index_name, settings=None, mappings=None):
+        return self.client.indices.create(index=index_name, settings=settings, mappings=mappings, ignore=400)
+
+    def delete_index(self, index_name):
+        return self.client.indices.delete(index=index_name, ignore=[400, 404])
+
+    def exists(self, index_name):
+        return self.client.indices.exists(index=index_name)
+
+    def index(self, index_name, doc_id, document):
+        return self.client.index(index=index_name, id=doc_id, document=document, request_timeout=45)
+
+    def delete(self, index_name, doc_id):
+        return self.client.delete(index=index_name, id=doc_id, ignore=[404], request_timeout=45)
+
+    def bulk(self, actions):
+        from elasticsearch7.helpers import bulk
+        success, errors = bulk(self.client, actions, raise_on_error=False)
+        return {"success": success, "errors": len(errors)}
+
+    def count(self, index_name):
+        return self.client.count(index=index_name)["count"]
+
+    def search(self, index_name, query, highlight=None, size=SEARCH_SIZE, from_=0):
+        return self.client.search(index=index_name, query=query, highlight=highlight, size=size, from_=from_)
+
+    def facets(self, index_name, fields, query=None):
+        aggs = {field: {"terms": {"field": field, "size": 1000}} for field in fields}
+        res = self.client.search(index=index_name, query=query or {"match_all": {}}, aggs=aggs, size=0)
+        return {
+            field: {bucket["key"]: bucket["doc_count"] for bucket in res["aggregations"][field]["buckets"]}
+            for field in fields
+        }
+
+    def refresh(self, index_name):
+        self.client.indices.refresh(index=index_name)
+
+
+class LocalIndex:
+    '''
+    In-process index of one lang:
+    - text: inverted index {field: {token: {doc: term frequency}}} scored with BM25
+    - keywords: {field: {value: {doc}}} for term filters and facets
+    Documents are numbered, a deleted or replaced document leaves a hole until the index is saved.
+    A saved index is memory mapped: postings and sources are read from the file when
+    a query needs them, and only loaded in memory by the first write.
+    File: magic, header length, json header (ids, offsets), then arrays of native unsigned ints
+    (postings, field lengths) and the json sources.
+    '''
+
+    def __init__(self, filepath, lang="en"):
+        self.filepath = filepath
+        self.lang = lang
+        self.ids = []
+        self.docs = {}
+        self.sources = []
+        self.text = {}
+        self.lengths = {}
+        self.total_lengths = {}
+        self.keywords = {}
+        self.mapped = None
+        self.view = None
+        self.file = None
+        self.mtime = None
+        self.body = 0
+
+    # --- reading
+
+    def open(self):
+        '''memory map the saved index'''
+        self.close()
+        self.file = open(self.filepath, "rb")
+        self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mapped)
+        self.mtime = os.fstat(self.file.fileno()).st_mtime_ns
+        if bytes(self.view[:len(LOCAL_INDEX_MAGIC)]) != LOCAL_INDEX_MAGIC:
+            self.close()
+            raise ValueError(f"{self.filepath} is not a search index")
+        start = len(LOCAL_INDEX_MAGIC)
+        header_length = int.from_bytes(self.view[start:start + 8], "little")
+        header = json.loads(bytes(self.view[start + 8:start + 8 + header_length]))
+        # offsets of the header are relative to the body
+        self.body = start + 8 + header_length
+        self.lang = header["lang"]
+        self.ids = header["ids"]
+        self.docs = {doc_id: n for n, doc_id in enumerate(self.ids)}
+        self.sources = header["sources"]
+        self.text = header["text"]
+        self.lengths = header["lengths"]
+        self.total_lengths = header["total_lengths"]
+        self.keywords = header["keywords"]
+        return self
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.mapped.close()
+            self.file.close()
+        self.view = None
+        self.mapped = None
+        self.file = None
+
+    def uints(self, location):
+        offset, size = location
+        offset += self.body
+        return self.view[offset:offset + 4 * size].cast("I")
+
+    def postings(self, field, token):
+        '''(doc, term frequency) of token in field'''
+        postings = self.text.get(field, {}).get(token)
+        if postings is None:
+            return []
+        if self.view is None:
+            return [(n, tf) for n, tf in postings.items() if self.ids[n] is not None]
+        docs = self.uints(postings)
+        tfs = self.uints((postings[0] + 4 * postings[1], postings[1]))
+        return list(zip(docs, tfs))
+
+    def keyword_docs(self, field, value):
+        docs = self.keywords.get(field, {}).get(keyword(value))
+        if docs is None:
+            return set()
+        if self.view is None:
+            return {n for n in docs if self.ids[n] is not None}
+        return set(self.uints(docs))
+
+    def field_length(self, field, n):
+        lengths = self.lengths.get(field)
+        if lengths is None:
+            return 0
+        if self.view is None:
+            return lengths.get(n, 0)
+        return self.uints(lengths)[n]
+
+    def source(self, n):
+        source = self.sources[n]
+        if self.view is None:
+            return source
+        offset, size = source
+        offset += self.body
+        return json.loads(bytes(self.view[offset:offset + size]))
+
+    def live_docs(self):
+        return {n for n, doc_id in enumerate(self.ids) if doc_id is not None}
+
+    def __len__(self):
+        return len(self.docs)
+
+    # --- writing
+
+    def load(self):
+        '''read the whole mapped index in memory before a write'''
+        if self.view is None:
+            return
+        text = {
+            field: {token: dict(self.postings(field, token)) for token in tokens}
+            for field, tokens in self.text.items()
+        }
+        lengths = {
+            field: {n: size for n, size in enumerate(self.uints(location)) if size > 0}
+            for field, location in self.lengths.items()
+        }
+        keywords = {
+            field: {value: set(self.uints(location)) for value, location in values.items()}
+            for field, values in self.keywords.items()
+        }
+        sources = [self.source(n) for n in range(len(self.ids))]
+        self.close()
+        self.text, self.lengths, self.keywords, self.sources = text, lengths, keywords, sources
+
+    def add(self, doc_id, document):
+        self.load()
+        doc_id = str(doc_id)
+        self.remove(doc_id)
+        n = len(self.ids)
+        self.ids.append(doc_id)
+        self.docs[doc_id] = n
+        self.sources.append(document)
+        for field, value in flatten(document):
+            self.keywords.setdefault(field, {}).setdefault(keyword(value), set()).add(n)
+            if not isinstance(value, str):
+                continue
+            tokens = analyze(value, self.lang)
+            postings = self.text.setdefault(field, {})
+            for token in tokens:
+                postings.setdefault(token, {})
+                postings[token][n] = postings[token].get(n, 0) + 1
+            lengths = self.lengths.setdefault(field, {})
+            lengths[n] = lengths.get(n, 0) + len(tokens)
+            self.total_lengths[field] = self.total_lengths.get(field, 0) + len(tokens)
+
+    def remove(self, doc_id):
+        '''returns False if doc_id was not indexed'''
+        self.load()
+        n = self.docs.pop(str(doc_id), None)
+        if n is None:
+            return False
+        self.ids[n] = None
+        self.sources[n] = None
+        for field, lengths in self.lengths.items():
+            self.total_lengths[field] -= lengths.pop(n, 0)
+        return True
+
+    def save(self):
+        '''write the index without holes (atomically) and memory map it'''
+        self.load()
+        numbers = {}
+        for n, doc_id in enumerate(self.ids):
+            if doc_id is not None:
+                numbers[n] = len(numbers)
+        body = bytearray()
+
+        def write_uints(values):
+            location = [len(body), len(values)]
+            body.extend(array.array("I", values).tobytes())
+            return location
+
+        text = {}
+        for field, tokens in self.text.items():
+            text[field] = {}
+            for token, postings in tokens.items():
+                live = sorted((numbers[n], tf) for n, tf in postings.items() if n in numbers)
+                if len(live) > 0:
+                    text[field][token] = [write_uints([n for n, _ in live] + [tf for _, tf in live])[0], len(live)]
+        lengths = {}
+        for field, field_lengths in self.lengths.items():
+            values = [0] * len(numbers)
+            for n, size in field_lengths.items():
+                if n in numbers:
+                    values[numbers[n]] = size
+            lengths[field] = write_uints(values)
+        keywords = {}
+        for field, values in self.keywords.items():
+            keywords[field] = {}
+            for value, docs in values.items():
+                live = sorted(numbers[n] for n in docs if n in numbers)
+                if len(live) > 0:
+                    keywords[field][value] = write_uints(live)
+        sources = []
+        for n in numbers:
+            data = json.dumps(self.sources[n], ensure_ascii=False, default=str).encode("utf-8")
+            sources.append([len(body), len(data)])
+            body.extend(data)
+        header = json.dumps({
+            "lang": self.lang,
+            "ids": [self.ids[n] for n in numbers],
+            "sources": sources,
+            "text": text,
+            "lengths": lengths,
+            "total_lengths": self.total_lengths,
+            "keywords": keywords,
+        }).encode("utf-8")
+        # the body starts 4 bytes aligned for the arrays of unsigned ints
+        header += b" " * ((-(len(LOCAL_INDEX_MAGIC) + 8 + len(header))) % 4)
+        tmp_path = f"{self.filepath}.tmp"
+        with open(tmp_path, "wb") as fd:
+            fd.write(LOCAL_INDEX_MAGIC)
+            fd.write(len(header).to_bytes(8, "little"))
+            fd.write(header)
+            fd.write(body)
+        os.replace(tmp_path, self.filepath)
+        return self.open()
+
+    # --- queries
+
+    def bm25(self, field, tokens, boost=1.0):
+        '''{doc: BM25 score} of the docs matching any token in field'''
+        scores = {}
+        nb_docs = len(self.docs)
+        if nb_docs == 0 or field not in self.text:
+            return scores
+        avg_length = self.total_lengths.get(field, 0) / nb_docs or 1.0
+        for token in set(tokens):
+            postings = self.postings(field, token)
+            if len(postings) == 0:
+                continue
+            idf = math.log(1 + (nb_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for n, tf in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.field_length(field, n) / avg_length)
+                scores[n] = scores.get(n, 0.0) + boost * idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def match_fields(self, fields, text):
+        '''best_fields multi_match: the score of a doc is its best field score, fields may be boosted ("title^2")'''
+        tokens = analyze(text, self.lang)
+        scores = {}
+        for field in fields:
+            field, _, boost = field.partition("^")
+            for n, score in self.bm25(field, tokens, float(boost or 1)).items():
+                scores[n] = max(scores.get(n, 0.0), score)
+        return scores
+
+    def evaluate(self, query):
+        '''{doc: score} of the docs matching an elasticsearch query'''
+        if query is None or len(query) == 0:
+            return {n: 1.0 for n in self.live_docs()}
+        if len(query) != 1:
+            raise ValueError(f"Unsupported query {query}")
+        kind, params = next(iter(query.items()))
+        if kind == "match_all":
+            return {n: 1.0 for n in self.live_docs()}
+        if kind == "multi_match":
+            fields = params.get("fields") or list(self.text)
+            return self.match_fields(fields, params["query"])
+        if kind == "match":
+            field, value = next(iter(params.items()))
+            if isinstance(value, dict):
+                value = value["query"]
+            return self.match_fields([field], value)
+        if kind == "term":
+            field, value = next(iter(params.items()))
+            if isinstance(value, dict):
+                value = value["value"]
+            return {n: 1.0 for n in self.keyword_docs(keyword_field(field), value)}
+        if kind == "terms":
+            field, values = next(iter(params.items()))
+            docs = set()
+            for value in values:
+                docs |= self.keyword_docs(keyword_field(field), value)
+            return {n: 1.0 for n in docs}
+        if kind == "nested":
+            # nested fields are indexed under "<path>.<key>"
+            return self.evaluate(params["query"])
+        if kind == "bool":
+            return self.evaluate_bool(params)
+        raise ValueError(f"Unsupported query {kind}")
+
+    def evaluate_bool(self, params):
+        scores = None
+        clauses = [(clause, True) for clause in as_list(params.get("must"))]
+        # filter clauses do not score
+        clauses += [(clause, False) for clause in as_list(params.get("filter"))]
+        for clause, scoring in clauses:
+            clause_scores = self.evaluate(clause)
+            if not scoring:
+                clause_scores = {n: 0.0 for n in clause_scores}
+            if scores is None:
+                scores = clause_scores
+            else:
+                scores = {n: score + clause_scores[n] for n, score in scores.items() if n in clause_scores}
+        should = [self.evaluate(clause) for clause in as_list(params.get("should"))]
+        if scores is None:
+            # without must or filter, a doc has to match one should clause
+            scores = {}
+            for clause_scores in should:
+                for n, score in clause_scores.items():
+                    scores[n] = scores.get(n, 0.0) + score
+            if len(should) == 0:
+                scores = {n: 1.0 for n in self.live_docs()}
+        else:
+            for clause_scores in should:
+                for n, score in clause_scores.items():
+                    if n in scores:
+                        scores[n] += score
+        for clause in as_list(params.get("must_not")):
+            for n in self.evaluate(clause):
+                scores.pop(n, None)
+        return scores
+
+    def highlight(self, source, query_tokens, highlight):
+        '''fragments of the highlighted fields where a query token was found'''
+        pre_tags = as_list(highlight.get("pre_tags", "<em>"))[0]
+        post_tags = as_list(highlight.get("post_tags", "</em>"))[0]
+        highlights = {}
+
+        def mark(word):
+            tokens = analyze(word, self.lang)
+            if len(tokens) > 0 and tokens[0] in query_tokens:
+                return f"{pre_tags}{word}{post_tags}"
+            return word
+
+        for field in highlight.get("fields", {}):
+            fragments = []
+            for path, value in flatten(source):
+                if path != field or not isinstance(value, str):
+                    continue
+                marked = TOKEN.sub(lambda m: mark(m.group(0)), value)
+                if marked != value:
+                    fragments.append(marked)
+            if len(fragments) > 0:
+                highlights[field] = fragments
+        return highlights
+
+
+def query_text(query):
+    '''full text searched by the match and multi_match clauses of a query'''
+    if not isinstance(query, dict):
+        return []
+    texts = []
+    for kind, params in query.items():
+        if kind == "multi_match":
+            texts.append(params["query"])
+        elif kind == "match":
+            value = next(iter(params.values()))
+            texts.append(value["query"] if isinstance(value, dict) else value)
+        elif kind == "nested":
+            texts += query_text(params["query"])
+        elif kind == "bool":
+            for clauses in params.values():
+                for clause in as_list(clauses):
+                    texts += query_text(clause)
+    return texts
+
+
+@contextlib.contextmanager
+def file_lock(filepath):
+    '''exclusive lock of filepath between processes, held while an index file is rewritten'''
+    if fcntl is None:
+        yield
+        return
+    with open(f"{filepath}.lock", "a") as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class LocalBackend(SearchBackend):
+    '''
+    Pure python search engine for small catalogs, offline runs and CI:
+    one LocalIndex file per index in directory, the lang of an index is the suffix of its name
+    (<model>_fr, <model>_en).
+    - writes of index() and delete() are visible at once and saved by batches of save_every
+    or save_interval seconds, bulk() and refresh() save at once, pending writes are saved at exit
+    - a save holds a lock on the index file (fcntl): an index replaced by another process
+    is reloaded and the pending writes applied again before it is saved
+    - a missing index answers no results
+    - queries run under the lock of the writes: a save closes the file mapping they read
+    '''
+    name = "local"
+
+    def __init__(self, directory, save_every=LOCAL_SAVE_EVERY, save_interval=LOCAL_SAVE_INTERVAL):
+        self.directory = directory
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.indexes = {}
+        # unsaved (op_type, doc_id, document) per index
+        self.pending = {}
+        self.timers = {}
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)
+
+    def get_filepath(self, index_name):
+        return os.path.join(self.directory, f"{index_name}{LOCAL_INDEX_EXTENSION}")
+
+    def get_index(self, index_name):
+        filepath = self.get_filepath(index_name)
+        index = self.indexes.get(index_name)
+        if not os.path.exists(filepath):
+            if index is not None:
+                index.close()
+                del self.indexes[index_name]
+            self.pending.pop(index_name, None)
+            raise KeyError(f"Index {index_name} does not exist")
+        if index is None or index.mtime != os.stat(filepath).st_mtime_ns:
+            if index is not None:
+                index.close()
+            index = LocalIndex(filepath).open()
+            for operation in self.pending.get(index_name, []):
+                self.apply(index, operation)
+            self.indexes[index_name] = index
+        return index
+
+    def apply(self, index, operation):
+        op_type, doc_id, document = operation
+        if op_type == "delete":
+            return index.remove(doc_id)
+        index.add(doc_id, document)
+        return True
+
+    def save(self, index_name):
+        '''save the pending writes of index_name (under self.lock)'''
+        timer = self.timers.pop(index_name, None)
+        if timer is not None:
+            timer.cancel()
+        if len(self.pending.get(index_name, [])) == 0:
+            return
+        with file_lock(self.get_filepath(index_name)):
+            try:
+                index = self.get_index(index_name)
+            except KeyError:
+                # deleted meanwhile, the pending writes are dropped with it
+                return
+            index.save()
+        self.pending[index_name] = []
+
+    def flush(self, index_name=None):
+        '''save the pending writes of index_name (default: of every index)'''
+        with self.lock:
+            for name in [index_name] if index_name is not None else list(self.pending):
+                self.save(name)
+
+    def write(self, index_name, operation):
+        with self.lock:
+            index = self.get_index(index_name)
+            changed = self.apply(index, operation)
+            if not changed:
+                return False
+            self.pending.setdefault(index_name, []).append(operation)
+            if len(self.pending[index_name]) >= self.save_every:
+                self.save(index_name)
+            elif index_name not in self.timers:
+                timer = threading.Timer(self.save_interval, self.flush, [index_name])
+                timer.daemon = True
+                self.timers[index_name] = timer
+                timer.start()
+        return True
+
+    def create_index(self, index_name, settings=None, mappings=None):
+        lang = index_name.rsplit("_", 1)[-1] if "_" in index_name else "en"
+        filepath = self.get_filepath(index_name)
+        with self.lock, file_lock(filepath):
+            if os.path.exists(filepath):
+                return {"acknowledged": False, "index": index_name}
+            self.indexes[index_name] = LocalIndex(filepath, lang).save()
+        return {"acknowledged": True, "index": index_name}
+
+    def delete_index(self, index_name):
+        filepath = self.get_filepath(index_name)
+        with self.lock, file_lock(filepath):
+            timer = self.timers.pop(index_name, None)
+            if timer is not None:
+                timer.cancel()
+            self.pending.pop(index_name, None)
+            index = self.indexes.pop(index_name, None)
+            if index is not None:
+                index.close()
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        return {"acknowledged": True}
+
+    def exists(self, index_name):
+        return os.path.exists(self.get_filepath(index_name))
+
+    def index(self, index_name, doc_id, document):
+        self.write(index_name, ("index", str(doc_id), document))
+        return {"_index": index_name, "_id": str(doc_id), "result": "created"}
+
+    def delete(self, index_name, doc_id):
+        found = self.write(index_name, ("delete", str(doc_id), None))
+        return {"_index": index_name, "_id": str(doc_id), "result": "deleted" if found else "not_found"}
+
+    def bulk(self, actions):
+        success = 0
+        errors = 0
+        with self.lock:
+            changed = set()
+            for action in actions:
+                try:
+                    index = self.get_index(action["_index"])
+                    if action.get("_op_type", "index") == "delete":
+                        operation = ("delete", str(action["_id"]), None)
+                    else:
+                        operation = ("index", str(action["_id"]), action["_source"])
+                    if self.apply(index, operation):
+                        self.pending.setdefault(action["_index"], []).append(operation)
+                    changed.add(action["_index"])
+                    success += 1
+                except KeyError:
+                    errors += 1
+            for index_name in changed:
+                self.save(index_name)
+        return {"success": success, "errors": errors}
+
+    def refresh(self, index_name):
+        self.flush(index_name)
+
+    def get_search_index(self, index_name):
+        '''index_name or None if it does not exist (not built yet): no results rather than an error'''
+        try:
+            return self.get_index(index_name)
+        except KeyError:
+            return None
+
+    def count(self, index_name):
+        with self.lock:
+            index = self.get_search_index(index_name)
+            return 0 if index is None else len(index)
+
+    def search(self, index_name, query, highlight=None, size=SEARCH_SIZE, from_=0):
+        start = time.perf_counter()
+        # a write or a save swaps the index data and closes its file mapping:
+        # mapped postings and sources are only read under the lock
+        with self.lock:
+            index = self.get_search_index(index_name)
+            if index is None:
+                return {
+                    "took": int((time.perf_counter() - start) * 1000),
+                    "hits": {"total": {"value": 0, "relation": "eq"}, "max_score": None, "hits": []},
+                }
+            scores = index.evaluate(query)
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            query_tokens = set()
+            if highlight:
+                for text in query_text(query):
+                    query_tokens.update(analyze(text, index.lang))
+            hits = []
+            for n, score in ranked[from_:from_ + size]:
+                source = index.source(n)
+                hit = {"_index": index_name, "_id": index.ids[n], "_score": score, "_source": source}
+                if highlight and len(query_tokens) > 0:
+                    highlights = index.highlight(source, query_tokens, highlight)
+                    if len(highlights) > 0:
+                        hit["highlight"] = highlights
+                hits.append(hit)
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "hits": {
+                "total": {"value": len(scores), "relation": "eq"},
+                "max_score": ranked[0][1] if ranked else None,
+                "hits": hits,
+            },
+        }
+
+    def facets(self, index_name, fields, query=None):
+        with self.lock:
+            index = self.get_search_index(index_name)
+            if index is None:
+                return {field: {} for field in fields}
+            docs = set(index.evaluate(query))
+            facets = {}
+            for field in fields:
+                counts = {}
+                for value in index.keywords.get(keyword_field(field), {}):
+                    count = len(docs & index.keyword_docs(keyword_field(field), value))
+                    if count > 0:
+                        counts[value] = count
+                facets[field] = dict(sorted(counts.items(), key=lambda item: -item[1]))
+        return facets
+
+
+def get_backend(name="elasticsearch", url="http://localhost:9200", directory=None):
+    '''search backend "elasticsearch" (cluster at url) or "local" (index files in directory, see clients.SEARCH_DIR)'''
+    if name == "elasticsearch":
+        return ElasticsearchBackend(url)
+    if name == "local":
+        if directory is None:
+            raise ValueError("The local search backend needs the directory of its index files")
+        return LocalBackend(directory)
+    raise ValueError(f"Unknown search backend {name}")
+
+
+parser = argparse.ArgumentParser(description="Query an index of the local search backend")
+parser.add_argument("index", help="index name, e.g. dataset_fr")
+parser.add_argument("query", help="full text query")
+parser.add_argument("--directory", default=None, help="default: clients.SEARCH_DIR")
+parser.add_argument("--size", type=int, default=SEARCH_SIZE)
+
+
+if __name__ == "__main__":
+    from clients import SEARCH_DIR
+    args = parser.parse_args()
+    backend = LocalBackend(args.directory or SEARCH_DIR)
+    res = backend.search(args.index, {"multi_match": {"query": args.query}}, size=args.size)
+    print(f"{res['hits']['total']['value']} results in {res['took']}ms")
+    for hit in res["hits"]["hits"]:
+        print(f"{hit['_score']:.3f} {hit['_id']} {json.dumps(hit['_source'], ensure_ascii=False)[:120]}")
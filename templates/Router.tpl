@@ -129,53 +129,11 @@ async def get_filters(request:Request, lang: str="fr"):
 @router.post("/filters?lang={{lang}}")
 async def filter_{{model_name}}s(request:Request, filter:{{modelName}}, lang:str="{{lang}}"):
     req_filter = await request.json()
-    index_name = f"{{model_name}}_{{lang}}"
     print(req_filter)
-    if len(req_filter) == 1:
-        param_k = list(req_filter.keys())[0]
-        param_v = list(req_filter.values())[0]
-        if param_k == "organizations":
-            final_q = {
-                "nested": {
-                    "path": param_k,
-                    "query": {
-                    "match": {
-                        f"{param_k}.name": ",".join(param_v)
-                       }
-                    }
-                }
-            }
-            
-        else:
-            if isinstance(param_v, list):
-                final_q = {"match": {param_k: {"query": ",".join(param_v)}}}
-            else:
-                final_q = {"match": {param_k: {"query": param_v}}}
-        # highlight = {}
-        # results = search_documents(final_q, highlight,model="{{model_name}}", lang=lang)
-        print(final_q)
-    else:
-        must = []
-        for key, val in req_filter.items():
-            if key == "organizations":
-                nested_q = {"nested": {
-                    "path": key,
-                    "query": {
-                    "match": {
-                        f"{key}.name": ",".join(val)
-                       }
-                    }
-                }}
-                must.append(nested_q)
-            else:
-                if isinstance(val, list):
-                    must.append({"match":{key:",".join(val)}})
-                else:
-                    must.append({"match":{key:val}})
-        final_q = {"bool" : { "must":must}}
-        print(final_q)
-    highlight = {}
-    results = search_documents(final_q, highlight, model="{{model_name}}", lang=lang)
+    try:
+        results = filter_documents(req_filter, model="{{model_name}}", lang=lang)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     results["query"] = req_filter
     print(results)
     return results
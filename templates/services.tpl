@@ -1,12 +1,28 @@
-from elasticsearch7 import Elasticsearch
+import os
+from bson import ObjectId
 from pymongo import MongoClient
+from apps.reference_utils import ReferenceRegistry
+from apps.search_backend import get_backend
+from apps.facet_bitmaps import FacetEngine
 
 #use settings
-es = Elasticsearch("http://localhost:9200")
+# SEARCH_BACKEND=local searches the index files of SEARCH_DIR without elasticsearch
+# (default: the directory the scripts index into, see clients.SEARCH_DIR)
+SEARCH = get_backend(os.environ.get("SEARCH_BACKEND", "elasticsearch"), "http://localhost:9200", os.environ.get("SEARCH_DIR", "{{search_dir}}"))
+es = SEARCH.client
 LANGS = ["fr", "en"]
 DATABASE_NAME = "GD4H_V2"
 mongodb_client = MongoClient("mongodb://localhost:27017")
 DB = mongodb_client[DATABASE_NAME]
+REFERENCES = ReferenceRegistry(DB)
+FACETS = FacetEngine(DB, "{{model_name}}", LANGS, REFERENCES)
+
+def get_facets():
+    """facet bitmaps of the model, updated by index_document and delete_document,
+    rebuilt when the rules, the references or the documents were reimported (or after FACETS.max_age)"""
+    if FACETS.is_stale():
+        FACETS.build()
+    return FACETS
 
 def get_indexed_and_facet_fields(model="{model_name}"):
     return list(DB.rules.find({"model":model, "$or":[{"is_indexed":True}, {"is_facet":True}]}, {"_id":0}))
@@ -17,40 +33,61 @@ def get_indexed_fieldnames(model="{model_name}"):
 def get_facet_fieldnames(model="{model_name}"):
     return [n["slug"] for n in list(DB.rules.find({"model":model,"is_facet":True}, {"slug":1, "_id":0}))]
 
+def get_index_fieldnames(model="{model_name}"):
+    """fields kept in index documents: searchable, facets and short display fields (ITEM_order > 0)"""
+    fields = [n["slug"] for n in get_indexed_and_facet_fields(model)]
+    for rule in DB.rules.find({"model": model, "ITEM_order": {"$gt": 0}}, {"slug":1, "ITEM_order":1, "_id":0}):
+        if type(rule["ITEM_order"]) is int and rule["slug"] not in fields:
+            fields.append(rule["slug"])
+    return fields
+
+def build_index_doc(fields, doc, lang):
+    index_doc = {k: v for k, v in doc[lang].items() if k in fields}
+    index_doc["id"] = str(doc["_id"])
+    return index_doc
+
 def index_document(model, doc):
+    if model == "{{model_name}}":
+        get_facets().update(doc)
+    fields = get_index_fieldnames(model)
     for lang in LANGS:
         index_name = f"{model}_{lang}"
-        fields = get_indexed_and_facet_fields(model)
-        fields.append("_id")
         doc_id = str(doc["_id"])
-        index_doc = doc[lang]
-        index_doc["_id"] = doc_id
-        response = es.index(index = index_name,id = doc_id, document = index_doc,request_timeout=45)
+        index_doc = build_index_doc(fields, doc, lang)
+        response = SEARCH.index(index_name, doc_id, index_doc)
         print(response)
 
 def index_documents(model="{model_name}", lang="fr"):
     index_name = f"{model}_{lang}"
-    fields = ["_id"]
     col_name = f"{model}s"
-    fields = get_indexed_and_facet_fields(model)
-    fields.append("_id")
-    display_fields = {f:1 for f in fields}
-    for doc in DB[col_name].find({}, display_fields):
-        doc_id = str(doc["_id"])
-        index_doc = doc[lang]
-        index_doc["_id"] = doc_id
-        response = es.index(index = index_name,id = doc_id, document = index_doc,request_timeout=45)
-        print(response)
+    fields = get_index_fieldnames(model)
+    display_fields = {f"{lang}.{f}":1 for f in fields}
+    display_fields["_id"] = 1
+    actions = (
+        {"_index": index_name, "_id": str(doc["_id"]), "_source": build_index_doc(fields, doc, lang)}
+        for doc in DB[col_name].find({}, display_fields)
+    )
+    response = SEARCH.bulk(actions)
+    print(response)
     return
 
+def get_filter_query(key, value, model="{model_name}"):
+    """exact filter on a facet: keyword facets, or the raw keyword of searchable fields"""
+    field = f"{key}.raw" if key in get_indexed_fieldnames(model) else key
+    if isinstance(value, list):
+        return {"terms": {field: value}}
+    return {"term": {field: value}}
+
 def delete_document(doc_id, model="{model_name}", lang="fr"):
     index_name = f"{model}_{lang}"
-    response = es.remove(index = index_name,id = doc_id,request_timeout=45)
+    if model == "{{model_name}}":
+        get_facets().remove(doc_id)
+    response = SEARCH.delete(index_name, doc_id)
     print(response)
     return
 def search_documents(query, highlight, model="{model_name}", lang="fr"):
     index_name = f"{model}_{lang}"
-    res = es.search(index=index_name, query=query, highlight=highlight)
+    res = SEARCH.search(index_name, query, highlight)
     result_count =  res["hits"]["total"]["value"]
     results = []
     for r in res["hits"]["hits"]:
@@ -61,7 +98,30 @@ def search_documents(query, highlight, model="{model_name}", lang="fr"):
         results.append(result) 
     return {"results": results, "count": result_count}
 
+def filter_documents(filters, model="{model_name}", lang="fr", size=10):
+    """
+    documents matching facet filters {field: value or [values]} from the facet bitmaps,
+    with the shape of search_documents and the facet counts under the filters
+    """
+    facets = get_facets()
+    ids = facets.documents(filters, lang)
+    fields = get_index_fieldnames(model)
+    projection = {f"{lang}.{f}":1 for f in fields}
+    projection["_id"] = 1
+    docs = {str(doc["_id"]): doc for doc in DB[f"{model}s"].find({"_id": {"$in": [ObjectId(i) for i in ids[:size]]}}, projection)}
+    results = []
+    for doc_id in ids[:size]:
+        if doc_id not in docs:
+            continue
+        result = build_index_doc(fields, docs[doc_id], lang)
+        result["_id"] = doc_id
+        # filters do not rank: every match has the score of a constant_score query (1.0)
+        result["score"] = str(round(1.0*10,2))+"%"
+        results.append(result)
+    return {"results": results, "count": len(ids), "counts": facets.counts(filters, lang)}
+
 def sync_get_filters(lang):
+    counts = get_facets().counts(lang=lang)
     filters = []
     for facet in DB["rules"].find({"model": "{model_name}", "is_facet": True}):
         filter_d = {
@@ -70,10 +130,11 @@ def sync_get_filters(lang):
                 "description": facet[f"description_{lang}"],
                 "is_controled":facet["is_controled"], 
                 "is_multiple":facet["multiple"], 
-                "is_bool": facet["datatype"] == "boolean"
+                "is_bool": facet["datatype"] == "boolean",
+                "counts": counts.get(facet["slug"], {})
             }
         if facet["is_controled"]:
-            filter_d["values"] = DB[facet["reference_table"]].distinct(f"name_{lang}")
+            filter_d["values"] = REFERENCES.values(facet["reference_table"], f"name_{lang}")
         elif facet["datatype"] == "boolean":
             filter_d["values"] = [True, False]
         elif facet["slug"] == "organizations":
@@ -0,0 +1,16 @@
+import os
+import sys
+import importlib.util
+import importlib.machinery
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules import each other as top level modules (utils, clients, ...)
+sys.path.insert(0, ROOT)
+
+# index_utils and index_sync use relative imports: they are loaded as the `scripts` package,
+# as pipeline.py does from the parent directory
+if "scripts" not in sys.modules:
+    spec = importlib.machinery.ModuleSpec("scripts", None, is_package=True)
+    spec.submodule_search_locations = [ROOT]
+    sys.modules["scripts"] = importlib.util.module_from_spec(spec)
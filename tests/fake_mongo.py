@@ -0,0 +1,115 @@
+'''in-memory stand-in of the pymongo collections used by the import and index modules'''
+import re
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$regex" and (not isinstance(value, str) or re.search(operand, value) is None):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return dict(doc)
+    fields = {key: included for key, included in projection.items() if key != "_id"}
+    if len(fields) > 0 and not any(fields.values()):
+        return {key: value for key, value in doc.items() if projection.get(key, 1)}
+    projected = {}
+    for key, included in projection.items():
+        # dotted paths ("fr.title") keep the embedded field
+        *parents, field = key.split(".")
+        source, target = doc, projected
+        for parent in parents:
+            source = source.get(parent, {}) if isinstance(source, dict) else {}
+            target = target.setdefault(parent, {})
+        if included and isinstance(source, dict) and field in source:
+            target[field] = source[field]
+    if projection.get("_id", 1) and "_id" in doc:
+        projected["_id"] = doc["_id"]
+    return projected
+
+
+class FakeCursor(list):
+    def batch_size(self, size):
+        return self
+
+    def limit(self, size):
+        return FakeCursor(self[:size]) if size else self
+
+
+class FakeCollection:
+    def __init__(self, name="collection"):
+        self.name = name
+        self.docs = {}
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(project(doc, projection) for doc in self.docs.values() if matches(doc, query or {}))
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query, projection)
+        return found[0] if len(found) > 0 else None
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def insert_many(self, docs):
+        for doc in docs:
+            self.docs[doc["_id"]] = dict(doc)
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = dict(doc, _id=query["_id"])
+
+    def update_one(self, query, update, upsert=False):
+        found = self.find_one(query)
+        if found is None:
+            if not upsert:
+                return
+            found = {key: value for key, value in query.items() if not isinstance(value, dict)}
+        found.update(update["$set"])
+        self.docs[found["_id"]] = found
+
+    def update_many(self, query, update):
+        for doc in self.docs.values():
+            if matches(doc, query):
+                doc.update(update["$set"])
+
+    def delete_many(self, query):
+        for doc_id in [doc_id for doc_id, doc in self.docs.items() if matches(doc, query)]:
+            del self.docs[doc_id]
+
+    def bulk_write(self, operations, ordered=False):
+        from pymongo import InsertOne, ReplaceOne, UpdateOne
+        inserted = modified = upserted = 0
+        for operation in operations:
+            if isinstance(operation, InsertOne):
+                self.docs[operation._doc["_id"]] = dict(operation._doc)
+                inserted += 1
+            elif isinstance(operation, ReplaceOne):
+                exists = self.find_one(operation._filter) is not None
+                self.replace_one(operation._filter, operation._doc)
+                modified, upserted = modified + exists, upserted + (not exists)
+            elif isinstance(operation, UpdateOne):
+                exists = self.find_one(operation._filter) is not None
+                self.update_one(operation._filter, operation._doc, upsert=True)
+                modified, upserted = modified + exists, upserted + (not exists)
+        details = {"nInserted": inserted, "nUpserted": upserted, "nModified": modified, "writeErrors": []}
+        return type("BulkWriteResult", (), {"bulk_api_result": details})()
+
+
+class FakeDB(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection(name)
+        return collection
+
+    def __getattr__(self, name):
+        return self[name]
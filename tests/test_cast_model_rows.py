@@ -0,0 +1,52 @@
+import pytest
+
+# db_import_utils sanitizes imported values with bleach
+pytest.importorskip("bleach")
+
+import utils  # noqa: E402
+from db_import_utils import cast_model_rows, cast_model_rows_by_row  # noqa: E402
+
+RULES = {
+    "title": {"datatype": "string", "multiple": False},
+    "created": {"datatype": "date", "multiple": False},
+    "updated": {"datatype": "date", "multiple": True},
+    "is_open": {"datatype": "boolean", "multiple": False},
+    "year": {"datatype": "int", "multiple": False},
+    "keywords": {"datatype": "string", "multiple": True},
+    "themes": {"datatype": "boolean", "multiple": True},
+}
+ROWS = [
+    {
+        "title": "air", "created": "2021-01-01T00:04:00.000Z", "updated": "2021-01-01|2022-02-02T10:00:00",
+        "is_open": "true", "year": "2020", "keywords": "a|b", "themes": "True|False", "extra": "x|y",
+    },
+    # bad values are kept as they are
+    {
+        "title": "", "created": "not a date", "updated": "|n/a", "is_open": "peut-être",
+        "year": "n/a", "keywords": "", "themes": "oui|NULL", "extra": "true",
+    },
+    {
+        "title": "NULL", "created": "None", "updated": "", "is_open": "False",
+        "year": "", "keywords": "c", "themes": "", "extra": "NA",
+    },
+    # rows read from a csv with missing cells
+    {"title": "eau", "created": None, "updated": None, "is_open": None, "year": None, "keywords": None, "themes": None, "extra": None},
+]
+
+
+class FakeRules:
+    def get_rule(self, model, slug):
+        return RULES.get(slug)
+
+
+@pytest.fixture(autouse=True)
+def rules(monkeypatch):
+    monkeypatch.setattr(utils, "RULES", FakeRules())
+
+
+@pytest.mark.parametrize("multilang", [True, False])
+def test_column_cast_matches_the_cell_by_cell_cast(multilang):
+    rows = [dict(row) for row in ROWS]
+    assert cast_model_rows("dataset", "fr", rows, multilang) == cast_model_rows_by_row("dataset", "fr", ROWS, multilang)
+    # the rows are not modified
+    assert rows == ROWS
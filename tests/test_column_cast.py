@@ -0,0 +1,46 @@
+import datetime
+
+from column_cast import cast_value, cast_values, cast_columns, cast_unknown_value, format_date
+
+RULES = {
+    "name": {"datatype": "string", "multiple": False},
+    "created": {"datatype": "date", "multiple": False},
+    "is_open": {"datatype": "boolean", "multiple": False},
+    "year": {"datatype": "int", "multiple": False},
+    "keywords": {"datatype": "string", "multiple": True},
+}
+
+
+def test_cast_values_by_datatype():
+    assert cast_value("date", "2021-01-01T00:04:00.000Z") == datetime.datetime(2021, 1, 1, 0, 4)
+    assert cast_value("boolean", "False") is False
+    assert cast_value("int", "2021") == 2021
+    assert cast_value("int", "n/a") == "n/a"
+    assert cast_value("date", "n/a") == "n/a"
+    assert cast_values("string", ["a", "", "NULL", None]) == ["a", "", None, None]
+
+
+def test_cast_unknown_value():
+    assert cast_unknown_value("a|b") == ["a", "b"]
+    assert cast_unknown_value("true") is True
+    assert cast_unknown_value("NA") is None
+
+
+def test_cast_columns():
+    rows = [
+        {"name": "air", "created": "2021-01-01T00:04:00.000Z", "is_open": "true", "year": "2020", "keywords": "a|b", "extra": "x"},
+        {"name": "", "created": "None", "is_open": "False", "year": "", "keywords": "c", "extra": "y|z"},
+    ]
+    assert cast_columns(rows, RULES.get) == [
+        {"name": "air", "created": datetime.datetime(2021, 1, 1, 0, 4), "is_open": True, "year": 2020, "keywords": ["a", "b"], "extra": "x"},
+        {"name": "", "created": None, "is_open": False, "year": "", "keywords": ["c"], "extra": ["y", "z"]},
+    ]
+    assert cast_columns([], RULES.get) == []
+
+
+def test_format_date_of_imported_and_legacy_values():
+    # dates imported by cast_value are datetimes, older documents hold the csv string
+    imported = cast_value("date", "2021-01-01T00:04:00.000Z")
+    assert format_date(imported) == "2021-01-01T00:04:00"
+    assert format_date("2021-01-01T00:04:00.000Z") == "2021-01-01T00:04:00"
+    assert format_date(datetime.date(2021, 1, 1)) == "2021-01-01"
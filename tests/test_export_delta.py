@@ -0,0 +1,67 @@
+import pytest
+
+# export_model_delta catches pymongo's OperationFailure
+pytest.importorskip("pymongo")
+
+import db_export_utils  # noqa: E402
+from db_export_utils import export_model_delta, load_manifest, save_manifest  # noqa: E402
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = "t0"
+
+    def try_next(self):
+        if len(self.changes) == 0:
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeCollection:
+    def __init__(self, changes):
+        self.changes = changes
+
+    def watch(self, **kwargs):
+        return FakeStream(self.changes)
+
+
+def run_delta(monkeypatch, tmp_path, changes):
+    snapshots = []
+    monkeypatch.setattr(db_export_utils, "DB", {"datasets": FakeCollection(changes)})
+    monkeypatch.setattr(db_export_utils, "export_model_snapshot", lambda model, compression, export_dir: snapshots.append(model))
+    save_manifest({"model": "dataset", "snapshot": {"file": "s.jsonl"}, "resume_token": "t0", "deltas": []}, str(tmp_path))
+    export_model_delta("dataset", export_dir=str(tmp_path))
+    return snapshots, load_manifest("dataset", str(tmp_path))
+
+
+def test_delta_skips_events_without_document(monkeypatch, tmp_path):
+    changes = [
+        {"_id": "t1", "operationType": "insert", "documentKey": {"_id": 1}, "fullDocument": {"_id": 1}},
+        {"_id": "t2", "operationType": "createIndexes"},
+        {"_id": "t3", "operationType": "delete", "documentKey": {"_id": 2}},
+    ]
+    snapshots, manifest = run_delta(monkeypatch, tmp_path, changes)
+    assert snapshots == []
+    assert manifest["resume_token"] == "t3"
+    assert manifest["deltas"][0]["upserted"] == 1
+    assert manifest["deltas"][0]["deleted"] == 1
+
+
+@pytest.mark.parametrize("operation", ["drop", "rename", "dropDatabase", "invalidate"])
+def test_delta_falls_back_to_a_snapshot(monkeypatch, tmp_path, operation):
+    changes = [
+        {"_id": "t1", "operationType": "insert", "documentKey": {"_id": 1}, "fullDocument": {"_id": 1}},
+        {"_id": "t2", "operationType": operation},
+    ]
+    snapshots, manifest = run_delta(monkeypatch, tmp_path, changes)
+    assert snapshots == ["dataset"]
+    assert manifest["deltas"] == []
@@ -0,0 +1,63 @@
+import os
+import datetime
+
+import pytest
+
+# the aggregation expressions only run on a real mongod: EXPORT_PARITY_MONGO_URL=mongodb://localhost:27017
+MONGO_URL = os.environ.get("EXPORT_PARITY_MONGO_URL")
+if not MONGO_URL:
+    pytest.skip("EXPORT_PARITY_MONGO_URL is not set", allow_module_level=True)
+pymongo = pytest.importorskip("pymongo")
+
+from export_aggregation import export_value_expr, reference_label_expr  # noqa: E402
+from db_export_utils import compile_value_exporter  # noqa: E402
+
+VALUES = [
+    None, "", "air", "l'air", 2, -3, 2.0, 2.5, True, False,
+    datetime.datetime(2021, 1, 1, 0, 4), datetime.datetime(2021, 1, 1, 0, 4, 0, 123000),
+    "2021-01-01T00:04:00.000Z",
+    ["air", "l'eau", None, True, 2], [], [""],
+]
+REFS = [
+    {"uri": "http://ref/air", "name_fr": "air", "name_en": "air quality"},
+    {"uri": "http://ref/eau", "name_fr": "", "name_en": "water"},
+    {"uri": "http://ref/sols", "name_fr": "sols"},
+    # french name equal to the english name of another row
+    {"uri": "http://ref/soil", "name_fr": "terre", "name_en": "sols"},
+]
+
+
+@pytest.fixture(scope="module")
+def collection():
+    client = pymongo.MongoClient(MONGO_URL)
+    collection = client.get_database("export_parity")["values"]
+    collection.drop()
+    collection.insert_many([{"_id": n, "value": value} for n, value in enumerate(VALUES)])
+    collection.insert_one({"_id": len(VALUES)})
+    yield collection
+    collection.drop()
+    client.close()
+
+
+def aggregate(collection, expr):
+    pipeline = [{"$sort": {"_id": 1}}, {"$project": {"cell": expr}}]
+    return [doc.get("cell") for doc in collection.aggregate(pipeline)]
+
+
+@pytest.mark.parametrize("datatype", ["string", "integer", "float", "boolean", "date"])
+def test_values_are_exported_as_the_python_exporter(collection, datatype):
+    export = compile_value_exporter(datatype)
+    expected = [str(export(value)) for value in VALUES] + ["None"]
+    assert aggregate(collection, export_value_expr(datatype, "$value")) == expected
+
+
+def test_reference_labels_as_the_python_registry(collection):
+    collection.update_many({}, {"$set": {"refs": REFS}})
+    values = ["air", "water", "http://ref/sols", "sols", "inconnu"]
+    collection.update_many({}, {"$unset": {"value": ""}})
+    for n, value in enumerate(values):
+        collection.update_one({"_id": n}, {"$set": {"value": value}})
+    labels = aggregate(collection, reference_label_expr("$refs", "fr", "$value"))
+    # missing names and missing values keep the value itself
+    assert labels[:len(values)] == ["air", "water", "sols", "sols", "inconnu"]
+    assert labels[len(values):] == [None] * (len(VALUES) + 1 - len(values))
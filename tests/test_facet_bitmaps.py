@@ -0,0 +1,91 @@
+import random
+
+from facet_bitmaps import ARRAY_CONTAINER_MAX, Bitmap, FacetEngine
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        return [
+            doc for doc in self.docs
+            if all(doc.get(key) == value for key, value in query.items() if key != "_id")
+            and ("_id" not in query or doc["_id"] in query["_id"]["$in"])
+        ]
+
+
+class FakeDB(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+RULES = [
+    {"slug": "theme", "model": "dataset", "is_facet": True, "datatype": "string"},
+    {"slug": "is_open", "model": "dataset", "is_facet": True, "datatype": "boolean"},
+]
+DATASETS = [
+    {"_id": 1, "fr": {"theme": ["air", "eau"], "is_open": True}},
+    {"_id": 2, "fr": {"theme": "air", "is_open": False}},
+    {"_id": 3, "fr": {"theme": "sols", "is_open": True}},
+]
+
+
+def build(**kwargs):
+    db = FakeDB(rules=FakeCollection(RULES), datasets=FakeCollection(DATASETS), versions=FakeCollection())
+    return db, FacetEngine(db, "dataset", langs=["fr"], **kwargs).build()
+
+
+def test_bitmap_operations_match_sets():
+    random.seed(0)
+    # dense enough for bitset containers, sparse enough for array ones
+    a = set(random.sample(range(200000), 30000))
+    b = set(random.sample(range(200000), 3000))
+    bitmap_a, bitmap_b = Bitmap(a), Bitmap(b)
+    assert any(isinstance(container, int) for container in bitmap_a.containers.values())
+    assert all(not isinstance(container, int) for container in bitmap_b.containers.values())
+    assert list(bitmap_a & bitmap_b) == sorted(a & b)
+    assert list(bitmap_a | bitmap_b) == sorted(a | b)
+    assert list(bitmap_a - bitmap_b) == sorted(a - b)
+    assert len(bitmap_a) == len(a)
+
+
+def test_bitmap_containers_shrink_back_to_arrays():
+    bitmap = Bitmap(range(ARRAY_CONTAINER_MAX + 1))
+    assert isinstance(bitmap.containers[0], int)
+    bitmap.discard(0)
+    assert not isinstance(bitmap.containers[0], int)
+    assert 0 not in bitmap and ARRAY_CONTAINER_MAX in bitmap
+
+
+def test_filters_and_counts():
+    _, engine = build()
+    assert engine.documents({"theme": ["eau", "sols"]}) == ["1", "3"]
+    assert engine.documents({"theme": "air", "is_open": True}) == ["1"]
+    counts = engine.counts({"theme": "air"})
+    # a field is counted with the filters of the other fields only
+    assert counts["theme"] == {"air": 2, "eau": 1, "sols": 1}
+    assert counts["is_open"] == {True: 1, False: 1}
+
+
+def test_removed_numbers_are_reused():
+    _, engine = build()
+    for n in range(10):
+        engine.remove(2 if n % 2 == 0 else 4)
+        engine.add({"_id": 4 if n % 2 == 0 else 2, "fr": {"theme": "eau", "is_open": True}})
+    assert len(engine.ids) == 3
+    engine.update({"_id": 1, "fr": {"theme": "sols", "is_open": False}})
+    assert len(engine.ids) == 3
+    assert engine.documents({"theme": "sols"}) == ["1", "3"]
+
+
+def test_stale_after_a_version_bump_or_max_age():
+    db, engine = build(check_interval=0)
+    assert not engine.is_stale()
+    db["versions"].docs.append({"_id": "datasets", "version": 1})
+    assert engine.is_stale()
+    engine.build()
+    assert not engine.is_stale()
+    _, engine = build(max_age=0)
+    assert engine.is_stale()
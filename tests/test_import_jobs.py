@@ -0,0 +1,103 @@
+import pytest
+
+# ImportJob ids are bson ObjectIds and BulkWriter sends pymongo operations
+pytest.importorskip("bson")
+pytest.importorskip("pymongo")
+
+from pymongo.errors import BulkWriteError  # noqa: E402
+
+from bulk_utils import BulkWriter  # noqa: E402
+from import_jobs import ImportJob  # noqa: E402
+
+
+class FakeCollection:
+    '''documents by _id, bulk_write rejects existing _ids as mongo does'''
+
+    name = "datasets"
+
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query):
+        return self.docs.get(query["_id"])
+
+    def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = dict(doc, _id=query["_id"])
+
+    def update_one(self, query, update):
+        self.docs[query["_id"]].update(update["$set"])
+
+    def bulk_write(self, operations, ordered=False):
+        errors = []
+        for index, operation in enumerate(operations):
+            doc = operation._doc
+            if doc["_id"] in self.docs:
+                errors.append({
+                    "index": index,
+                    "code": 11000,
+                    "errmsg": f"E11000 duplicate key error collection: db.datasets index: _id_ dup key: {{ _id: {doc['_id']} }}",
+                })
+            else:
+                self.docs[doc["_id"]] = doc
+        details = {"nInserted": len(operations) - len(errors), "nUpserted": 0, "nModified": 0, "writeErrors": errors}
+        if len(errors) > 0:
+            raise BulkWriteError(details)
+        return type("Result", (), {"bulk_api_result": details})()
+
+
+class Killed(Exception):
+    pass
+
+
+def import_rows(db, datasets, rows, resume=False, kill_at_batch=None):
+    '''import rows with batches of 2, killed between the write and the checkpoint of a batch'''
+    job = ImportJob(db, "datasets_fr", resume=resume)
+
+    def on_flush(flushed):
+        if job.batches + 1 == kill_at_batch:
+            raise Killed()
+        job.commit(flushed)
+
+    bulk_writer = BulkWriter(datasets, batch_size=2, on_flush=on_flush, duplicates_ok=job.resumed)
+    with bulk_writer:
+        for row, meta in job.items(rows):
+            job.write(bulk_writer, [{"title": row, "_import": meta}])
+    job.finish()
+    return job, bulk_writer
+
+
+def test_kill_and_resume_writes_every_row_once():
+    db = {"_jobs": FakeCollection()}
+    datasets = FakeCollection()
+    rows = [f"row {n}" for n in range(1, 8)]
+    with pytest.raises(Killed):
+        import_rows(db, datasets, rows, kill_at_batch=2)
+    # batch 2 is in mongo but not checkpointed
+    assert db["_jobs"].docs["datasets_fr"]["row"] == 2
+    assert len(datasets.docs) == 4
+    job, bulk_writer = import_rows(db, datasets, rows, resume=True)
+    assert job.resumed
+    assert sorted(doc["title"] for doc in datasets.docs.values()) == rows
+    assert bulk_writer.stats()["rewritten"] == 2
+    assert db["_jobs"].docs["datasets_fr"]["row"] == 7
+
+
+def test_new_runs_do_not_collide_with_previous_ones():
+    db = {"_jobs": FakeCollection()}
+    datasets = FakeCollection()
+    rows = ["a", "b", "c"]
+    import_rows(db, datasets, rows)
+    job, bulk_writer = import_rows(db, datasets, rows)
+    assert not job.resumed
+    assert len(datasets.docs) == 6
+    assert bulk_writer.stats()["errors"] == 0
+
+
+def test_duplicates_are_reported_outside_resumed_runs(capsys):
+    datasets = FakeCollection()
+    with BulkWriter(datasets, batch_size=10) as bulk_writer:
+        bulk_writer.insert({"_id": 1})
+        bulk_writer.insert({"_id": 1})
+    assert bulk_writer.stats()["duplicates"] == 1
+    assert bulk_writer.stats()["rewritten"] == 0
+    assert "Error row 2: E11000" in capsys.readouterr().out
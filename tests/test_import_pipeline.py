@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from import_pipeline import ImportPipeline, Stage
+
+
+def pipeline(written, double=lambda rows: [row * 2 for row in rows]):
+    return ImportPipeline([
+        Stage("double", double),
+        Stage("write", lambda rows: written.extend(rows) or rows),
+    ], chunk_size=2, queue_size=1)
+
+
+def test_chunks_go_through_the_stages_in_order():
+    written = []
+    stats = pipeline(written).run(range(7))
+    assert written == [0, 2, 4, 6, 8, 10, 12]
+    assert stats["read"]["rows"] == stats["write"]["rows"] == 7
+
+
+def test_failing_stage_is_raised():
+    written = []
+
+    def double(rows):
+        if 6 in rows:
+            raise ValueError("bad row")
+        return [row * 2 for row in rows]
+
+    with pytest.raises(ValueError, match="bad row"):
+        pipeline(written, double).run(range(100))
+    assert 12 not in written
+
+
+def test_failing_source_stops_the_stages():
+    def rows():
+        yield from range(10)
+        raise OSError("truncated file")
+
+    threads = threading.active_count()
+    with pytest.raises(OSError, match="truncated file"):
+        pipeline([]).run(rows())
+    # the stage threads were stopped and joined before the error went up
+    assert threading.active_count() == threads
@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# heavy modules that must only be loaded on first use (see clients.py)
+LAZY_MODULES = ["argostranslate", "pymongo", "bson", "elasticsearch7"]
+# seconds, generous for slow CI machines: the heavy modules alone take longer
+IMPORT_TIME_BUDGET = 1.0
+
+MEASURE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": [m for m in {lazy} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module):
+    '''import module in a fresh interpreter, return (seconds, heavy modules loaded)'''
+    code = MEASURE.format(module=module, lazy=LAZY_MODULES)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if out.returncode != 0:
+        pytest.fail(f"import {module} failed:\n{out.stderr}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return result["elapsed"], result["modules"]
+
+
+@pytest.mark.parametrize("module", ["utils", "clients"])
+def test_heavy_modules_are_loaded_on_first_use(module):
+    elapsed, loaded = measure_import(module)
+    assert loaded == [], f"{module} loads {', '.join(loaded)} at import time"
+    assert elapsed < IMPORT_TIME_BUDGET, f"import {module} takes {elapsed:.3f}s"
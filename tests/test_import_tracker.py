@@ -0,0 +1,62 @@
+import pytest
+
+# upserts are pymongo operations on bson ObjectIds
+pytest.importorskip("bson")
+pytest.importorskip("pymongo")
+
+from fake_mongo import FakeDB  # noqa: E402
+
+from bulk_utils import BulkWriter  # noqa: E402
+from import_tracker import IMPORTS_COLLECTION, ImportTracker  # noqa: E402
+
+ROWS = [
+    {"uri": "u1", "name": "air"},
+    {"uri": "", "name": "eau"},
+    # identical keyless rows each keep their doc
+    {"uri": "", "name": "eau"},
+]
+
+
+def tracked_import(db, rows, incremental=True):
+    '''import rows as import_reference_table does, returns the changes'''
+    tracker = ImportTracker(db, "ref_theme", key_field="uri")
+    if not incremental:
+        db["ref_theme"].delete_many({})
+        tracker.reset()
+    with BulkWriter(db["ref_theme"]) as bulk_writer:
+        tracker.upsert(bulk_writer, [dict(row, _import=meta) for row, meta in tracker.diff(rows)])
+    return tracker.finish(bulk_writer)
+
+
+def test_incremental_after_full_import_changes_nothing():
+    db = FakeDB()
+    changes = tracked_import(db, ROWS, incremental=False)
+    assert len(changes["inserted"]) == 3
+    changes = tracked_import(db, ROWS)
+    assert changes == {"inserted": [], "updated": [], "deleted": []}
+    assert len(db["ref_theme"].docs) == 3
+
+
+def test_full_import_forgets_rows_of_the_dropped_collection():
+    db = FakeDB()
+    tracked_import(db, ROWS + [{"uri": "u2", "name": "sols"}], incremental=False)
+    changes = tracked_import(db, ROWS, incremental=False)
+    # the hash of u2 went with the dropped collection: nothing left to tombstone
+    assert changes["deleted"] == []
+    changes = tracked_import(db, ROWS + [{"uri": "u2", "name": "sols"}])
+    assert len(changes["inserted"]) == 1
+    assert len(db["ref_theme"].docs) == 4
+
+
+def test_record_stores_the_rows_written_by_a_job():
+    db = FakeDB()
+    rows = [{"id": "1", "title": "a"}, {"id": "2", "title": "b"}, {"id": "", "title": "c"}]
+    # row 2 failed to be written
+    db["datasets"].insert_many([{"_id": "doc1", "title": "a"}, {"_id": "doc3", "title": "c"}])
+    db[IMPORTS_COLLECTION].insert_many([{"_id": "datasets:old", "collection": "datasets", "doc_id": "gone", "hash": "", "deleted": False, "run": None}])
+    tracker = ImportTracker(db, "datasets", key_field="id")
+    assert tracker.record(zip(rows, ["doc1", "doc2", "doc3"])) == 2
+    tracker = ImportTracker(db, "datasets", key_field="id")
+    changed = tracker.diff(rows)
+    assert [row["id"] for row, _ in changed] == ["2"]
+    assert tracker.tombstone() == []
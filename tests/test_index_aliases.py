@@ -0,0 +1,102 @@
+import fnmatch
+
+import scripts.index_utils as index_utils
+from scripts.index_utils import delete_old_versions, get_index_versions, swap_alias
+
+
+class FakeIndices:
+    '''indices api of elasticsearch over {index name: set of aliases}'''
+
+    def __init__(self, indexes):
+        self.indexes = {name: set(aliases) for name, aliases in indexes.items()}
+        self.deleted = []
+
+    def get(self, index):
+        return {name: {} for name in self.indexes if fnmatch.fnmatch(name, index)}
+
+    def exists(self, index):
+        return index in self.indexes or self.exists_alias(index)
+
+    def exists_alias(self, name):
+        return any(name in aliases for aliases in self.indexes.values())
+
+    def get_alias(self, name):
+        return {index: {"aliases": {name: {}}} for index, aliases in self.indexes.items() if name in aliases}
+
+    def update_aliases(self, body):
+        for action in body["actions"]:
+            (op, params), = action.items()
+            if op == "add":
+                self.indexes[params["index"]].add(params["alias"])
+            elif op == "remove":
+                self.indexes[params["index"]].discard(params["alias"])
+            elif op == "remove_index":
+                del self.indexes[params["index"]]
+
+    def create(self, index, **kwargs):
+        self.indexes[index] = set()
+        return {"acknowledged": True, "index": index}
+
+    def delete(self, index, ignore=()):
+        self.deleted.append(index)
+        self.indexes.pop(index, None)
+
+
+class FakeES:
+    def __init__(self, indexes):
+        self.indices = FakeIndices(indexes)
+
+
+def use_es(monkeypatch, indexes):
+    es = FakeES(indexes)
+    monkeypatch.setattr(index_utils, "es", es)
+    return es.indices
+
+
+def test_versions_are_sorted_numbers(monkeypatch):
+    use_es(monkeypatch, {"dataset_fr_v10": [], "dataset_fr_v9": [], "dataset_fr_vtmp": [], "dataset_en_v1": []})
+    assert get_index_versions("dataset_fr") == [9, 10]
+    assert get_index_versions("organization_fr") == []
+
+
+def test_swap_moves_the_alias_to_the_new_version(monkeypatch):
+    indices = use_es(monkeypatch, {"dataset_fr_v1": ["dataset_fr"], "dataset_fr_v2": []})
+    swap_alias("dataset_fr", "dataset_fr_v2")
+    assert indices.indexes == {"dataset_fr_v1": set(), "dataset_fr_v2": {"dataset_fr"}}
+    # swapping again changes nothing
+    swap_alias("dataset_fr", "dataset_fr_v2")
+    assert indices.indexes["dataset_fr_v2"] == {"dataset_fr"}
+
+
+def test_swap_replaces_an_index_created_before_aliases(monkeypatch):
+    indices = use_es(monkeypatch, {"dataset_fr": [], "dataset_fr_v1": []})
+    swap_alias("dataset_fr", "dataset_fr_v1")
+    assert indices.indexes == {"dataset_fr_v1": {"dataset_fr"}}
+
+
+def test_old_versions_are_deleted_except_the_kept_ones(monkeypatch):
+    indices = use_es(monkeypatch, {f"dataset_fr_v{v}": [] for v in range(1, 5)})
+    indices.indexes["dataset_fr_v4"].add("dataset_fr")
+    delete_old_versions("dataset_fr", keep=1)
+    assert indices.deleted == ["dataset_fr_v1", "dataset_fr_v2"]
+    assert sorted(indices.indexes) == ["dataset_fr_v3", "dataset_fr_v4"]
+    delete_old_versions("dataset_fr", keep=0)
+    assert sorted(indices.indexes) == ["dataset_fr_v4"]
+
+
+def test_rebuild_stops_when_an_index_is_not_created(monkeypatch):
+    indices = use_es(monkeypatch, {"dataset_fr_v1": ["dataset_fr"]})
+    indexed = []
+
+    def create_index(model, lang, bulk_load, index_name):
+        if lang == "en":
+            return {"error": {"type": "resource_already_exists_exception"}, "status": 400}
+        return indices.create(index_name)
+
+    monkeypatch.setattr(index_utils, "is_local_search", lambda: False)
+    monkeypatch.setattr(index_utils, "create_index", create_index)
+    monkeypatch.setattr(index_utils, "index_model", lambda *args, **kwargs: indexed.append(args))
+    assert not index_utils.rebuild_index("dataset", ["fr", "en"])
+    assert indexed == []
+    # the version created for fr is removed, the alias still reads v1
+    assert indices.indexes == {"dataset_fr_v1": {"dataset_fr"}}
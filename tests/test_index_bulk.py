@@ -0,0 +1,68 @@
+import sys
+import types
+import threading
+
+import pytest
+
+from scripts.index_bulk import BulkIndexer
+
+
+def streaming_bulk(client, actions, **kwargs):
+    '''results of the _bulk API by _id: "bad" is rejected, "gone" is not found, "boom" kills the request'''
+    for action in actions:
+        op = action.get("_op_type", "index")
+        result = {"_index": action["_index"], "_id": action["_id"], "status": 200}
+        if action["_id"] == "boom":
+            raise ConnectionError("connection reset")
+        if action["_id"] == "bad":
+            result.update(status=400, error={"type": "mapper_parsing_exception"})
+        elif action["_id"] == "gone":
+            result.update(status=404, result="not_found")
+        yield result["status"] < 300, {op: result}
+
+
+@pytest.fixture(autouse=True)
+def bulk_helpers(monkeypatch):
+    try:
+        import elasticsearch7.helpers as helpers
+    except ImportError:
+        helpers = types.ModuleType("elasticsearch7.helpers")
+        monkeypatch.setitem(sys.modules, "elasticsearch7", types.ModuleType("elasticsearch7"))
+        monkeypatch.setitem(sys.modules, "elasticsearch7.helpers", helpers)
+    monkeypatch.setattr(helpers, "streaming_bulk", streaming_bulk, raising=False)
+
+
+def index(indexer, doc_ids, op="index"):
+    for doc_id in doc_ids:
+        indexer.add({"_op_type": op, "_index": "dataset_fr", "_id": doc_id, "_source": {}})
+
+
+def test_errors_are_collected_per_document():
+    with BulkIndexer(None, workers=2, chunk_size=2) as indexer:
+        index(indexer, ["1", "bad", "2", "3"])
+    assert indexer.errors == [{
+        "index": "dataset_fr", "id": "bad", "op": "index", "status": 400,
+        "error": {"type": "mapper_parsing_exception"},
+    }]
+    stats = indexer.stats()
+    assert (stats["actions"], stats["success"], stats["errors"]) == (4, 3, 1)
+
+
+def test_deletes_of_missing_documents_succeed():
+    with BulkIndexer(None, workers=1) as indexer:
+        index(indexer, ["1", "gone"], op="delete")
+    assert indexer.errors == []
+    assert indexer.stats()["success"] == 2
+
+
+def test_dead_worker_drains_the_queue():
+    indexer = BulkIndexer(None, workers=1, chunk_size=1)
+    # the queue holds 2 actions: add() would block once the worker died
+    adding = threading.Thread(target=index, args=(indexer, ["1", "boom"] + [str(n) for n in range(20)]))
+    adding.start()
+    adding.join(5)
+    assert not adding.is_alive()
+    indexer.close()
+    assert [error["error"] for error in indexer.errors] == ["ConnectionError('connection reset')"]
+    stats = indexer.stats()
+    assert (stats["actions"], stats["success"], stats["errors"]) == (22, 1, 1)
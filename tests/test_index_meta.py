@@ -0,0 +1,48 @@
+import scripts.index_utils as index_utils
+from scripts.index_utils import compare_index_meta, get_index_meta
+
+SETTINGS = {"analysis": {"analyzer": {"default": {"type": "french"}}}}
+PROPERTIES = {
+    "title": {"type": "text"},
+    "theme": {"type": "keyword"},
+}
+
+
+def test_same_mapping_is_unchanged():
+    assert get_index_meta(SETTINGS, PROPERTIES) == get_index_meta(SETTINGS, dict(reversed(PROPERTIES.items())))
+    assert compare_index_meta(get_index_meta(SETTINGS, PROPERTIES), get_index_meta(SETTINGS, PROPERTIES)) == "unchanged"
+
+
+def test_added_field_is_additive():
+    properties = dict(PROPERTIES, year={"type": "integer"})
+    assert compare_index_meta(get_index_meta(SETTINGS, PROPERTIES), get_index_meta(SETTINGS, properties)) == "additive"
+
+
+def test_changed_or_removed_field_is_changed():
+    live = get_index_meta(SETTINGS, PROPERTIES)
+    changed = dict(PROPERTIES, theme={"type": "text"})
+    assert compare_index_meta(live, get_index_meta(SETTINGS, changed)) == "changed"
+    assert compare_index_meta(live, get_index_meta(SETTINGS, {"title": {"type": "text"}})) == "changed"
+
+
+def test_changed_settings_are_changed():
+    settings = {"analysis": {"analyzer": {"default": {"type": "english"}}}}
+    properties = dict(PROPERTIES, year={"type": "integer"})
+    assert compare_index_meta(get_index_meta(SETTINGS, PROPERTIES), get_index_meta(settings, properties)) == "changed"
+
+
+def test_index_without_fingerprint_is_changed():
+    assert compare_index_meta(None, get_index_meta(SETTINGS, PROPERTIES)) == "changed"
+    assert compare_index_meta({}, get_index_meta(SETTINGS, PROPERTIES)) == "changed"
+
+
+def test_sync_index_acts_on_the_status_of_each_lang(monkeypatch):
+    statuses = {"fr": "changed", "en": "additive"}
+    calls = []
+    monkeypatch.setattr(index_utils, "is_local_search", lambda: False)
+    monkeypatch.setattr(index_utils, "get_index_status", lambda model, lang: (statuses[lang], {}))
+    monkeypatch.setattr(index_utils, "extend_mapping", lambda model, lang, config: calls.append(("extend", lang)))
+    monkeypatch.setattr(index_utils, "rebuild_index", lambda model, langs, bulk_load: calls.append(("rebuild", langs)) or True)
+    monkeypatch.setattr(index_utils, "reconcile_index", lambda model, langs: calls.append(("reconcile", langs)))
+    assert index_utils.sync_index("dataset", ["fr", "en"])
+    assert calls == [("extend", "en"), ("rebuild", ["fr"]), ("reconcile", ["en"])]
@@ -0,0 +1,90 @@
+import json
+import datetime
+
+import pytest
+from fake_mongo import FakeDB
+
+import scripts.index_utils as index_utils
+from scripts.index_utils import build_index_doc, json_default, reconcile_index, scan_index_hashes
+
+FIELDS = {
+    "dataset": ["title", "created", "year", "organizations"],
+    "organization": ["name", "founded"],
+}
+ORGANIZATION = {"_id": "o1", "fr": {"name": "ADEME", "founded": datetime.datetime(1991, 1, 1), "website": "ademe.fr"}}
+DATASETS = [
+    {"_id": "d1", "fr": {
+        "title": "qualité de l'air",
+        "created": datetime.datetime(2021, 1, 1, 0, 4, 0, 123000),
+        "year": 2021.0,
+        "organizations": [ORGANIZATION, None],
+        "description": "not indexed",
+    }},
+    {"_id": "d2", "fr": {"title": "eau", "created": datetime.date(2020, 5, 1), "organizations": []}},
+    {"_id": "d3", "fr": {"title": "sols"}},
+]
+
+
+class FakeSearch:
+    '''point in time search of elasticsearch over the _source sent by the client'''
+
+    def __init__(self, sources):
+        # the client sends json, the index returns it parsed
+        self.hits = [
+            {"_id": doc_id, "_source": json.loads(json.dumps(source, default=json_default)), "sort": [n]}
+            for n, (doc_id, source) in enumerate(sources.items())
+        ]
+        self.closed = []
+
+    def open_point_in_time(self, index, keep_alive):
+        return {"id": f"pit-{index}"}
+
+    def search(self, body):
+        start = body["search_after"][0] + 1 if "search_after" in body else 0
+        return {"pit_id": body["pit"]["id"], "hits": {"hits": self.hits[start:start + body["size"]]}}
+
+    def close_point_in_time(self, body):
+        self.closed.append(body["id"])
+
+
+@pytest.fixture(autouse=True)
+def index_fields(monkeypatch):
+    monkeypatch.setattr(index_utils, "get_index_fields", lambda model="dataset": FIELDS[model])
+
+
+def index_of(datasets):
+    return {doc["_id"]: build_index_doc("dataset", doc, "fr") for doc in datasets}
+
+
+def use_stubs(monkeypatch, sources):
+    db = FakeDB()
+    db["datasets"].insert_many(DATASETS)
+    search = FakeSearch(sources)
+    monkeypatch.setattr(index_utils, "DB", db)
+    monkeypatch.setattr(index_utils, "es", search)
+    return search
+
+
+def test_indexed_documents_are_not_stale(monkeypatch):
+    search = use_stubs(monkeypatch, index_of(DATASETS))
+    assert index_utils.index_doc_hash(search.hits[0]["_source"]) == index_utils.index_doc_hash(index_of(DATASETS)["d1"])
+    report = reconcile_index("dataset", ["fr"], repair=False)
+    assert report == {"fr": {"missing": [], "stale": [], "orphaned": []}}
+    assert search.closed == ["pit-dataset_fr"]
+
+
+def test_missing_stale_and_orphaned_documents(monkeypatch):
+    sources = index_of(DATASETS)
+    del sources["d2"]
+    sources["d3"]["title"] = "sols pollués"
+    sources["d4"] = {"title": "bruit", "id": "d4"}
+    use_stubs(monkeypatch, sources)
+    report = reconcile_index("dataset", ["fr"], repair=False)
+    assert report == {"fr": {"missing": ["d2"], "stale": ["d3"], "orphaned": ["d4"]}}
+
+
+def test_hashes_are_scanned_by_pages(monkeypatch):
+    search = use_stubs(monkeypatch, index_of(DATASETS))
+    hashes = list(scan_index_hashes("dataset_fr", page_size=2))
+    assert [doc_id for doc_id, _ in hashes] == ["d1", "d2", "d3"]
+    assert search.closed == ["pit-dataset_fr"]
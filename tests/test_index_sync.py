@@ -0,0 +1,134 @@
+import pytest
+
+import scripts.index_sync as index_sync
+from scripts.index_sync import IndexSync
+
+
+class FakeStream:
+    '''change stream replaying a list of events, then closed'''
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = None
+        self.alive = True
+
+    def try_next(self):
+        if len(self.changes) == 0:
+            self.alive = False
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def change(token, operation, doc_id=None):
+    event = {"_id": token, "operationType": operation, "ns": {"db": "db", "coll": "datasets"}}
+    if doc_id is not None:
+        event["documentKey"] = {"_id": doc_id}
+    return event
+
+
+def run_sync(monkeypatch, changes):
+    sync = IndexSync(models=["dataset"], langs=["fr"], batch_size=10)
+    calls = {"sent": [], "tokens": [], "reconciled": [], "opened": 0}
+    streams = [FakeStream(changes)]
+
+    def watch(resume_token):
+        calls["opened"] += 1
+        if len(streams) > 0:
+            return streams.pop(0)
+        return FakeStream([])
+
+    monkeypatch.setattr(sync, "watch", watch)
+    monkeypatch.setattr(sync, "save_token", calls["tokens"].append)
+    monkeypatch.setattr(sync, "send", lambda batch, token: calls["sent"].append([c["_id"] for c in batch]))
+    monkeypatch.setattr(index_sync, "reconcile_index", lambda model, langs: calls["reconciled"].append(model))
+    stream = sync.watch(None)
+    while stream is not None:
+        stream = sync.tail(stream, None)
+    return calls
+
+
+def test_document_events_are_batched(monkeypatch):
+    calls = run_sync(monkeypatch, [change("t1", "insert", 1), change("t2", "delete", 2)])
+    assert calls["sent"] == [["t1", "t2"]]
+    assert calls["reconciled"] == []
+
+
+def test_drop_reconciles_and_reopens_the_stream(monkeypatch):
+    calls = run_sync(monkeypatch, [change("t1", "insert", 1), change("t2", "drop"), change("t3", "insert", 3)])
+    assert calls["sent"] == [["t1"]]
+    assert calls["reconciled"] == ["dataset"]
+    assert calls["opened"] == 2
+
+
+def test_invalidate_without_namespace(monkeypatch):
+    calls = run_sync(monkeypatch, [{"_id": "t1", "operationType": "invalidate"}])
+    assert calls["reconciled"] == ["dataset"]
+    assert calls["opened"] == 2
+
+
+def test_other_events_are_skipped_and_their_token_saved(monkeypatch):
+    calls = run_sync(monkeypatch, [change("t1", "createIndexes"), change("t2", "insert", 2)])
+    assert calls["sent"] == [["t2"]]
+    assert calls["tokens"] == ["t1"]
+
+
+def test_actions_of_events_without_document():
+    assert IndexSync(models=["dataset"], langs=["fr"]).actions(change("t1", "rename")) == []
+
+
+class FakeIndexer:
+    '''BulkIndexer failing the documents of its first `failures` uses'''
+
+    failures = 0
+    uses = 0
+
+    def __init__(self, client, workers=1, name="sync"):
+        FakeIndexer.uses += 1
+        failed = FakeIndexer.uses <= FakeIndexer.failures
+        self.errors = [{"index": "dataset_fr", "id": "1", "status": 503, "error": "unavailable"}] if failed else []
+
+    def add(self, action):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def send_batch(monkeypatch, failures, tokens, max_retries=2):
+    FakeIndexer.failures = failures
+    FakeIndexer.uses = 0
+    sync = IndexSync(models=["dataset"], langs=["fr"], max_retries=max_retries, retry_backoff=0)
+    monkeypatch.setattr(index_sync, "BulkIndexer", FakeIndexer)
+    monkeypatch.setattr(index_sync, "get_es", lambda: None)
+    monkeypatch.setattr(sync, "save_token", tokens.append)
+    sync.send([change("t1", "delete", 1)], "t1")
+    return tokens
+
+
+def test_token_saved_once_the_batch_is_indexed(monkeypatch):
+    assert send_batch(monkeypatch, 0, []) == ["t1"]
+    assert FakeIndexer.uses == 1
+
+
+def test_failed_batch_is_retried_before_saving_the_token(monkeypatch):
+    assert send_batch(monkeypatch, 2, []) == ["t1"]
+    assert FakeIndexer.uses == 3
+
+
+def test_token_kept_when_documents_keep_failing(monkeypatch):
+    tokens = []
+    with pytest.raises(RuntimeError):
+        send_batch(monkeypatch, 10, tokens)
+    assert tokens == []
+    assert FakeIndexer.uses == 3
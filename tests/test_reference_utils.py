@@ -0,0 +1,34 @@
+from fake_mongo import FakeDB
+
+from reference_utils import ReferenceRegistry
+
+REFS = [
+    {"_id": 1, "uri": "http://ref/air", "name_fr": "air", "name_en": "air quality"},
+    {"_id": 2, "uri": "http://ref/eau", "name_fr": "", "name_en": "water"},
+    # english name equal to the french name of the next row
+    {"_id": 3, "uri": "http://ref/terre", "name_fr": "terre", "name_en": "sols"},
+    {"_id": 4, "uri": "http://ref/sols", "name_fr": "sols"},
+    {"_id": 5, "uri": "", "name_fr": "bruit", "name_en": "noise"},
+]
+
+
+def registry():
+    db = FakeDB()
+    db["ref_theme"].insert_many(REFS)
+    return ReferenceRegistry(db)
+
+
+def test_values_skip_empty_cells():
+    references = registry()
+    assert references.values("ref_theme", "name_fr") == ["air", "terre", "sols", "bruit"]
+    assert references.values("ref_theme", "name_en") == ["air quality", "water", "sols", "noise"]
+    assert "" not in references.values("ref_theme", "uri")
+
+
+def test_names_are_looked_up_in_lang_first():
+    references = registry()
+    values = ["sols", "air quality", "http://ref/terre", "water", "inconnu", ""]
+    assert references.names("ref_theme", values, "fr") == ["sols", "air", "terre", "water", "inconnu", ""]
+    assert references.names("ref_theme", values, "en") == ["sols", "air quality", "sols", "water", "inconnu", ""]
+    # a name only known in the other lang
+    assert references.names("ref_theme", ["terre", "bruit"], "en") == ["sols", "noise"]
@@ -0,0 +1,81 @@
+from scheduler import Scheduler, Task
+
+
+def build(calls, state_file, fail=(), **kwargs):
+    def func(name):
+        def run():
+            if name in fail:
+                raise RuntimeError(name)
+            calls.append(name)
+        return run
+    tasks = [
+        Task("rules", func("rules")),
+        Task("references", func("references"), inputs=["rules"]),
+        Task("datasets", func("datasets"), inputs=["rules", "references"]),
+        Task("index", func("index"), inputs=["datasets"]),
+    ]
+    return Scheduler(tasks, state_file, **kwargs)
+
+
+def test_runs_tasks_after_their_dependencies(tmp_path):
+    calls = []
+    assert build(calls, str(tmp_path / "state.json")).run()
+    assert calls == ["rules", "references", "datasets", "index"]
+
+
+def test_skips_unchanged_tasks(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    build([], state_file).run()
+    calls = []
+    scheduler = build(calls, state_file)
+    assert scheduler.run()
+    assert calls == []
+    assert {task.status for task in scheduler.tasks.values()} == {"skipped"}
+
+
+def test_force_reruns_every_task(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    build([], state_file).run()
+    calls = []
+    build(calls, state_file, force=True).run()
+    assert sorted(calls) == ["datasets", "index", "references", "rules"]
+
+
+def test_changed_file_reruns_the_task_and_its_dependents(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    csv_file = tmp_path / "references.csv"
+    csv_file.write_text("a\n1\n")
+
+    def tasks(calls):
+        return [
+            Task("rules", lambda: calls.append("rules")),
+            Task("references", lambda: calls.append("references"), files=[str(csv_file)], inputs=["rules"]),
+            Task("datasets", lambda: calls.append("datasets"), inputs=["references"]),
+        ]
+
+    Scheduler(tasks([]), state_file).run()
+    csv_file.write_text("a\n2\n")
+    calls = []
+    Scheduler(tasks(calls), state_file).run()
+    assert calls == ["references", "datasets"]
+
+
+def test_failed_task_blocks_its_dependents(tmp_path):
+    calls = []
+    scheduler = build(calls, str(tmp_path / "state.json"), fail=["references"])
+    assert not scheduler.run()
+    assert calls == ["rules"]
+    assert scheduler.tasks["references"].status == "failed"
+    assert scheduler.tasks["datasets"].status == "blocked"
+    assert scheduler.tasks["index"].status == "blocked"
+
+
+def test_missing_created_path_reruns_the_task(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    back_dir = tmp_path / "back"
+    calls = []
+    task = lambda: Task("codegen", lambda: (calls.append("codegen"), back_dir.mkdir()), creates=[str(back_dir)])
+    Scheduler([task()], state_file).run()
+    back_dir.rmdir()
+    Scheduler([task()], state_file).run()
+    assert calls == ["codegen", "codegen"]
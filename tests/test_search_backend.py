@@ -0,0 +1,98 @@
+import time
+import threading
+
+from search_backend import LocalBackend, LocalIndex
+
+DOCS = {
+    "1": {"title": "qualité de l'air à Paris", "theme": "air"},
+    "2": {"title": "qualité de l'eau potable", "theme": "eau"},
+    "3": {"title": "pollution de l'air et de l'air intérieur", "theme": "air"},
+}
+
+
+def build(directory, **kwargs):
+    backend = LocalBackend(str(directory), **kwargs)
+    backend.create_index("dataset_fr")
+    backend.bulk([{"_index": "dataset_fr", "_id": doc_id, "_source": doc} for doc_id, doc in DOCS.items()])
+    return backend
+
+
+def ids(response):
+    return [hit["_id"] for hit in response["hits"]["hits"]]
+
+
+def test_bm25_ranks_by_term_frequency(tmp_path):
+    backend = build(tmp_path)
+    response = backend.search("dataset_fr", {"match": {"title": "air"}})
+    assert ids(response) == ["3", "1"]
+    assert response["hits"]["total"]["value"] == 2
+    assert backend.facets("dataset_fr", ["theme"]) == {"theme": {"air": 2, "eau": 1}}
+
+
+def test_missing_index_has_no_results(tmp_path):
+    backend = LocalBackend(str(tmp_path))
+    response = backend.search("dataset_en", {"match": {"title": "air"}})
+    assert response["hits"]["total"]["value"] == 0
+    assert response["hits"]["hits"] == []
+    # as services.search_documents calls it
+    response = backend.search("dataset_en", {"multi_match": {"query": "air"}}, {"fields": {"*": {}}})
+    assert response["hits"]["hits"] == []
+    assert backend.count("dataset_en") == 0
+    assert backend.facets("dataset_en", ["theme"]) == {"theme": {}}
+
+
+def test_writes_are_saved_by_batches(tmp_path):
+    backend = build(tmp_path, save_every=2, save_interval=60)
+    filepath = backend.get_filepath("dataset_fr")
+    backend.index("dataset_fr", "4", {"title": "air extérieur", "theme": "air"})
+    # visible at once, not saved yet
+    assert backend.count("dataset_fr") == 4
+    assert len(LocalIndex(filepath).open()) == 3
+    backend.delete("dataset_fr", "2")
+    assert sorted(LocalIndex(filepath).open().docs) == ["1", "3", "4"]
+    assert backend.pending["dataset_fr"] == []
+
+
+def test_refresh_saves_pending_writes(tmp_path):
+    backend = build(tmp_path, save_interval=60)
+    backend.delete("dataset_fr", "1")
+    backend.refresh("dataset_fr")
+    assert sorted(LocalIndex(backend.get_filepath("dataset_fr")).open().docs) == ["2", "3"]
+
+
+def test_concurrent_writers_keep_each_other_writes(tmp_path):
+    first = build(tmp_path, save_interval=60)
+    second = LocalBackend(str(tmp_path), save_interval=60)
+    first.index("dataset_fr", "4", {"title": "bruit", "theme": "bruit"})
+    second.index("dataset_fr", "5", {"title": "sols", "theme": "sols"})
+    first.flush()
+    # second reloads the file saved by first and applies its pending write again
+    second.flush()
+    assert sorted(LocalIndex(first.get_filepath("dataset_fr")).open().docs) == ["1", "2", "3", "4", "5"]
+    assert ids(first.search("dataset_fr", {"match": {"title": "sols"}})) == ["5"]
+
+
+
+def test_writes_wait_for_running_searches(tmp_path, monkeypatch):
+    backend = build(tmp_path, save_every=1)
+    reading = threading.Event()
+    uints = LocalIndex.uints
+
+    def slow_uints(self, location):
+        # the search holds a view of the file mapping while the write is started
+        view = uints(self, location)
+        if not reading.is_set():
+            reading.set()
+            time.sleep(0.2)
+        return view
+
+    monkeypatch.setattr(LocalIndex, "uints", slow_uints)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(backend.search("dataset_fr", {"match": {"title": "air"}})))
+    reader.start()
+    reading.wait()
+    # loading the index for the write closes its file mapping
+    backend.index("dataset_fr", "4", {"title": "air extérieur", "theme": "air"})
+    reader.join()
+    assert ids(results[0]) == ["3", "1"]
+    assert backend.count("dataset_fr") == 4
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from translation_memory import TranslationMemory
+
+
+def memory(tmp_path, **kwargs):
+    return TranslationMemory(str(tmp_path / "cache" / "translations.sqlite"), **kwargs)
+
+
+def last_used(memory, text):
+    return memory.conn.execute("SELECT last_used FROM translations WHERE text=?", (text,)).fetchone()[0]
+
+
+def test_get_normalized_texts(tmp_path):
+    tm = memory(tmp_path)
+    tm.set("qualité  de l'air", "fr_en", "1", "air quality")
+    assert tm.get("qualité de l'air ", "fr_en", "1") == "air quality"
+    assert tm.get("qualité de l'air", "en_fr", "1") is None
+    assert tm.get("qualité de l'air", "fr_en", "2") is None
+    assert (tm.hits, tm.misses) == (1, 2)
+
+
+def test_set_many_and_get_many(tmp_path):
+    tm = memory(tmp_path)
+    tm.set_many({"air": "air", "eau": "water"}, "fr_en", "1")
+    assert tm.get_many(["eau", " eau", "sols"], "fr_en", "1") == {"eau": "water", " eau": "water"}
+    assert tm.count() == 2
+    assert tm.stats()["hit_ratio"] == 0.5
+
+
+def test_last_uses_are_written_by_batches(tmp_path):
+    tm = memory(tmp_path, touch_every=3)
+    tm.set_many({"air": "air", "eau": "water", "sols": "soils"}, "fr_en", "1")
+    stored = last_used(tm, "air")
+    tm.get("air", "fr_en", "1")
+    tm.get_many(["eau"], "fr_en", "1")
+    # no write on a hit
+    assert last_used(tm, "air") == stored
+    tm.get("air", "fr_en", "1")
+    tm.get("sols", "fr_en", "1")
+    assert last_used(tm, "air") > stored
+    assert tm._used == {}
+
+
+def test_evict_least_recently_used(tmp_path):
+    tm = memory(tmp_path, max_entries=10, evict_every=1000)
+    for n in range(12):
+        tm.set(f"texte {n}", "fr_en", "1", f"text {n}")
+    # used since they were stored: the pending uses are written before evicting
+    tm.get_many(["texte 0", "texte 1"], "fr_en", "1")
+    assert tm.evict() == 3
+    assert tm.count() == 9
+    assert tm.get_many(["texte 0", "texte 1", "texte 2"], "fr_en", "1") == {"texte 0": "text 0", "texte 1": "text 1"}
+
+
+def test_export_and_import(tmp_path):
+    tm = memory(tmp_path)
+    tm.set_many({"air": "air", "eau": "water"}, "fr_en", "1")
+    tm.get("eau", "fr_en", "1")
+    filepath = str(tmp_path / "translations.jsonl")
+    assert tm.export_jsonl(filepath) == 2
+    with open(filepath) as f:
+        entries = {entry["text"]: entry for entry in map(json.loads, f)}
+    assert entries["eau"]["last_used"] > entries["air"]["last_used"]
+    other = TranslationMemory(str(tmp_path / "other.sqlite"))
+    assert other.import_jsonl(filepath) == 2
+    assert other.get_many(["air", "eau"], "fr_en", "1") == {"air": "air", "eau": "water"}
+
+
+def test_bad_import_is_rolled_back(tmp_path):
+    tm = memory(tmp_path)
+    filepath = tmp_path / "translations.jsonl"
+    filepath.write_text(json.dumps({"text": "air", "direction": "fr_en", "model_version": "1", "translation": "air"}) + "\n{")
+    with pytest.raises(json.JSONDecodeError):
+        tm.import_jsonl(str(filepath))
+    assert not tm.conn.in_transaction
+    assert tm.count() == 0
+    # the memory is still writable
+    tm.set("eau", "fr_en", "1", "water")
+    assert tm.count() == 1
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# file: translation_memory.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import argparse
+import unicodedata
+
+
+def normalize_text(text):
+    '''normalize text before lookup: unicode NFC and collapsed whitespaces'''
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class TranslationMemory:
+    '''
+    On-disk translation memory keyed by (normalized text, direction, model version)
+    - direction is "fr_en" or "en_fr"
+    - when more than `max_entries` are stored, least recently used entries are evicted
+    (checked every `evict_every` writes)
+    - the last use of the entries found is kept in memory and written by batches
+    of `touch_every` entries, or before an eviction or an export
+    '''
+
+    def __init__(self, path, max_entries=500000, evict_every=1000, touch_every=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.touch_every = touch_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        # (text, direction, model_version) > last use not written yet
+        self._used = {}
+        self._conn = None
+        # the connection is shared by the import pipeline threads
+        self.lock = threading.RLock()
+
+    @property
+    def conn(self):
+        with self.lock:
+            return self.connect()
+
+    def connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS translations (
+                    text TEXT NOT NULL,
+                    direction TEXT NOT NULL,
+                    model_version TEXT NOT NULL,
+                    translation TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (text, direction, model_version)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+            )
+        return self._conn
+
+    def get(self, text, direction, model_version):
+        with self.lock:
+            key = (normalize_text(text), direction, model_version)
+            row = self.conn.execute(
+                "SELECT translation FROM translations WHERE text=? AND direction=? AND model_version=?",
+                key,
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touch([key])
+            return row[0]
+
+    def get_many(self, texts, direction, model_version):
+        '''lookup several texts at once, returns {text: translation} for the ones found'''
+        with self.lock:
+            keys = {}
+            for text in texts:
+                keys.setdefault(normalize_text(text), []).append(text)
+            found = {}
+            normalized = list(keys)
+            # stay below sqlite max number of host parameters
+            for i in range(0, len(normalized), 500):
+                chunk = normalized[i:i+500]
+                rows = self.conn.execute(
+                    "SELECT text, translation FROM translations WHERE direction=? AND model_version=? "
+                    f"AND text IN ({','.join('?' * len(chunk))})",
+                    (direction, model_version, *chunk),
+                ).fetchall()
+                for text, translation in rows:
+                    for original in keys[text]:
+                        found[original] = translation
+                self.touch([(text, direction, model_version) for text, _ in rows])
+                self.hits += len(rows)
+                self.misses += len(chunk) - len(rows)
+            return found
+
+    def touch(self, keys):
+        '''record the use of the entries of keys, written by flush_used'''
+        with self.lock:
+            now = time.time()
+            for key in keys:
+                self._used[key] = now
+            if len(self._used) >= self.touch_every:
+                self.flush_used()
+
+    def flush_used(self):
+        '''write the pending last uses in one transaction'''
+        with self.lock:
+            if len(self._used) == 0:
+                return
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "UPDATE translations SET last_used=? WHERE text=? AND direction=? AND model_version=?",
+                    [(last_used, *key) for key, last_used in self._used.items()],
+                )
+            self._used = {}
+
+    def set_many(self, translations, direction, model_version):
+        '''store {text: translation} in one transaction'''
+        with self.lock:
+            now = time.time()
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (normalize_text(text), direction, model_version, translation, now)
+                        for text, translation in translations.items()
+                    ],
+                )
+            self._writes += len(translations)
+            if self._writes >= self.evict_every:
+                self._writes = 0
+                self.evict()
+
+    def set(self, text, direction, model_version, translation):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                (normalize_text(text), direction, model_version, translation, time.time()),
+            )
+            self._writes += 1
+            if self._writes >= self.evict_every:
+                self._writes = 0
+                self.evict()
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def evict(self):
+        '''drop least recently used entries above max_entries (10% margin to batch deletes)'''
+        with self.lock:
+            count = self.count()
+            if count <= self.max_entries:
+                return 0
+            self.flush_used()
+            to_delete = count - int(self.max_entries * 0.9)
+            self.conn.execute(
+                "DELETE FROM translations WHERE rowid IN "
+                "(SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                (to_delete,),
+            )
+            return to_delete
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self.count(),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0,
+        }
+
+    def clear(self):
+        with self.lock:
+            self._used = {}
+            self.conn.execute("DELETE FROM translations")
+
+    def export_jsonl(self, filepath):
+        '''dump the memory into a jsonl file to ship it to another environment'''
+        self.flush_used()
+        nb = 0
+        with open(filepath, "w") as f:
+            for text, direction, model_version, translation, last_used in self.conn.execute(
+                "SELECT text, direction, model_version, translation, last_used FROM translations"
+            ):
+                f.write(json.dumps({
+                    "text": text,
+                    "direction": direction,
+                    "model_version": model_version,
+                    "translation": translation,
+                    "last_used": last_used,
+                }, ensure_ascii=False) + "\n")
+                nb += 1
+        return nb
+
+    def import_jsonl(self, filepath):
+        '''load a jsonl dump produced by export_jsonl, existing entries are replaced'''
+        with self.lock:
+            nb = 0
+            # a bad line rolls the whole file back
+            with open(filepath, "r") as f, self.conn:
+                self.conn.execute("BEGIN")
+                for line in f:
+                    if line.strip() == "":
+                        continue
+                    entry = json.loads(line)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                        (
+                            normalize_text(entry["text"]),
+                            entry["direction"],
+                            entry["model_version"],
+                            entry["translation"],
+                            entry.get("last_used", time.time()),
+                        ),
+                    )
+                    nb += 1
+            self.evict()
+            return nb
+
+
+parser = argparse.ArgumentParser(description="Manage the translation memory")
+parser.add_argument("action", choices=["stats", "export", "import", "clear"])
+parser.add_argument("filepath", nargs="?", help="jsonl file for export/import")
+
+
+if __name__ == "__main__":
+    from utils import TRANSLATION_MEMORY
+    args = parser.parse_args()
+    if args.action == "stats":
+        print(TRANSLATION_MEMORY.stats())
+    elif args.action == "clear":
+        TRANSLATION_MEMORY.clear()
+        print("Translation memory cleared")
+    elif args.filepath is None:
+        parser.error(f"{args.action} requires a filepath")
+    elif args.action == "export":
+        nb = TRANSLATION_MEMORY.export_jsonl(args.filepath)
+        print(f"Exported {nb} translations into {args.filepath}")
+    else:
+        nb = TRANSLATION_MEMORY.import_jsonl(args.filepath)
+        print(f"Imported {nb} translations from {args.filepath}")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# file: translation_pool.py
+
+import os
+import time
+import argparse
+import itertools
+import multiprocessing
+from csv import DictReader
+from concurrent.futures import ProcessPoolExecutor
+
+from clients import get_translator
+
+
+def init_worker():
+    '''load fr_en and en_fr models once in the worker process'''
+    get_translator("fr")
+    get_translator("en")
+
+
+def translate_texts(texts, _from="fr"):
+    '''translate a list of texts inside a worker'''
+    translator = get_translator(_from)
+    return [translator.translate(text) for text in texts]
+
+
+class TranslationPool:
+    '''
+    Pool of translation processes
+    - each worker loads the argos models once at startup
+    - translate() splits texts into chunks of `chunk_size`, dispatches them
+    to the workers and returns translations in the same order
+    '''
+
+    def __init__(self, workers=None, chunk_size=10):
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+    def translate(self, texts, _from="fr"):
+        chunks = [texts[i:i+self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        results = self.executor.map(translate_texts, chunks, itertools.repeat(_from))
+        return [text for chunk in results for text in chunk]
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def benchmark(csv_file, column, workers_list, _from="fr", chunk_size=10, limit=1000):
+    '''print rows/s translating `column` of csv_file for each number of workers'''
+    with open(csv_file, "r") as f:
+        texts = [row[column] for row in itertools.islice(DictReader(f, delimiter=","), limit)]
+    print(f"Translating {len(texts)} rows of {column} from {csv_file}")
+    for workers in workers_list:
+        with TranslationPool(workers, chunk_size) as pool:
+            # warm up: wait for every worker to load its models
+            pool.translate(["test"] * workers * chunk_size, _from)
+            start = time.perf_counter()
+            pool.translate(texts, _from)
+            elapsed = time.perf_counter() - start
+        print(f"workers: {workers} rows/s: {len(texts) / elapsed:.1f}")
+
+
+parser = argparse.ArgumentParser(description="Benchmark translation workers")
+parser.add_argument("csv_file")
+parser.add_argument("column")
+parser.add_argument("--lang", default="fr")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+parser.add_argument("--chunk-size", type=int, default=10)
+parser.add_argument("--limit", type=int, default=1000)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    benchmark(args.csv_file, args.column, args.workers, args.lang, args.chunk_size, args.limit)
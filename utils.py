@@ -3,163 +3,209 @@
 
 import os
 import datetime
-from pymongo import MongoClient
 from csv import DictReader, DictWriter
 import json
-from argostranslate import package, translate
-
-DATABASE_NAME = "GD4H_V2"
-mongodb_client = MongoClient("mongodb://localhost:27017")
-DB = mongodb_client[DATABASE_NAME]
-
-AVAILABLE_LANG = ["fr","en"]
-SWITCH_LANGS = dict(zip(AVAILABLE_LANG,AVAILABLE_LANG[::-1]))
-
-installed_languages = translate.get_installed_languages()
-fr_en = installed_languages[1].get_translation(installed_languages[0])
-en_fr = installed_languages[0].get_translation(installed_languages[1])
-
-curr_dir = os.path.dirname(os.path.abspath(__file__))
-import os
-from argostranslate import package, translate
-from pymongo import MongoClient
+from contextlib import contextmanager
+from clients import DATABASE_NAME, LazyDatabase
+from clients import get_translator, get_model_version
+from rules_utils import RulesRegistry
+from reference_utils import ReferenceRegistry
+from translation_memory import TranslationMemory
+from translation_pool import TranslationPool
 
 # from rules_utils import (get_rule, get_multiple_fields) 
 # from rules_utils import (get_not_translated_fields, get_fields_to_translate, get_reference_fields, get_reference_name_lang)
 
 
-DATABASE_NAME = "GD4H_V2"
-mongodb_client = MongoClient("mongodb://localhost:27017")
-DB = mongodb_client[DATABASE_NAME]
+# mongo client and argos models are loaded on first use (see clients.py)
+DB = LazyDatabase()
+RULES = RulesRegistry(DB)
+REFERENCES = ReferenceRegistry(DB)
 
 AVAILABLE_LANG = ["fr","en"]
 SWITCH_LANGS = dict(zip(AVAILABLE_LANG,AVAILABLE_LANG[::-1]))
 
-installed_languages = translate.get_installed_languages()
-fr_en = installed_languages[1].get_translation(installed_languages[0])
-en_fr = installed_languages[0].get_translation(installed_languages[1])
-
+curr_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(curr_dir)
 data_dir = os.path.join(parent_dir, "data")
 meta_dir = os.path.join(data_dir, "meta")
 schema_dir = os.path.join(data_dir, "schemas")
+cache_dir = os.path.join(data_dir, "cache")
+
+TRANSLATION_MEMORY = TranslationMemory(os.path.join(cache_dir, "translations.sqlite"))
+# number of csv rows translated together by the importers
+TRANSLATION_CHUNK_SIZE = 200
+# number of translation processes used by the importers (0: translate in process)
+TRANSLATION_WORKERS = 0
+# number of texts sent at once to a translation process
+TRANSLATION_WORKER_CHUNK_SIZE = 10
+TRANSLATION_POOL = None
+
+def chunked(iterable, size=TRANSLATION_CHUNK_SIZE):
+    '''yield lists of at most size items from iterable'''
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
 
 # TRANSLATION
+def start_translation_pool(workers=TRANSLATION_WORKERS, chunk_size=TRANSLATION_WORKER_CHUNK_SIZE):
+    '''send translations to a pool of worker processes until stop_translation_pool()'''
+    global TRANSLATION_POOL
+    if workers > 1 and TRANSLATION_POOL is None:
+        TRANSLATION_POOL = TranslationPool(workers, chunk_size)
+    return TRANSLATION_POOL
+
+def stop_translation_pool():
+    global TRANSLATION_POOL
+    if TRANSLATION_POOL is not None:
+        TRANSLATION_POOL.close()
+        TRANSLATION_POOL = None
+
+@contextmanager
+def translation_pool(workers=TRANSLATION_WORKERS, chunk_size=TRANSLATION_WORKER_CHUNK_SIZE):
+    '''
+    start_translation_pool() for the block, the worker processes are stopped even if it raises
+    and the last uses of the translation memory are written
+    a pool already started by the caller (e.g. pipeline.py) is reused and left running
+    '''
+    started = TRANSLATION_POOL is None
+    pool = start_translation_pool(workers, chunk_size)
+    try:
+        yield pool
+    finally:
+        TRANSLATION_MEMORY.flush_used()
+        if started:
+            stop_translation_pool()
+
+def run_translation_model(texts, _from="fr"):
+    '''run the argos model on a list of texts, in the translation pool if started'''
+    if TRANSLATION_POOL is not None:
+        return TRANSLATION_POOL.translate(texts, _from)
+    translator = get_translator(_from)
+    return [translator.translate(text) for text in texts]
+
+def translate_batch(texts, _from="fr"):
+    '''
+    translate a list of texts and return translations in the same order
+    - empty and non string values are returned as is
+    - each distinct text is looked up once in the translation memory
+    and only the missing ones go through the model
+    '''
+    direction = f"{_from}_{SWITCH_LANGS[_from]}"
+    model_version = get_model_version(direction)
+    unique_texts = list(dict.fromkeys(t for t in texts if isinstance(t, str) and t != ""))
+    if len(unique_texts) == 0:
+        return list(texts)
+    translations = TRANSLATION_MEMORY.get_many(unique_texts, direction, model_version)
+    missing = [t for t in unique_texts if t not in translations]
+    if len(missing) > 0:
+        new_translations = dict(zip(missing, run_translation_model(missing, _from)))
+        TRANSLATION_MEMORY.set_many(new_translations, direction, model_version)
+        translations.update(new_translations)
+    return [translations.get(t, t) if isinstance(t, str) else t for t in texts]
+
 def translate(text, _from="fr"):
-    if _from == "fr":
-        return fr_en.translate(text)
-    else:
-        return en_fr.translate(text)
+    '''translate text, looking up the translation memory first'''
+    return translate_batch([text], _from)[0]
 
 
-def translate_doc(model, doc, _from="fr"):
+def translate_docs(model, docs, _from="fr"):
     '''
+    translate a chunk of docs {"fr": {...}, "en": {...}} in one batch
+    returns the list of translated subdocs in the same order
     _from=fr > en
     _from=en > fr
     '''
-    other_lang = SWITCH_LANGS[_from]
-    _from_doc = doc[_from]
-    to_translate = {}
-    for key, value in _from_doc.items():
-        if key not in DB.rules.distinct("slug"):
-            to_translate[key] = value
-            continue
-        elif key in get_multiple_fields(model):
-            if key in get_not_translated_fields(model):
-                to_translate[key] = value
-            elif key in get_fields_to_translate(model):
-                to_translate[key] = [translate(v,_from) for v in value]
-            else:
-                assert key in get_reference_fields(model), key
-                to_translate[key] = [get_reference_name_translated(key, v, _from) for v in value]
-                
-                
-        else:
-            if key in get_not_translated_fields(model):
+    rules_slugs = RULES.slugs()
+    translated_docs = []
+    # (container, position) where each text to translate goes back
+    slots = []
+    texts = []
+    for doc in docs:
+        to_translate = {}
+        for key, value in doc[_from].items():
+            if key not in rules_slugs or RULES.has_flag(model, key, "not_translated"):
                 to_translate[key] = value
-            elif key in get_fields_to_translate(model):
-                to_translate[key] = [translate(value,_from)]
+            elif RULES.has_flag(model, key, "to_translate"):
+                if RULES.has_flag(model, key, "multiple"):
+                    to_translate[key] = list(value)
+                else:
+                    to_translate[key] = [value]
+                for i, v in enumerate(to_translate[key]):
+                    slots.append((to_translate[key], i))
+                    texts.append(v)
             else:
-                assert key in get_reference_fields(model), key
-                to_translate[key] = get_reference_name_translated(key, value)
-                
+                assert RULES.has_flag(model, key, "reference"), key
+                if RULES.has_flag(model, key, "multiple"):
+                    to_translate[key] = get_reference_names_translated(key, value, _from)
+                else:
+                    to_translate[key] = get_reference_name_translated(key, value, _from)
+        translated_docs.append(to_translate)
+    for (container, i), translated in zip(slots, translate_batch(texts, _from)):
+        container[i] = translated
+    return translated_docs
 
-    return to_translate
+def translate_doc(model, doc, _from="fr"):
+    '''
+    _from=fr > en
+    _from=en > fr
+    '''
+    return translate_docs(model, [doc], _from)[0]
 
 def get_not_translated_fields(model="organization"):
     '''get all fields for given model that are not multilingual'''
-    fields = DB.rules.find({"model": model, "translation": False}, {"slug":1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "not_translated")
 
 def get_fields_to_translate(model="dataset"):
-    fields = DB.rules.find({"model": model, "translation": True, "reference_table":"", "is_controled":False}, {"slug": 1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "to_translate")
 
 def get_translated_fields(model="organization"):
     '''get all fields for given model that are multilingual'''
-    fields = DB.rules.find({"model": model, "translation": True}, {"slug":1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "translated")
 
 def get_reference_name_translated(field, value, _from="fr"):
-    if value != "":
-        other_lang = SWITCH_LANGS[_from]
-        ref = DB["ref_"+field].find_one({f"name_{_from}":value})
-        if ref is not None:
-            return ref[f"name_{other_lang}"]
-    return value
-    # refs = DB.references.find_one({"slug":field, "refs":{"$elemMatch":{f"name_{_from}":value}}},{"refs.$":1, "_id":0})
-    # if refs is not None:
-    #     return refs["refs"][0][f"name_{other_lang}"] 
-    # else:
-    #     return 
-    # ref = DB[f"ref_{field}"].find_one({f"name_{_from}": value})
-    # trad = ref[f"name_{other_lang}"]
-    # print("ref", field, value, trad)
-    # return ref[f"name_{other_lang}"]
+    return REFERENCES.translate_one("ref_"+field, value, _from)
+
+def get_reference_names_translated(field, values, _from="fr"):
+    '''translate a list of controlled values of field in one lookup'''
+    return REFERENCES.translate("ref_"+field, values, _from)
 
 # FIELDS RULES
 def get_rule(model, field_slug):
     '''get rule for given model and given field'''
-    rule = DB.rules.find_one({"model": model, "slug": field_slug})
-    return rule
+    return RULES.get_rule(model, field_slug)
 
 def get_rules(model):
     '''get rule for given model and given field'''
-    return list(DB.rules.find({"model": model},{"_id":0}))
+    return RULES.get_rules(model)
 
 def get_multiple_fields(model="dataset"):
-    fields = DB.rules.find({"model": model, "multiple": True}, {"slug": 1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "multiple")
 
 def get_mandatory_fields(model="organization"):
-    fields = DB.rules.find({"model": model, "mandatory": True}, {"slug":1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "mandatory")
 
 def get_searchable_fields(model):
-    fields = DB.rules.find({"model": model, "$or":[{"indexed": True},{"is_facet": True}]}, {"slug":1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "search")
 
 def get_indexed_fields(model):
-    fields = DB.rules.find({"model": model, "indexed": True}, {"slug":1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "indexed")
 
 def get_facet_fields(model):
-    fields = DB.rules.find({"model": model, "is_facet": True}, {"slug":1})
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "facet")
 
 def get_reference_fields(model):
-    fields = DB.rules.find(
-        {"model": model, "reference_table": {"$ne": ""}}, {"slug": 1}
-    )
-    return [f["slug"] for f in fields]
+    return RULES.fields(model, "reference")
 
 def get_reference_values(model, lang):
     references = {}
     for field in get_reference_fields(model):
-        references[field] = []
-        for x in DB.references.find({"slug": field}):
-            for y in x["refs"]:
-                references[field].append(y[f"name_{lang}"])
+        references[field] = REFERENCES.values("ref_"+field, f"name_{lang}")
     return references
 
 def get_json_type(rule):
@@ -206,7 +252,7 @@ def get_json_ref_type(rule, ref_rule):
             datatype["pattern"] = "^https?://"
         else:
             datatype["type"] = "string"
-        datatype["enum"] = DB[ref_rule["reference_table"]].distinct(rule["slug"])
+        datatype["enum"] = [v for v in REFERENCES.values(ref_rule["reference_table"], rule["slug"]) if v is not None]
         if len(datatype["enum"]) == 0:
             del datatype["enum"]
         return datatype
@@ -224,36 +270,17 @@ def get_json_ref_type(rule, ref_rule):
 
 def is_multilang_model(model_name):
     """define if the model has two langs"""
-    return any(
-        [
-            r["translation"]
-            for r in DB["rules"].find(
-                {"model": model_name}, {"translation": 1, "_id": 0}
-            )
-        ]
-    )
+    return RULES.any_flag(model_name, "translated")
 
 
 def is_search_model(model_name):
     """define if the model has to be searchable"""
-    return any(
-        [
-            r["is_indexed"]
-            for r in DB["rules"].find(
-                {"model": model_name}, {"is_indexed": 1, "_id": 0}
-            )
-        ]
-    )
+    return RULES.any_flag(model_name, "is_indexed")
 
 
 def is_facet_model(model_name):
     """define if the model has to be filtered"""
-    return any(
-        [
-            r["is_facet"]
-            for r in DB["rules"].find({"model": model_name}, {"is_facet": 1, "_id": 0})
-        ]
-    )
+    return RULES.any_flag(model_name, "facet")
 
 if __name__ == "__main__":
     # dataset = DB.datasets.find_one()